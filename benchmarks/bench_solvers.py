@@ -0,0 +1,291 @@
+"""
+Benchmark the solvers over a sweep of sizes and 'never' constraint densities.
+
+Each case runs in its own process, so that a slow case can be stopped at the timeout and the peak memory
+(measured with `tracemalloc`, which also sees NumPy arrays) belongs to that case alone.
+The results are written as JSON. Comparing them with a saved baseline flags the cases that got slower
+or use more memory, and the exit code is 1 if there are any. Cases that timed out in both runs are listed too,
+since they could have gotten slower without anyone noticing.
+
+    python -m benchmarks.bench_solvers --quick --output results.json
+    python -m benchmarks.bench_solvers --quick --compare baseline.json
+"""
+
+import json
+import logging
+import math
+import multiprocessing
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from secret_santa import secret_santa
+from secret_santa.cli_utils import setup_logging
+from secret_santa.stats import SolverStats
+
+# engines that take the 'never' constraints
+CONSTRAINED_ENGINES = [f"hat-{method}" for method in secret_santa.SOLVER_METHODS] + [
+    "search"
+]
+# engines that only make derangements, so they only run without constraints
+SIMPLE_ENGINES = [f"simple-{method}" for method in secret_santa.DERANGEMENT_METHODS]
+ENGINES = CONSTRAINED_ENGINES + SIMPLE_ENGINES
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+QUICK_SIZES = [10, 100, 1_000]
+# fraction of all giver -> receiver pairs that are 'never' constraints. The sparsest ones are the only ones
+# with few enough constraints for the largest sizes, and they are skipped where they would round to no constraints.
+DENSITIES = [0.0, 0.0001, 0.001, 0.01, 0.1, 0.5, 0.9]
+# each size also runs with only this many more than ln(n) allowed receivers per giver (see `threshold_density`)
+THRESHOLD_MARGIN = 3
+# skip cases with more 'never' constraints than this, which would take too long just to generate
+MAX_NEVER_CONSTRAINTS = 2_000_000
+# seconds before a case is stopped
+DEFAULT_TIMEOUT = 60.0
+# a case regressed if it is this much slower (or uses this much more memory) than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and slower by at least this many seconds, which is above the noise of small cases
+MIN_REGRESSION_SECONDS = 0.01
+
+
+class Case(NamedTuple):
+    engine: str
+    n: int
+    density: float
+
+
+def _never_constraints(
+    names: list[str], density: float, rng: random.Random
+) -> list[list[str]]:
+    n = len(names)
+    k = round(density * (n - 1))
+    constraints = []
+    for g, giver in enumerate(names):
+        for r in rng.sample(range(n - 1), k):
+            # skip the giver themselves
+            constraints.append([giver, names[r + (r >= g)]])
+    return constraints
+
+
+def threshold_density(n: int) -> float:
+    """
+    The density that leaves each giver ln(n) + THRESHOLD_MARGIN allowed receivers (rounded up).
+    Random constraints have no valid assignment once some receiver is allowed for nobody, which happens
+    below about ln(n) allowed receivers per giver. With the margin, there is still one with probability
+    about exp(-exp(-THRESHOLD_MARGIN)), which is 95%.
+    """
+    allowed = min(n - 1, math.ceil(math.log(n)) + THRESHOLD_MARGIN)
+    return 1 - allowed / (n - 1)
+
+
+def run_case(case: Case, random_seed: int = 0) -> dict:
+    """Run one case in this process. The peak memory includes the inputs."""
+    rng = random.Random(random_seed)
+    tracemalloc.start()
+    names = [f"Person {i}" for i in range(case.n)]
+    never_constraints = _never_constraints(names, case.density, rng)
+    stats = SolverStats()
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        if case.engine.startswith("hat-"):
+            secret_santa.secret_santa_hat(
+                names,
+                random_seed,
+                never_constraints=never_constraints,
+                method=case.engine.removeprefix("hat-"),
+                stats=stats,
+            )
+        elif case.engine == "search":
+            givers = names[:]
+            receivers = names[:]
+            rng.shuffle(givers)
+            rng.shuffle(receivers)
+            if not secret_santa.secret_santa_search(
+                {}, givers, receivers, never_constraints
+            ):
+                status = "failed"
+        else:
+            secret_santa.secret_santa_hat_simple(
+                names, method=case.engine.removeprefix("simple-"), rng=rng
+            )
+    except SystemExit:
+        # the solvers exit when there is no valid assignment or they give up
+        status = "failed"
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        **case._asdict(),
+        "num_never": len(never_constraints),
+        "status": status,
+        "seconds": seconds,
+        "peak_memory_bytes": peak,
+        "attempts": stats.attempts if case.engine.startswith("hat-") else None,
+    }
+
+
+def _run_in_child(case: Case, random_seed: int, conn) -> None:
+    # keep the solvers' critical messages, but not every debug line
+    logging.getLogger().setLevel(logging.CRITICAL)
+    conn.send(run_case(case, random_seed))
+    conn.close()
+
+
+def run_isolated(case: Case, random_seed: int, timeout: float) -> dict:
+    """Run one case in a new process, and stop it after `timeout` seconds"""
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_run_in_child, args=(case, random_seed, child_conn)
+    )
+    process.start()
+    if parent_conn.poll(timeout):
+        result = parent_conn.recv()
+        process.join()
+        return result
+    process.terminate()
+    process.join()
+    return {
+        **case._asdict(),
+        "status": "timeout",
+        "seconds": timeout,
+        "peak_memory_bytes": None,
+        "attempts": None,
+    }
+
+
+def cases(sizes: list[int], densities: list[float], engines: list[str]) -> list[Case]:
+    """
+    The cases of the sweep, with the threshold density of each size after `densities`.
+    It leaves out the ones that cannot run and densities that round to no constraints.
+    """
+    result = []
+    for n in sizes:
+        for density in densities + [threshold_density(n)]:
+            if density * n * (n - 1) > MAX_NEVER_CONSTRAINTS:
+                continue
+            if density > 0 and round(density * (n - 1)) == 0:
+                continue
+            for engine in engines:
+                if engine in SIMPLE_ENGINES and density > 0:
+                    continue
+                result.append(Case(engine, n, density))
+    return result
+
+
+def compare(
+    results: list[dict], baseline: list[dict], tolerance: float = DEFAULT_TOLERANCE
+) -> list[str]:
+    """:returns: A description of each case that regressed from the baseline"""
+    previous = {(r["engine"], r["n"], r["density"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        case = f"{result['engine']} n={result['n']} density={result['density']}"
+        before = previous.get((result["engine"], result["n"], result["density"]))
+        if before is None:
+            continue
+        if before["status"] == "ok" and result["status"] != "ok":
+            regressions.append(f"{case}: {result['status']} (was ok)")
+            continue
+        if result["status"] != "ok":
+            continue
+        slower = result["seconds"] - before["seconds"]
+        if (
+            result["seconds"] > before["seconds"] * (1 + tolerance)
+            and slower > MIN_REGRESSION_SECONDS
+        ):
+            regressions.append(
+                f"{case}: {result['seconds']:.3f}s (was {before['seconds']:.3f}s)"
+            )
+        if before["peak_memory_bytes"] and result["peak_memory_bytes"] > before[
+            "peak_memory_bytes"
+        ] * (1 + tolerance):
+            regressions.append(
+                f"{case}: peak memory {result['peak_memory_bytes']} bytes (was {before['peak_memory_bytes']})"
+            )
+    return regressions
+
+
+def persistent_timeouts(results: list[dict], baseline: list[dict]) -> list[str]:
+    """:returns: A description of each case that timed out both in the baseline and now"""
+    previous = {(r["engine"], r["n"], r["density"]): r for r in baseline}
+    timeouts = []
+    for result in results:
+        before = previous.get((result["engine"], result["n"], result["density"]))
+        if (
+            before is not None
+            and before["status"] == "timeout"
+            and result["status"] == "timeout"
+        ):
+            timeouts.append(
+                f"{result['engine']} n={result['n']} density={result['density']}"
+            )
+    return timeouts
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark the solvers")
+    parser.add_argument(
+        "--quick", action="store_true", help=f"Only sizes {QUICK_SIZES}"
+    )
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument(
+        "--output", default=None, help="Write the results to this JSON file"
+    )
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="Flag regressions against the results in this JSON file",
+    )
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("-s", "--random-seed", type=int, default=0)
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose output for debugging"
+    )
+    args = parser.parse_args()
+    setup_logging(args.verbose)
+
+    results = []
+    for case in cases(QUICK_SIZES if args.quick else SIZES, DENSITIES, args.engines):
+        result = run_isolated(case, args.random_seed, args.timeout)
+        logging.info(
+            "%s n=%d density=%s: %s in %.3fs, peak memory %s bytes",
+            case.engine,
+            case.n,
+            case.density,
+            result["status"],
+            result["seconds"],
+            result["peak_memory_bytes"],
+        )
+        results.append(result)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4)
+        logging.info("Saved %d results to %s", len(results), args.output)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        for timeout in persistent_timeouts(results, baseline):
+            print(f"STILL TIMEOUT {timeout}: timed out in the baseline too")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,33 @@
 from .crypto_utils import get_random_key
 from .gmail import Mailer
-from .secret_santa import secret_santa_hat, secret_santa_search, secret_santa_hat_simple
+from .secret_santa import (
+    count_assignments,
+    history_penalties,
+    repair_pairings,
+    secret_santa_hat,
+    secret_santa_hat_multi,
+    secret_santa_hat_soft,
+    secret_santa_hat_simple,
+    secret_santa_matching,
+    secret_santa_search,
+)
+from .stats import SolverStats
+from .validation import validate_pairings, validate_pairings_file
 
 
 __all__ = [
     "get_random_key",
     "Mailer",
+    "SolverStats",
+    "count_assignments",
+    "history_penalties",
+    "repair_pairings",
     "secret_santa_hat",
+    "secret_santa_hat_multi",
+    "secret_santa_hat_soft",
     "secret_santa_hat_simple",
+    "secret_santa_matching",
     "secret_santa_search",
+    "validate_pairings",
+    "validate_pairings_file",
 ]
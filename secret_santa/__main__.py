@@ -16,8 +16,14 @@ from .encryption_api import (
     encrypt_pairings,
     sanity_check_encrypted_pairings,
 )
-from .secret_santa import create_pairings_from_file, read_people
+from .secret_santa import (
+    create_pairings_from_file,
+    read_constraints,
+    read_groups,
+    read_people,
+)
 from .sms_utils import send_all_sms_messages, create_text_messages
+from .validation import check_problems, validate_pairings_file
 
 
 DATA_OUTPUT_DIR = os.path.normpath(
@@ -59,6 +65,7 @@ def main(
     random_seed: Optional[int],
     encrypted_pairings_fname: Optional[str],
     channel: Optional[str],
+    cache_fname: Optional[str] = None,
 ) -> None:
     """
     Create a new set of Secret Santa pairings and send them out.
@@ -74,7 +81,9 @@ def main(
             "No encrypted pairings file specified, creating pairings from file %s",
             people_fname,
         )
-        pairings = create_pairings_from_file(people_fname, random_seed=random_seed)
+        pairings = create_pairings_from_file(
+            people_fname, random_seed=random_seed, cache_fname=cache_fname
+        )
         if not live:
             logging.warning("Not sending emails since this is a dry run.")
             print("Pairings:")
@@ -262,7 +271,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--sanity-check",
         action="store_true",
-        help="Checks saved encrypted pairings to verify that the pairings were valid",
+        help="Checks saved encrypted pairings (or unencrypted pairings, if there are none) to verify that the pairings were valid",
     )
     parser.add_argument(
         "--sanity-check-emails",
@@ -287,6 +296,11 @@ if __name__ == "__main__":
         default=None,
         help="Reuse previous encrypted pairings as specified by this file",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="With --random-seed, solve again instead of reusing the pairings of an earlier run with the same inputs",
+    )
     parser.add_argument(
         "--channel",
         default=None,
@@ -310,12 +324,28 @@ if __name__ == "__main__":
         )
     elif args.sanity_check:
         people = read_people(args.people_file)
-        sanity_check_encrypted_pairings(
-            data_dir=args.output_dir,
-            names=list(people.keys()),
-        )
+        constraints = read_constraints(args.people_file)
+        if os.path.exists(os.path.join(args.output_dir, "encrypted_pairings.json")):
+            sanity_check_encrypted_pairings(
+                data_dir=args.output_dir,
+                names=list(people.keys()),
+                always_constraints=constraints.get("always"),
+                never_constraints=constraints.get("never"),
+                groups=read_groups(people),
+            )
+        else:
+            check_problems(
+                validate_pairings_file(
+                    os.path.join(args.output_dir, "unencrypted_pairings.json"),
+                    names=people.keys(),
+                    always_constraints=constraints.get("always"),
+                    never_constraints=constraints.get("never"),
+                    groups=read_groups(people),
+                )
+            )
     elif args.sanity_check_emails:
         people = read_people(args.people_file)
+        constraints = read_constraints(args.people_file)
         emails: dict[str, str] = {}
         for name, item in people.items():
             assert "email" in item and isinstance(item["email"], str)
@@ -323,6 +353,9 @@ if __name__ == "__main__":
         sanity_check_emails(
             data_dir=args.output_dir,
             emails=emails,
+            always_constraints=constraints.get("always"),
+            never_constraints=constraints.get("never"),
+            groups=read_groups(people),
         )
     else:
         main(
@@ -337,4 +370,7 @@ if __name__ == "__main__":
             random_seed=args.random_seed,
             encrypted_pairings_fname=args.encrypted_pairings,
             channel=args.channel,
+            cache_fname=None
+            if args.no_cache
+            else os.path.join(args.output_dir, "pairings_cache.db"),
         )
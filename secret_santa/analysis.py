@@ -0,0 +1,299 @@
+"""
+Monte Carlo check that a sampler draws valid assignments uniformly.
+
+If every valid assignment is equally likely, giver g gives to receiver r with probability
+(number of valid assignments with g -> r) / (number of valid assignments). We draw many assignments,
+count how often each giver -> receiver pair comes up, and compare the counts with those probabilities.
+For a problem that is small enough to enumerate (or has no constraints at all), the probabilities are exact.
+Otherwise we compare with the same number of draws from the vectorized rejection sampler,
+which is uniform by construction.
+
+The draws are split into chunks of a fixed size, and chunk i is always seeded from the seed and i,
+so the counts do not depend on the number of worker processes. Each chunk is folded into an n x n
+count matrix as soon as it is drawn, so memory does not grow with the number of draws.
+"""
+
+import concurrent.futures
+import itertools
+import math
+import os
+import random
+from argparse import ArgumentParser
+from collections.abc import Sequence, Set
+from typing import NamedTuple
+
+import numpy as np
+
+from . import vectorized
+from .cli_utils import setup_logging
+from .matching import random_perfect_matching
+from .model import PairingProblem
+from .search import shuffled_search, stream_rng
+from .secret_santa import (
+    get_derangement,
+    get_uniform_derangement,
+    read_constraints,
+    read_groups,
+    read_people,
+)
+
+SAMPLERS = ["matching", "search", "vectorized", "derangement", "rejection"]
+# draws per chunk of work
+CHUNK_SIZE = 10_000
+# enumerate every assignment of problems up to this size to get the exact probabilities
+MAX_EXACT_SIZE = 9
+
+
+class UniformityReport(NamedTuple):
+    num_samples: int
+    # "exact" if the sampler was compared with the exact probabilities, otherwise "vectorized"
+    reference: str
+    chi_square: float
+    degrees_of_freedom: int
+    # probability of a chi-square at least this large if the sampler is uniform
+    p_value: float
+    # largest deviation of a single pair from the reference, in standard errors
+    max_z: float
+    # (giver, receiver) of that pair: free positions, or names from `analyze_uniformity`
+    worst_pair: tuple
+
+
+def _is_derangement_problem(forbidden: Sequence[Set[int]]) -> bool:
+    return all(excluded == {g} for g, excluded in enumerate(forbidden))
+
+
+def _draw_chunk(
+    forbidden: Sequence[Set[int]], sampler: str, num_samples: int, seed: int
+) -> np.ndarray:
+    """:returns: Int array of shape (num_samples, n) where row i is the receiver of each giver in draw i"""
+    n = len(forbidden)
+    rng = random.Random(seed)
+    if sampler == "vectorized":
+        matrix = np.zeros((n, n), dtype=bool)
+        for g, excluded in enumerate(forbidden):
+            matrix[g, list(excluded)] = True
+        samples = vectorized.sample_assignments(
+            matrix, num_samples, np.random.default_rng(seed), max_batches=1 << 20
+        )
+        assert len(samples) == num_samples
+        return samples
+
+    identity = list(range(n))
+    samples = np.empty((num_samples, n), dtype=np.int64)
+    for i in range(num_samples):
+        if sampler == "matching":
+            result = random_perfect_matching(forbidden, rng)
+        elif sampler == "search":
+            result = shuffled_search(forbidden, rng)
+        elif sampler == "derangement":
+            result = get_uniform_derangement(identity, rng)
+        else:
+            result = get_derangement(identity, rng)
+        assert result is not None, "There is no valid assignment"
+        samples[i] = result
+    return samples
+
+
+def _count_chunk(
+    forbidden: Sequence[Set[int]], sampler: str, num_samples: int, seed: int
+) -> np.ndarray:
+    n = len(forbidden)
+    samples = _draw_chunk(forbidden, sampler, num_samples, seed)
+    # flat index of each giver -> receiver pair in the n x n matrix
+    flat = (np.arange(n) * n + samples).ravel()
+    return np.bincount(flat, minlength=n * n).reshape(n, n)
+
+
+def pair_counts(
+    forbidden: Sequence[Set[int]],
+    sampler: str,
+    num_samples: int,
+    random_seed: int,
+    workers: int = 1,
+) -> np.ndarray:
+    """
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not give to
+    :param sampler: One of `SAMPLERS`. "derangement" and "rejection" are the two methods of `secret_santa_hat_simple`
+        and only apply when nobody is excluded but the giver themselves.
+    :param workers: Draw the chunks in a process pool of this size. The counts do not depend on it.
+    :returns: Int array of shape (n, n) where entry (g, r) is the number of draws in which g gave to r
+    """
+    assert sampler in SAMPLERS, f"sampler must be one of {SAMPLERS}"
+    if sampler in ("derangement", "rejection"):
+        assert _is_derangement_problem(forbidden), (
+            f"sampler {sampler} does not support constraints"
+        )
+    n = len(forbidden)
+    sizes = [CHUNK_SIZE] * (num_samples // CHUNK_SIZE)
+    if num_samples % CHUNK_SIZE:
+        sizes.append(num_samples % CHUNK_SIZE)
+    seeds = [stream_rng(random_seed, i).getrandbits(63) for i in range(len(sizes))]
+    counts = np.zeros((n, n), dtype=np.int64)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in pool.map(
+                _count_chunk,
+                itertools.repeat(forbidden),
+                itertools.repeat(sampler),
+                sizes,
+                seeds,
+            ):
+                counts += chunk
+    else:
+        for size, seed in zip(sizes, seeds):
+            counts += _count_chunk(forbidden, sampler, size, seed)
+    return counts
+
+
+def exact_probabilities(forbidden: Sequence[Set[int]]) -> np.ndarray | None:
+    """
+    :returns: Float array of shape (n, n) where entry (g, r) is the fraction of valid assignments in which g gives to r.
+        None if the problem is too large to enumerate and has constraints.
+    """
+    n = len(forbidden)
+    if _is_derangement_problem(forbidden) and n > 1:
+        probabilities = np.full((n, n), 1 / (n - 1))
+        np.fill_diagonal(probabilities, 0.0)
+        return probabilities
+    if n > MAX_EXACT_SIZE:
+        return None
+    counts = np.zeros((n, n), dtype=np.int64)
+    for perm in itertools.permutations(range(n)):
+        if all(r not in excluded for r, excluded in zip(perm, forbidden)):
+            counts[np.arange(n), perm] += 1
+    total = counts[0].sum() if n else 0
+    assert total > 0, "There is no valid assignment"
+    return counts / total
+
+
+def _chi_square_p_value(chi_square: float, df: int) -> float:
+    """Upper tail of the chi-square distribution, with the Wilson-Hilferty normal approximation"""
+    if df <= 0:
+        return 1.0
+    h = 2 / (9 * df)
+    z = ((chi_square / df) ** (1 / 3) - (1 - h)) / math.sqrt(h)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def uniformity_report(
+    forbidden: Sequence[Set[int]],
+    sampler: str,
+    num_samples: int,
+    random_seed: int = 0,
+    workers: int = 1,
+) -> UniformityReport:
+    """
+    Draw `num_samples` assignments with `sampler` (see `pair_counts`) and test them against the uniform distribution.
+    The chi-square test is per giver: each giver's counts are a multinomial over the receivers it may give to.
+    """
+    counts = pair_counts(forbidden, sampler, num_samples, random_seed, workers)
+    probabilities = exact_probabilities(forbidden)
+    if probabilities is not None:
+        reference = "exact"
+        expected = probabilities * num_samples
+        # pairs that are always or never drawn carry no information
+        informative = (probabilities > 0) & (probabilities < 1)
+        variance = expected * (1 - probabilities)
+        deviation = counts - expected
+    else:
+        reference = "vectorized"
+        # two-sample test with a different seed for the reference draws
+        other = pair_counts(forbidden, "vectorized", num_samples, ~random_seed, workers)
+        informative = (counts + other) > 0
+        variance = (counts + other).astype(float)
+        expected = variance
+        deviation = counts - other
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cells = np.where(informative, deviation**2 / expected, 0.0)
+        z = np.where(informative, np.abs(deviation) / np.sqrt(variance), 0.0)
+    free_per_giver = informative.sum(axis=1)
+    df = int(np.maximum(free_per_giver - 1, 0).sum())
+    chi_square = float(cells.sum())
+    worst = np.unravel_index(int(np.argmax(z)), z.shape)
+    return UniformityReport(
+        num_samples=num_samples,
+        reference=reference,
+        chi_square=chi_square,
+        degrees_of_freedom=df,
+        p_value=_chi_square_p_value(chi_square, df),
+        max_z=float(z[worst]),
+        worst_pair=(int(worst[0]), int(worst[1])),
+    )
+
+
+def analyze_uniformity(
+    names: list[str],
+    sampler: str = "matching",
+    num_samples: int = 100_000,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+    random_seed: int = 0,
+    workers: int = 1,
+) -> UniformityReport:
+    """
+    Check whether `sampler` draws the valid assignments of these participants uniformly. See `uniformity_report`.
+    The 'always' pairs are fixed, so only the rest of the assignment is tested.
+    """
+    problem = PairingProblem.from_names(
+        names, always_constraints, never_constraints, groups
+    )
+    report = uniformity_report(
+        problem.forbidden_sets(), sampler, num_samples, random_seed, workers
+    )
+    g, r = report.worst_pair
+    table = problem.table
+    return report._replace(
+        worst_pair=(table.name(problem.givers[g]), table.name(problem.receivers[r]))
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Check whether a sampler draws valid assignments uniformly"
+    )
+    parser.add_argument(
+        "--people-file",
+        default=None,
+        help="Names and constraints to test with. By default, --num-people people without constraints",
+    )
+    parser.add_argument("--num-people", type=int, default=8)
+    parser.add_argument("--sampler", choices=SAMPLERS, default="matching")
+    parser.add_argument("--num-samples", type=int, default=1_000_000)
+    parser.add_argument("-s", "--random-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.process_cpu_count() or 1)
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose output for debugging"
+    )
+    args = parser.parse_args()
+    setup_logging(args.verbose)
+
+    always_constraints = None
+    never_constraints = None
+    groups = None
+    if args.people_file:
+        people = read_people(args.people_file)
+        constraints = read_constraints(args.people_file)
+        names = list(people.keys())
+        always_constraints = constraints.get("always")
+        never_constraints = constraints.get("never")
+        groups = read_groups(people)
+    else:
+        names = [f"Person {i}" for i in range(args.num_people)]
+    report = analyze_uniformity(
+        names,
+        args.sampler,
+        args.num_samples,
+        always_constraints,
+        never_constraints,
+        groups,
+        args.random_seed,
+        args.workers,
+    )
+    print(f"samples: {report.num_samples} (compared with {report.reference})")
+    print(
+        f"chi-square: {report.chi_square:.1f} on {report.degrees_of_freedom} degrees of freedom, p = {report.p_value:.3g}"
+    )
+    print(
+        f"largest deviation: {report.max_z:.1f} standard errors at {report.worst_pair}"
+    )
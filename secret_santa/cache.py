@@ -0,0 +1,121 @@
+"""
+Persistent cache of solved pairings, so that running again with the same inputs does not solve again.
+
+Entries are addressed by a SHA-256 hash of everything the result depends on: the names in order,
+the constraints, the groups, the random seed, the solver options and `SOLVER_VERSION`.
+The same key means the same run, so logging it lets us confirm that a run reproduced an earlier one.
+Solves with penalties (e.g. from history) are not cached: the min-cost solver stops at a time budget,
+so its result also depends on how fast the machine is, which no key can capture.
+Entries live in a table of the campaign database (or any SQLite file) and the least recently used ones are evicted.
+"""
+
+import hashlib
+import json
+import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.orm import Session
+
+from .db_models import CachedPairings
+
+# change this whenever the solver may return different pairings for the same inputs and seed
+SOLVER_VERSION = 2
+# keep at most this many entries
+DEFAULT_MAX_ENTRIES = 256
+
+
+def _normalized_pairs(pairs: list[list] | None) -> list[tuple[str, str]]:
+    """The order of the constraints does not change the result, so sort them and drop duplicates"""
+    return sorted({(giver, receiver) for giver, receiver in pairs or []})
+
+
+def cache_key(
+    names: list[str],
+    random_seed: int,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+    **options: Any,
+) -> str:
+    """
+    :param names: In the order given to the solver, which matters for the result
+    :param options: Any other argument of the solver that changes the result, e.g. `num_gifts`. Must be JSON serializable.
+    :returns: The hex digest that identifies this run
+    """
+    document = {
+        "solver_version": SOLVER_VERSION,
+        "names": names,
+        "always": _normalized_pairs(always_constraints),
+        "never": _normalized_pairs(never_constraints),
+        "groups": groups or {},
+        "random_seed": random_seed,
+        "options": options,
+    }
+    encoded = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def open_cache(fname: str) -> Iterator[Session]:
+    """
+    Open (and create if needed) a cache that lives in its own SQLite file.
+    The session is closed and the engine's connections are released on exit.
+    """
+    engine = create_engine(f"sqlite:///{fname}", future=True)
+    try:
+        CachedPairings.metadata.create_all(
+            bind=engine,
+            tables=[CachedPairings.__table__],  # type: ignore[list-item]
+        )
+        with Session(bind=engine, autoflush=False, future=True) as db_session:
+            yield db_session
+    finally:
+        engine.dispose()
+
+
+def _next_use(db_session: Session) -> int:
+    # a counter rather than a timestamp, so that the order of uses is exact
+    last = db_session.execute(select(func.max(CachedPairings.last_used))).scalar()
+    return (last or 0) + 1
+
+
+def get_cached_pairings(db_session: Session, key: str) -> Any | None:
+    """:returns: The pairings saved under `key`, or None if there are none"""
+    entry = db_session.get(CachedPairings, key)
+    if entry is None:
+        logging.debug("No cached pairings for key %s", key)
+        return None
+    entry.last_used = _next_use(db_session)
+    db_session.commit()
+    logging.info("Using cached pairings for key %s", key)
+    return json.loads(entry.pairings)
+
+
+def save_cached_pairings(
+    db_session: Session,
+    key: str,
+    pairings: Any,
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+) -> None:
+    """
+    Save the pairings under `key`, then evict the least recently used entries beyond `max_entries`
+    :param pairings: Must be JSON serializable
+    """
+    assert max_entries >= 1
+    db_session.merge(
+        CachedPairings(
+            key=key, pairings=json.dumps(pairings), last_used=_next_use(db_session)
+        )
+    )
+    db_session.flush()
+    stale = (
+        select(CachedPairings.key)
+        .order_by(CachedPairings.last_used.desc())
+        .offset(max_entries)
+    )
+    db_session.execute(delete(CachedPairings).where(CachedPairings.key.in_(stale)))
+    db_session.commit()
+    logging.debug("Saved pairings for key %s", key)
@@ -1,36 +1,70 @@
+import atexit
 import random
 import logging
 import os
 import sys
 
-from sqlalchemy import create_engine, select, exists, delete
+from sqlalchemy import create_engine, select, exists, delete, insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, sessionmaker
 
 from . import cli_utils
 from . import email_utils
 from . import file_utils
+from .cache import cache_key, get_cached_pairings, save_cached_pairings
 import secret_santa
-from .db_models import Base, Campaign, Participant, Constraint, ConstraintType, Pairing
+from .db_models import (
+    Campaign,
+    Participant,
+    Constraint,
+    ConstraintType,
+    Pairing,
+    upgrade_schema,
+)
 
 DEFAULT_DATA_DIR = "data"
 
 
+# one session factory (and so one engine and connection pool) per database file for the life of the process
+_session_factories: dict[str, sessionmaker[Session]] = {}
+
+
 def _create_db_session(data_dir: str) -> Session:
     """
+    The schema of each database is upgraded the first time a session is created for it.
     NOTE: `data_dir` must be an absolute path
     """
     assert data_dir.startswith("/"), "Data dir must be an absolute path"
 
-    sqlalchemy_database_uri = f"sqlite:///{data_dir}/secret_santa.db"
-    logging.debug("Connecting to database: %s", sqlalchemy_database_uri)
-    engine = create_engine(sqlalchemy_database_uri, future=True)
-    SessionLocal = sessionmaker(
-        bind=engine, autocommit=False, autoflush=False, future=True
-    )
+    db_path = os.path.normpath(os.path.join(data_dir, "secret_santa.db"))
+    SessionLocal = _session_factories.get(db_path)
+    if SessionLocal is None:
+        sqlalchemy_database_uri = f"sqlite:///{db_path}"
+        logging.debug("Connecting to database: %s", sqlalchemy_database_uri)
+        engine = create_engine(sqlalchemy_database_uri, future=True)
+        SessionLocal = sessionmaker(
+            bind=engine, autocommit=False, autoflush=False, future=True
+        )
+        with SessionLocal() as db_session:
+            upgrade_schema(db_session)
+        _session_factories[db_path] = SessionLocal
     return SessionLocal()
 
 
+def _dispose_db_engines() -> None:
+    """
+    Close the pooled connections of every database, e.g. before its file is moved or deleted.
+    This runs when the process exits.
+    """
+    for SessionLocal in _session_factories.values():
+        engine = SessionLocal.kw["bind"]
+        engine.dispose()
+    _session_factories.clear()
+
+
+atexit.register(_dispose_db_engines)
+
+
 def _rationalize_data_dir(data_dir: str | None) -> str:
     if data_dir is None:
         data_dir = os.path.abspath(DEFAULT_DATA_DIR)
@@ -51,7 +85,6 @@ def create_campaign(name: str, data_dir: str | None = None) -> None:
     assert len(name) > 0
     data_dir = _rationalize_data_dir(data_dir)
     db_session = _create_db_session(data_dir)
-    Base.metadata.create_all(bind=db_session.get_bind())
 
     try:
         campaign = Campaign(name=name)
@@ -74,81 +107,141 @@ def _get_campaign_or_fail(db_session: Session, campaign_name: str) -> Campaign:
 def load_participants_from_json(
     path: str, campaign_name: str, data_dir: str | None = None
 ) -> None:
-    """Read a JSON file of participants and load it into the DB for a given campaign."""
+    """
+    Read a JSON file of participants and load it into the DB for a given campaign.
+    They are inserted in bulk in one transaction. Participants whose name or email is already in the campaign
+    are reported and skipped, and the rest are still loaded.
+    """
 
     d = file_utils.read_participants_json(path)
     data_dir = _rationalize_data_dir(data_dir)
     db_session = _create_db_session(data_dir)
-    Base.metadata.create_all(bind=db_session.get_bind())
 
     # find the campaign
     campaign = _get_campaign_or_fail(db_session, campaign_name)
 
+    existing = db_session.execute(
+        select(Participant.name, Participant.email).where(
+            Participant.campaign_id == campaign.id
+        )
+    ).all()
+    names = {name for name, _ in existing}
+    emails = {email for _, email in existing if email is not None}
+    rows = []
+    for name, p_obj in d.items():
+        email = p_obj.get("email")
+        if name in names:
+            logging.error("Participant %s has already been added", name)
+            continue
+        if email is not None and email in emails:
+            logging.error("Email %s of participant %s is already taken", email, name)
+            continue
+        names.add(name)
+        if email is not None:
+            emails.add(email)
+        rows.append(
+            {
+                "name": p_obj["name"],
+                "email": email,
+                "text": p_obj.get("text"),
+                "is_verified": p_obj.get("is_verified"),
+                "group_name": p_obj.get("group"),
+                "campaign_id": campaign.id,
+            }
+        )
+
     try:
-        for name, p_obj in d.items():
-            p = Participant(
-                name=p_obj["name"],
-                email=p_obj.get("email"),
-                text=p_obj.get("text"),
-                is_verified=p_obj.get("is_verified"),
-                campaign_id=campaign.id,
-            )
-            db_session.add(p)
+        if rows:
+            db_session.execute(insert(Participant), rows)
         db_session.commit()
-        logging.info("Loaded %d participants into campaign %d", len(d), campaign.id)
-    except IntegrityError:
+        logging.info(
+            "Loaded %d participants into campaign %s", len(rows), campaign_name
+        )
+    except IntegrityError as err:
+        # only if the campaign changed since the participants were read
         db_session.rollback()
-        logging.error("Some of these participants have already been added")
+        logging.error("Some of these participants have already been added: %s", err)
 
 
 def load_constraints_from_json(
     campaign_name: str, path: str, data_dir: str | None = None, verbose: bool = False
 ) -> None:
+    """
+    Read a JSON file of constraints and load them into the DB for a given campaign.
+    The participant names are resolved with one query, and the constraints are inserted in bulk in one transaction.
+    Constraints that were already added or that name unknown participants are reported and skipped.
+    """
     if verbose:
         cli_utils.setup_logging(verbose=True)
 
     d = file_utils.read_constraints_json(path)
     data_dir = _rationalize_data_dir(data_dir)
     db_session = _create_db_session(data_dir)
-    Base.metadata.create_all(bind=db_session.get_bind())
 
     # find the campaign
     campaign = _get_campaign_or_fail(db_session, campaign_name)
 
-    try:
-        n = 0
-        for t in ["always", "never"]:
-            l = d.get(t, [])
-            for giver_name, receiver_name in l:
-                logging.debug(
-                    "Adding a %s constraint from %s -> %s", t, giver_name, receiver_name
+    p_map_r: dict[str, int] = {
+        name: p_id
+        for p_id, name in db_session.execute(
+            select(Participant.id, Participant.name).where(
+                Participant.campaign_id == campaign.id
+            )
+        )
+    }
+    existing: set[tuple[str, int, int]] = {
+        (t, giver_id, receiver_id)
+        for t, giver_id, receiver_id in db_session.execute(
+            select(Constraint.type, Constraint.giver_id, Constraint.receiver_id).where(
+                Constraint.campaign_id == campaign.id
+            )
+        )
+    }
+    rows = []
+    for t in ["always", "never"]:
+        l = d.get(t, [])
+        for giver_name, receiver_name in l:
+            logging.debug(
+                "Adding a %s constraint from %s -> %s", t, giver_name, receiver_name
+            )
+            unknown = [
+                name for name in (giver_name, receiver_name) if name not in p_map_r
+            ]
+            if unknown:
+                logging.error(
+                    "Skipping %s constraint %s -> %s: no participant named %s",
+                    t,
+                    giver_name,
+                    receiver_name,
+                    " or ".join(unknown),
                 )
-
-                giver = db_session.execute(
-                    select(Participant).where(
-                        Participant.name == giver_name,
-                        Participant.campaign_id == campaign.id,
-                    )
-                ).scalar_one()
-                receiver = db_session.execute(
-                    select(Participant).where(
-                        Participant.name == receiver_name,
-                        Participant.campaign_id == campaign.id,
-                    )
-                ).scalar_one()
-
-                constraint = Constraint(
-                    type=t,
-                    campaign_id=campaign.id,
-                    giver_id=giver.id,
-                    receiver_id=receiver.id,
+                continue
+            key = (t, p_map_r[giver_name], p_map_r[receiver_name])
+            if key in existing:
+                logging.error(
+                    "The %s constraint %s -> %s has already been added",
+                    t,
+                    giver_name,
+                    receiver_name,
                 )
-                n += 1
+                continue
+            existing.add(key)
+            rows.append(
+                {
+                    "type": t,
+                    "campaign_id": campaign.id,
+                    "giver_id": key[1],
+                    "receiver_id": key[2],
+                }
+            )
 
-                db_session.add(constraint)
+    try:
+        if rows:
+            db_session.execute(insert(Constraint), rows)
         db_session.commit()
-        logging.info("Loaded %d constraints into campaign %d", n, campaign.id)
+        logging.info("Loaded %d constraints into campaign %s", len(rows), campaign_name)
     except IntegrityError as err:
+        # only if the campaign changed since the constraints were read
         db_session.rollback()
         logging.error("Some of these constraints have already been added: %s", err)
 
@@ -162,17 +255,39 @@ def create_pairings(
     data_dir: str | None = None,
     random_seed: int | None = None,
     overwrite: bool = False,
+    history: int = 0,
+    history_decay: float = 0.5,
+    num_gifts: int = 1,
+    min_cycle_length: int = 2,
+    single_cycle: bool = False,
+    use_cache: bool = True,
 ) -> None:
     """
     Create pairings for the given campaign and save them to the database.
     :param campaign_name: Name of the campaign to create pairings for
+    :param history: Avoid repeating the pairings of this many previous campaigns, matched up by participant name
+    :param history_decay: Repeating a pairing from one campaign further back is penalized this much less
+    :param num_gifts: Number of gifts each participant gives (and receives). Each gift is saved with its round number.
+    :param min_cycle_length: Every gift cycle has at least this many people, e.g. 3 to rule out A -> B -> A
+    :param single_cycle: Everyone is part of one gift circle
+    :param use_cache: With a given `random_seed`, reuse the pairings of an earlier run with the same inputs
+        (see `cache.cache_key`), and save new ones for later runs. Not with `history`, see `cache`.
     """
+    if num_gifts > 1 and history > 0:
+        logging.error("--history is not supported with more than one gift")
+        sys.exit(1)
+    if num_gifts > 1 and (min_cycle_length > 2 or single_cycle):
+        logging.error(
+            "--min_cycle_length and --single_cycle are not supported with more than one gift"
+        )
+        sys.exit(1)
     data_dir = _rationalize_data_dir(data_dir)
     if random_seed is None:
         random_seed = _gen_random_seed()
+        # nothing could be reused with a new seed
+        use_cache = False
 
     db_session = _create_db_session(data_dir)
-    Base.metadata.create_all(bind=db_session.get_bind())
 
     # find the campaign
     campaign = _get_campaign_or_fail(db_session, campaign_name)
@@ -194,30 +309,70 @@ def create_pairings(
     logging.debug("Fetched %d participants", len(participants))
     p_map = {p.id: p.name for p in participants}
 
-    always_constraints = db_session.scalars(
-        select(Constraint).where(
-            Constraint.campaign_id == campaign.id,
-            Constraint.type == ConstraintType.ALWAYS,
-        )
-    ).all()
-    never_constraints = db_session.scalars(
-        select(Constraint).where(
-            Constraint.campaign_id == campaign.id,
-            Constraint.type == ConstraintType.NEVER,
-        )
-    ).all()
+    always_names = _read_constraints_from_db(
+        db_session, campaign.id, ConstraintType.ALWAYS, p_map
+    )
+    never_names = _read_constraints_from_db(
+        db_session, campaign.id, ConstraintType.NEVER, p_map
+    )
 
-    assignments = secret_santa.secret_santa_hat(
-        names=[p.name for p in participants],
-        random_seed=random_seed,
-        always_constraints=[
-            [p_map[a.giver_id], p_map[a.receiver_id]] for a in always_constraints
-        ],
-        never_constraints=[
-            [p_map[n.giver_id], p_map[n.receiver_id]] for n in never_constraints
-        ],
+    penalties = None
+    if history > 0:
+        previous = _read_previous_pairings(db_session, campaign, history)
+        logging.info("Avoiding pairings from %d previous campaigns", len(previous))
+        penalties = secret_santa.history_penalties(previous, decay=history_decay)
+        # the min-cost solver stops at a time budget, so the result is not reproducible
+        use_cache = False
+
+    names = [p.name for p in participants]
+    groups = {p.name: p.group_name for p in participants if p.group_name}
+    key = cache_key(
+        names,
+        random_seed,
+        always_names,
+        never_names,
+        groups,
+        num_gifts=num_gifts,
+        min_cycle_length=min_cycle_length,
+        single_cycle=single_cycle,
     )
-    print(assignments)
+    logging.info("Cache key of these pairings: %s", key)
+    cached = get_cached_pairings(db_session, key) if use_cache else None
+    if num_gifts > 1:
+        rounds = cached or secret_santa.secret_santa_hat_multi(
+            names=names,
+            random_seed=random_seed,
+            num_gifts=num_gifts,
+            always_constraints=always_names,
+            never_constraints=never_names,
+            groups=groups,
+        )
+        if use_cache and cached is None:
+            save_cached_pairings(db_session, key, rounds)
+        print(rounds)
+        pairs = [
+            (giver_name, receiver_name, gift_round)
+            for giver_name, receiver_names in rounds.items()
+            for gift_round, receiver_name in enumerate(receiver_names)
+        ]
+    else:
+        assignments = cached or secret_santa.secret_santa_hat(
+            names=names,
+            random_seed=random_seed,
+            always_constraints=always_names,
+            never_constraints=never_names,
+            penalties=penalties,
+            groups=groups,
+            min_cycle_length=min_cycle_length,
+            single_cycle=single_cycle,
+        )
+        if use_cache and cached is None:
+            save_cached_pairings(db_session, key, assignments)
+        print(assignments)
+        pairs = [
+            (giver_name, receiver_name, 0)
+            for giver_name, receiver_name in assignments.items()
+        ]
 
     if overwrite:
         # delete the pairings
@@ -228,19 +383,115 @@ def create_pairings(
 
     # save the pairings
     p_map_r = {p.name: p.id for p in participants}
-    for giver_name, receiver_name in assignments.items():
+    for giver_name, receiver_name, gift_round in pairs:
         g_id = p_map_r[giver_name]
         r_id = p_map_r[receiver_name]
         pair = Pairing(
             campaign_id=campaign.id,
             giver_id=g_id,
             receiver_id=r_id,
+            gift_round=gift_round,
         )
         db_session.add(pair)
     campaign.random_seed = random_seed
     db_session.commit()
 
 
+def repair_pairings(
+    campaign_name: str,
+    drop: list[str] | str | None = None,
+    data_dir: str | None = None,
+    random_seed: int | None = None,
+) -> None:
+    """
+    Fix up the pairings of a campaign after participants dropped out or were added with `load_participants_from_json`.
+    Only the givers whose receiver changed get new pairings, so only they need to be sent their pairing again.
+    Their pairings are saved with the `random_seed` of the repair, which reproduces it given the pairings before it.
+    :param drop: Names of the participants who dropped out. They are removed from the campaign with their constraints.
+        A single name may be given on its own, as `--drop Eve` does on the command line.
+    """
+    if isinstance(drop, str):
+        drop = [drop]
+    data_dir = _rationalize_data_dir(data_dir)
+    if random_seed is None:
+        random_seed = _gen_random_seed()
+
+    db_session = _create_db_session(data_dir)
+    campaign = _get_campaign_or_fail(db_session, campaign_name)
+    multi_gift = db_session.execute(
+        select(
+            exists(Pairing.id).where(
+                Pairing.campaign_id == campaign.id, Pairing.gift_round > 0
+            )
+        )
+    ).scalar_one()
+    if multi_gift:
+        logging.error("Repairing pairings with more than one gift is not supported")
+        sys.exit(1)
+    previous = _read_pairings_from_db(db_session, campaign.id)
+
+    if drop:
+        dropped_ids = db_session.scalars(
+            select(Participant.id).where(
+                Participant.campaign_id == campaign.id, Participant.name.in_(drop)
+            )
+        ).all()
+        assert len(dropped_ids) == len(set(drop)), "Can only drop existing participants"
+        db_session.execute(
+            delete(Pairing).where(
+                Pairing.giver_id.in_(dropped_ids) | Pairing.receiver_id.in_(dropped_ids)
+            )
+        )
+        db_session.execute(
+            delete(Constraint).where(
+                Constraint.giver_id.in_(dropped_ids)
+                | Constraint.receiver_id.in_(dropped_ids)
+            )
+        )
+        db_session.execute(delete(Participant).where(Participant.id.in_(dropped_ids)))
+        logging.info("Dropped %d participants", len(dropped_ids))
+
+    participants = _read_participants_from_db(db_session, campaign.id)
+    p_map = {p.id: p.name for p in participants}
+    pairings, changed = secret_santa.repair_pairings(
+        previous,
+        names=[p.name for p in participants],
+        random_seed=random_seed,
+        always_constraints=_read_constraints_from_db(
+            db_session, campaign.id, ConstraintType.ALWAYS, p_map
+        ),
+        never_constraints=_read_constraints_from_db(
+            db_session, campaign.id, ConstraintType.NEVER, p_map
+        ),
+        groups={p.name: p.group_name for p in participants if p.group_name},
+    )
+    print({giver: pairings[giver] for giver in changed})
+
+    # only replace the pairings of the givers that changed
+    p_map_r = {p.name: p.id for p in participants}
+    changed_ids = [p_map_r[giver] for giver in changed]
+    db_session.execute(
+        delete(Pairing).where(
+            Pairing.campaign_id == campaign.id, Pairing.giver_id.in_(changed_ids)
+        )
+    )
+    for giver_name in changed:
+        pair = Pairing(
+            campaign_id=campaign.id,
+            giver_id=p_map_r[giver_name],
+            receiver_id=p_map_r[pairings[giver_name]],
+            repair_seed=random_seed,
+        )
+        db_session.add(pair)
+    db_session.commit()
+    logging.info(
+        "Changed the pairings of %d givers with random seed %d: %s",
+        len(changed),
+        random_seed,
+        ", ".join(changed),
+    )
+
+
 def _create_campaign_data_dir(data_dir: str, campaign_name: str) -> str:
     tail = campaign_name.replace(" ", "_")
     path = os.path.join(data_dir, tail)
@@ -260,11 +511,32 @@ def _read_participants_from_db(
     return list(participants)
 
 
-def _read_pairings_from_db(db_session: Session, campaign_id: int) -> dict[str, str]:
+def _read_constraints_from_db(
+    db_session: Session,
+    campaign_id: int,
+    constraint_type: ConstraintType,
+    p_map: dict[int, str],
+) -> list[list[str]]:
+    """:returns: The constraints of this type, each one as [giver name, receiver name]"""
+    constraints = db_session.scalars(
+        select(Constraint).where(
+            Constraint.campaign_id == campaign_id,
+            Constraint.type == constraint_type,
+        )
+    ).all()
+    return [[p_map[c.giver_id], p_map[c.receiver_id]] for c in constraints]
+
+
+def _read_pairings_from_db(
+    db_session: Session, campaign_id: int, gift_round: int = 0
+) -> dict[str, str]:
+    """:param gift_round: With several gifts per giver, read the pairings of this round"""
     participants = _read_participants_from_db(db_session, campaign_id)
     p_map: dict[int, str] = {p.id: p.name for p in participants}
     pairings = db_session.scalars(
-        select(Pairing).where(Pairing.campaign_id == campaign_id)
+        select(Pairing).where(
+            Pairing.campaign_id == campaign_id, Pairing.gift_round == gift_round
+        )
     ).all()
     d: dict[str, str] = {}
     for pair in pairings:
@@ -272,6 +544,43 @@ def _read_pairings_from_db(db_session: Session, campaign_id: int) -> dict[str, s
     return d
 
 
+def _read_all_pairings_from_db(
+    db_session: Session, campaign_id: int
+) -> dict[str, list[str]]:
+    """:returns: The receivers of each giver in every gift round, in round order"""
+    participants = _read_participants_from_db(db_session, campaign_id)
+    p_map: dict[int, str] = {p.id: p.name for p in participants}
+    pairings = db_session.scalars(
+        select(Pairing)
+        .where(Pairing.campaign_id == campaign_id)
+        .order_by(Pairing.gift_round)
+    ).all()
+    d: dict[str, list[str]] = {}
+    for pair in pairings:
+        d.setdefault(p_map[pair.giver_id], []).append(p_map[pair.receiver_id])
+    return d
+
+
+def _read_previous_pairings(
+    db_session: Session, campaign: Campaign, num_campaigns: int
+) -> list[dict[str, list[str]]]:
+    """
+    :returns: The pairings of up to `num_campaigns` campaigns created before `campaign` that have pairings, most recent first.
+        Every gift round of those campaigns is included.
+    """
+    previous = db_session.scalars(
+        select(Campaign)
+        .where(
+            Campaign.id != campaign.id,
+            Campaign.created_at <= campaign.created_at,
+            exists(Pairing.id).where(Pairing.campaign_id == Campaign.id),
+        )
+        .order_by(Campaign.created_at.desc(), Campaign.id.desc())
+        .limit(num_campaigns)
+    ).all()
+    return [_read_all_pairings_from_db(db_session, c.id) for c in previous]
+
+
 def send_pairings_via_email(
     campaign_name: str,
     email_template_path: str,
@@ -299,7 +608,8 @@ def send_pairings_via_email(
 
     assert len(email_subject) > 0
 
-    pairings = _read_pairings_from_db(db_session, campaign_id=campaign.id)
+    # every gift round, so that givers with several receivers are told about all of them
+    pairings = _read_all_pairings_from_db(db_session, campaign_id=campaign.id)
     email_utils.create_emails(
         pairings=pairings,
         email_template_fname=email_template_path,
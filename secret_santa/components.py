@@ -0,0 +1,62 @@
+"""
+Split a pairing problem into parts that can be solved independently.
+
+Two givers are in the same part if there is a path between them in the allowed giver -> receiver graph,
+ignoring directions. There are no allowed pairs between different parts, so every valid assignment
+is a valid assignment of each part, and solving the parts separately loses nothing.
+Like `matching`, the search walks the complement of the exclusions with lists of unvisited givers and receivers,
+so it costs O(n + number of exclusions).
+"""
+
+from collections.abc import Sequence, Set
+
+
+def connected_components(
+    forbidden: Sequence[Set[int]],
+) -> list[tuple[list[int], list[int]]]:
+    """
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not give to
+    :returns: The givers and the receivers of each connected component of the allowed graph,
+        ordered by their smallest giver. Receivers that nobody may give to are left out.
+    """
+    n = len(forbidden)
+    unvisited_givers = list(range(n))
+    unvisited_receivers = list(range(n))
+    visited_giver = [False] * n
+    components = []
+    for start in range(n):
+        if visited_giver[start]:
+            continue
+        visited_giver[start] = True
+        givers = [start]
+        receivers: list[int] = []
+        head_g = 0
+        head_r = 0
+        while head_g < len(givers) or head_r < len(receivers):
+            if head_g < len(givers):
+                g = givers[head_g]
+                head_g += 1
+                excluded = forbidden[g]
+                keep = []
+                for r in unvisited_receivers:
+                    if r in excluded:
+                        keep.append(r)
+                    else:
+                        receivers.append(r)
+                unvisited_receivers = keep
+            else:
+                r = receivers[head_r]
+                head_r += 1
+                keep = []
+                for g in unvisited_givers:
+                    if visited_giver[g]:
+                        # the first giver of each component is still in the list
+                        continue
+                    if r in forbidden[g]:
+                        keep.append(g)
+                    else:
+                        visited_giver[g] = True
+                        givers.append(g)
+                unvisited_givers = keep
+        components.append((sorted(givers), sorted(receivers)))
+    return components
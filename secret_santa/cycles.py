@@ -0,0 +1,104 @@
+"""
+Lengthen the gift cycles of an assignment until none is shorter than a minimum.
+
+Every assignment splits into cycles (A -> B -> A is a cycle of length 2). Two cycles become one when a giver g
+in the first and a giver h in the second swap their receivers: g -> ... -> h -> ... -> g. So instead of
+rejecting assignments with short cycles, we merge each short cycle into another one with a single allowed swap,
+which only ever makes cycles longer. A single gift circle is the special case where the minimum is everyone.
+Cycles are tracked with union-find (smaller member lists are moved into larger ones),
+so apart from the swaps that are not allowed, this costs O(n log n).
+
+Givers and receivers are positions in a contracted problem where each node may stand for a chain of
+several people (see `model.PairingProblem`), so every node has a weight: the number of people in it.
+"""
+
+import random
+from collections.abc import Sequence, Set
+
+from .stats import SolverStats
+
+# random swaps to try for each short cycle before checking every possible swap
+NUM_RANDOM_MERGES = 32
+
+
+def lengthen_cycles(
+    forbidden: Sequence[Set[int]],
+    receiver_of: list[int],
+    node_of_receiver: Sequence[int],
+    weight: Sequence[int],
+    min_length: int,
+    rng: random.Random,
+    stats: SolverStats | None = None,
+) -> bool:
+    """
+    Merge cycles until each one has a total weight of at least `min_length` (in-place modification of `receiver_of`)
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not give to
+    :param receiver_of: A valid assignment: for each giver, the index of its receiver
+    :param node_of_receiver: For each receiver index, the giver index of the same node
+    :param weight: For each giver index, the number of people in its node
+    :param min_length: Use the sum of the weights for a single cycle
+    :returns: False if some short cycle cannot be merged with any other cycle by a single swap
+    """
+    n = len(receiver_of)
+    root = list(range(n))
+    members: list[list[int]] = [[] for _ in range(n)]
+    length = [0] * n
+    for start in range(n):
+        if members[start] or root[start] != start:
+            continue
+        g = start
+        while True:
+            root[g] = start
+            members[start].append(g)
+            length[start] += weight[g]
+            g = node_of_receiver[receiver_of[g]]
+            if g == start:
+                break
+
+    def allowed(g: int, h: int) -> bool:
+        # g takes the receiver of h, and h takes the receiver of g
+        return receiver_of[h] not in forbidden[g] and receiver_of[g] not in forbidden[h]
+
+    def find_swap(c: int) -> tuple[int, int] | None:
+        cycle = members[c]
+        for _ in range(NUM_RANDOM_MERGES):
+            g = rng.choice(cycle)
+            h = rng.randrange(n)
+            if stats is not None:
+                stats.constraint_checks += 1
+            if root[h] != c and allowed(g, h):
+                return g, h
+        others = [h for h in range(n) if root[h] != c]
+        rng.shuffle(others)
+        for g in cycle:
+            if stats is not None:
+                stats.constraint_checks += len(others)
+            for h in others:
+                if allowed(g, h):
+                    return g, h
+        return None
+
+    short = [c for c in range(n) if members[c] and length[c] < min_length]
+    rng.shuffle(short)
+    while short:
+        c = short.pop()
+        if root[c] != c or length[c] >= min_length:
+            continue
+        if stats is not None:
+            stats.nodes_expanded += 1
+        swap = find_swap(c)
+        if swap is None:
+            return False
+        g, h = swap
+        receiver_of[g], receiver_of[h] = receiver_of[h], receiver_of[g]
+        big, small = root[g], root[h]
+        if len(members[big]) < len(members[small]):
+            big, small = small, big
+        for k in members[small]:
+            root[k] = big
+        members[big].extend(members[small])
+        members[small] = []
+        length[big] += length[small]
+        if length[big] < min_length:
+            short.append(big)
+    return True
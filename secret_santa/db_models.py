@@ -1,8 +1,18 @@
 from datetime import datetime, timezone
 from enum import StrEnum
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, UniqueConstraint
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import (
+    Boolean,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    inspect,
+    text,
+)
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
 from sqlalchemy.sql import func
 
 
@@ -26,6 +36,8 @@ class Participant(Base):
     email: Mapped[str | None] = mapped_column(String, nullable=True)
     text: Mapped[str | None] = mapped_column(String, nullable=True)
     is_verified: Mapped[bool | None] = mapped_column(Boolean, nullable=True)
+    # members of the same group (e.g. a household) never give to each other
+    group_name: Mapped[str | None] = mapped_column(String, nullable=True)
 
     # uniq_participant_email_for_campaign
     __table_args__ = (
@@ -51,6 +63,7 @@ class Constraint(Base):
         Integer, ForeignKey("participants.id"), nullable=False
     )
 
+    # the index of this constraint also serves lookups by campaign_id and type, which are its first columns
     __table_args__ = (
         UniqueConstraint("campaign_id", "type", "giver_id", "receiver_id"),
     )
@@ -64,11 +77,18 @@ class Pairing(Base):
         Integer, ForeignKey("campaigns.id"), nullable=False
     )
     giver_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("participants.id"), nullable=False
+        Integer, ForeignKey("participants.id"), nullable=False, index=True
     )
     receiver_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("participants.id"), nullable=False
+        Integer, ForeignKey("participants.id"), nullable=False, index=True
+    )
+    # with several gifts per giver, the pairings are drawn in rounds numbered from 0
+    gift_round: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
     )
+    # the seed of the repair that drew this pairing, which with the pairings before it reproduces that repair.
+    # Not set for the pairings of the campaign's own draw, whose seed is `Campaign.random_seed`.
+    repair_seed: Mapped[int | None] = mapped_column(Integer, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime,
         nullable=False,
@@ -76,6 +96,11 @@ class Pairing(Base):
         server_default=func.now(),
     )
 
+    # also serves lookups by campaign_id alone
+    __table_args__ = (
+        Index("ix_pairings_campaign_id_gift_round", "campaign_id", "gift_round"),
+    )
+
 
 class Campaign(Base):
     __tablename__ = "campaigns"
@@ -99,3 +124,48 @@ class Campaign(Base):
         default=lambda: datetime.now(timezone.utc),
         server_default=func.now(),
     )
+
+
+class CachedPairings(Base):
+    """Pairings that were already solved, by the hash of everything that determines them (see `cache.cache_key`)"""
+
+    __tablename__ = "pairings_cache"
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    # JSON encoded result of the solver
+    pairings: Mapped[str] = mapped_column(String, nullable=False)
+    # the least recently used entries are evicted first
+    last_used: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+    )
+
+
+# columns added since the first release: table -> column -> DDL to add it to an existing table
+ADDED_COLUMNS = {
+    "participants": {"group_name": "VARCHAR"},
+    "pairings": {"gift_round": "INTEGER NOT NULL DEFAULT 0", "repair_seed": "INTEGER"},
+}
+
+
+def upgrade_schema(db_session: Session) -> None:
+    """
+    Create missing tables, add the columns that were added to existing tables since they were created,
+    and then create missing indexes. `create_all` alone never alters a table that already exists.
+    """
+    Base.metadata.create_all(bind=db_session.get_bind())
+    inspector = inspect(db_session.connection())
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for column, ddl in columns.items():
+            if column not in existing:
+                db_session.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+                )
+    for table_obj in Base.metadata.sorted_tables:
+        for index in table_obj.indexes:
+            index.create(bind=db_session.connection(), checkfirst=True)
+    db_session.commit()
@@ -15,8 +15,15 @@ from .gmail import Mailer
 from .secret_santa import sanity_check_pairings
 
 
-def sanity_check_emails(data_dir: str, emails: dict[str, str]):
+def sanity_check_emails(
+    data_dir: str,
+    emails: dict[str, str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+):
     """
+    Check the pairings in the emails, including the constraints and groups
     Throws assertion error on failure
     """
     email_dir = os.path.join(data_dir, "emails")
@@ -26,7 +33,9 @@ def sanity_check_emails(data_dir: str, emails: dict[str, str]):
     names = list(emails.keys())
     assert isinstance(names, list)
     logging.debug("Successfully read names from config folder")
-    sanity_check_pairings(pairings, names)
+    sanity_check_pairings(
+        pairings, names, always_constraints, never_constraints, groups
+    )
 
 
 def create_emails(
@@ -35,7 +44,8 @@ def create_emails(
     """
     Create HTML email text for everyone and write it to `output_dir`
     :param pairings: Either encrypted or unencrypted pairings.
-        If encrypted, values should be dictionaries with `key` and `encrypted_message` keys
+        If encrypted, values should be dictionaries with `key` and `encrypted_message` keys.
+        If unencrypted, values are the receiver's name, or the list of receivers when each giver gives several gifts
     """
     for giver in pairings:
         logging.debug("Creating email body for %s...", giver)
@@ -45,8 +55,11 @@ def create_emails(
             url = create_decryption_url(key=key, encrypted_msg=enc_receiver_name)
             email_format = {"giver_name": giver, "link": url}
         else:
-            assert isinstance(pairings[giver], str)
-            receiver_name = pairings[giver]
+            if isinstance(pairings[giver], list):
+                receiver_name = ", ".join(pairings[giver])
+            else:
+                assert isinstance(pairings[giver], str)
+                receiver_name = pairings[giver]
             email_format = {"giver_name": giver, "receiver_name": receiver_name}
         email_body = get_email_text(email_template_fname, email_format, output_dir)
         email_fname = get_email_fname(giver, output_dir)
@@ -3,7 +3,6 @@ Optionally, you may encrypt the pairings.
 This provides an interface to do so
 """
 
-import json
 import logging
 import os
 import urllib.parse
@@ -12,7 +11,7 @@ from datetime import datetime
 import requests
 
 from .config import CONFIG
-from .secret_santa import sanity_check_pairings
+from .validation import check_problems, iter_json_object, validate_pairings
 
 CURRENT_YEAR = CONFIG.get("year", datetime.now().year)
 SITE_URL = f"https://kats.coffee/secret-santa/{CURRENT_YEAR}"
@@ -65,24 +64,33 @@ def encrypt_pairings(
 
 
 def sanity_check_encrypted_pairings(
-    data_dir: str, names: list[str], api_base_url: str = API_BASE_URL
+    data_dir: str,
+    names: list[str],
+    api_base_url: str = API_BASE_URL,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
 ) -> None:
     """
-    Sanity check the saved encrypted pairings file
+    Sanity check the saved encrypted pairings file, including the constraints and groups
     Throws assertion error on failure
     """
     assert isinstance(names, list)
     fname = os.path.join(data_dir, "encrypted_pairings.json")
-    enc_pairings: dict[str, dict] = {}
     with open(fname) as fp:
-        enc_pairings = json.load(fp)
-    logging.debug("Read encrypted pairings from disk")
-    pairings: dict[str, str] = {}
-    for giver, enc_receiver in enc_pairings.items():
-        r = decrypt_with_api(
-            key=enc_receiver["key"],
-            msg=enc_receiver["encrypted_message"],
-            api_base_url=api_base_url,
+        # decrypt and check one pairing at a time as the file is read
+        pairs = (
+            (
+                giver,
+                decrypt_with_api(
+                    key=enc_receiver["key"],
+                    msg=enc_receiver["encrypted_message"],
+                    api_base_url=api_base_url,
+                ),
+            )
+            for giver, enc_receiver in iter_json_object(fp)
         )
-        pairings[giver] = r
-    sanity_check_pairings(pairings, names)
+        problems = validate_pairings(
+            pairs, names, always_constraints, never_constraints, groups
+        )
+    check_problems(problems)
@@ -0,0 +1,62 @@
+"""
+Decide whether a valid assignment exists before trying to sample one, and explain why not if it does not.
+
+By Hall's theorem, a perfect matching from givers to receivers exists iff every set of givers
+can give to at least as many receivers as there are givers in the set. When a maximum matching
+leaves a giver unmatched, the givers and receivers reachable from it by alternating paths are
+such a violating set (Konig's theorem): the givers can only give to the receivers, and there is
+exactly one receiver fewer than there are givers.
+"""
+
+import random
+from collections.abc import Sequence, Set
+from typing import NamedTuple
+
+from .matching import maximum_matching
+
+
+class HallViolation(NamedTuple):
+    """`givers` (by index) can only give to `receivers` (by index), and there are fewer receivers than givers"""
+
+    givers: list[int]
+    receivers: list[int]
+
+
+def find_hall_violation(forbidden: Sequence[Set[int]]) -> HallViolation | None:
+    """
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not give to
+    :returns: None iff there is a valid assignment. Otherwise a set of givers with too few receivers.
+    """
+    n = len(forbidden)
+    # the result does not depend on randomness, so use a fixed seed
+    receiver_of = maximum_matching(forbidden, random.Random(0))
+    unmatched = [g for g in range(n) if receiver_of[g] == -1]
+    if not unmatched:
+        return None
+
+    giver_of = [-1] * n
+    for g, r in enumerate(receiver_of):
+        if r != -1:
+            giver_of[r] = g
+    # alternating breadth-first search from a single unmatched giver,
+    # walking the complement of `forbidden` as in `matching._augment`
+    root = unmatched[0]
+    givers = [root]
+    receivers: list[int] = []
+    unvisited = list(range(n))
+    head = 0
+    while head < len(givers):
+        g = givers[head]
+        head += 1
+        excluded = forbidden[g]
+        keep = []
+        for r in unvisited:
+            if r in excluded:
+                keep.append(r)
+                continue
+            # r must be matched, otherwise there would be an augmenting path
+            receivers.append(r)
+            if giver_of[r] != g:
+                givers.append(giver_of[r])
+        unvisited = keep
+    return HallViolation(sorted(givers), sorted(receivers))
@@ -14,6 +14,8 @@ class ParticipantSchema(TypedDict):
     # phone number
     text: str | None
     is_verified: bool | None
+    # members of the same group (e.g. a household) never give to each other
+    group: str | None
 
 
 # class ConstraintsSchema(TypedDict):
@@ -47,6 +49,9 @@ def read_participants_json(fname: str) -> dict[str, ParticipantSchema]:
                 assert "email" in p_obj or "text" in p_obj, (
                     "Participant must have at least one contact method: email or text"
                 )
+                assert p_obj.get("group") is None or isinstance(p_obj["group"], str), (
+                    f"Group of participant {name} must be a string"
+                )
                 if "checked" in p_obj and "is_verified" not in p_obj:
                     p_obj["is_verified"] = p_obj.pop("checked")
 
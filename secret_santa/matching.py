@@ -0,0 +1,170 @@
+"""
+Randomized bipartite perfect matching between givers and receivers.
+
+The allowed giver -> receiver graph is the complement of a (usually sparse) set of exclusions,
+so it is never materialized. Only the excluded receivers of each giver are stored, and the
+augmenting-path search walks the complement graph by keeping a list of unvisited receivers.
+Each search costs O(n + number of exclusions) instead of O(n^2).
+"""
+
+import random
+from collections.abc import Sequence, Set
+
+from .stats import SolverStats
+
+
+def _augment(
+    root: int,
+    forbidden: Sequence[Set[int]],
+    receiver_of: list[int],
+    giver_of: list[int],
+    rng: random.Random,
+    stats: SolverStats | None = None,
+) -> bool:
+    """
+    Breadth-first search for an augmenting path starting at the unmatched giver `root`.
+    If one is found, flip it (in-place modification of `receiver_of` and `giver_of`) and return True.
+    Because the search is breadth-first, the path found is a shortest one.
+    """
+    unvisited = list(range(len(giver_of)))
+    rng.shuffle(unvisited)
+    # receiver -> the giver from which we reached it
+    parent: dict[int, int] = {}
+    queue = [root]
+    head = 0
+    while head < len(queue):
+        g = queue[head]
+        head += 1
+        excluded = forbidden[g]
+        keep = []
+        found = -1
+        for i, r in enumerate(unvisited):
+            if r in excluded or r == receiver_of[g]:
+                keep.append(r)
+                continue
+            parent[r] = g
+            if giver_of[r] == -1:
+                found = r
+                keep.extend(unvisited[i + 1 :])
+                break
+            queue.append(giver_of[r])
+        if stats is not None:
+            stats.nodes_expanded += 1
+            stats.constraint_checks += len(unvisited) if found == -1 else i + 1
+        unvisited = keep
+        if found != -1:
+            r = found
+            while True:
+                g = parent[r]
+                prev = receiver_of[g]
+                receiver_of[g] = r
+                giver_of[r] = g
+                if g == root:
+                    return True
+                r = prev
+    return False
+
+
+def _random_matching(
+    forbidden: Sequence[Set[int]],
+    rng: random.Random,
+    perfect: bool,
+    stats: SolverStats | None,
+) -> list[int]:
+    n = len(forbidden)
+    receiver_of = [-1] * n
+    giver_of = [-1] * n
+
+    # a random permutation is almost a valid matching when exclusions are sparse,
+    # so keep every allowed edge from it and only repair the rest
+    perm = list(range(n))
+    rng.shuffle(perm)
+    for g, r in enumerate(perm):
+        if r not in forbidden[g]:
+            receiver_of[g] = r
+            giver_of[r] = g
+    if stats is not None:
+        stats.constraint_checks += n
+
+    unmatched = [g for g in range(n) if receiver_of[g] == -1]
+    rng.shuffle(unmatched)
+    for g in unmatched:
+        # by Berge's lemma, if there is no augmenting path now then g is unmatched in a maximum matching
+        if not _augment(g, forbidden, receiver_of, giver_of, rng, stats) and perfect:
+            break
+    return receiver_of
+
+
+def maximum_matching(
+    forbidden: Sequence[Set[int]], rng: random.Random, stats: SolverStats | None = None
+) -> list[int]:
+    """
+    Find a random maximum matching between n givers and n receivers.
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not be matched with
+    :param rng: Source of randomness
+    :param stats: If given, count the work done
+    :returns: For each giver, the index of its receiver, or -1 if it is unmatched
+    """
+    return _random_matching(forbidden, rng, perfect=False, stats=stats)
+
+
+def random_perfect_matching(
+    forbidden: Sequence[Set[int]], rng: random.Random, stats: SolverStats | None = None
+) -> list[int] | None:
+    """
+    Find a random perfect matching between n givers and n receivers.
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not be matched with
+    :param rng: Source of randomness
+    :param stats: If given, count the work done
+    :returns: For each giver, the index of its receiver. None iff no perfect matching exists.
+    """
+    receiver_of = _random_matching(forbidden, rng, perfect=True, stats=stats)
+    if -1 in receiver_of:
+        return None
+    return receiver_of
+
+
+def repair_matching(
+    forbidden: Sequence[Set[int]],
+    receiver_of: list[int],
+    rng: random.Random,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    Complete a partial matching while changing as few of its pairs as possible.
+    The givers without a receiver are first paired at random with the receivers that are left, which moves nobody.
+    Each giver that is still without a receiver is then matched along a shortest augmenting path,
+    which moves every giver on it. With a single giver left without a receiver, this moves the fewest givers possible.
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not be matched with
+    :param receiver_of: For each giver, the receiver to keep if possible, or -1. Pairs that are forbidden are dropped.
+    :param rng: Source of randomness to choose among the shortest paths
+    :param stats: If given, count the work done
+    :returns: For each giver, the index of its receiver. None iff no perfect matching exists.
+    """
+    n = len(forbidden)
+    receiver_of = receiver_of[:]
+    giver_of = [-1] * n
+    for g, r in enumerate(receiver_of):
+        if r == -1:
+            continue
+        if r in forbidden[g] or giver_of[r] != -1:
+            receiver_of[g] = -1
+        else:
+            giver_of[r] = g
+    unmatched = [g for g in range(n) if receiver_of[g] == -1]
+    rng.shuffle(unmatched)
+    # as in `_random_matching`, most of these pairs are allowed when exclusions are sparse
+    free = [r for r in range(n) if giver_of[r] == -1]
+    rng.shuffle(free)
+    for g, r in zip(unmatched, free):
+        if r not in forbidden[g]:
+            receiver_of[g] = r
+            giver_of[r] = g
+    if stats is not None:
+        stats.constraint_checks += len(unmatched)
+    for g in unmatched:
+        if receiver_of[g] == -1 and not _augment(
+            g, forbidden, receiver_of, giver_of, rng, stats
+        ):
+            return None
+    return receiver_of
@@ -0,0 +1,250 @@
+"""
+Minimum-cost assignment when almost every allowed pair costs nothing.
+
+Only a sparse set of giver -> receiver pairs carry a cost (for example, pairs that were drawn in
+previous years), or a bonus (a negative cost, for example a preferred pair). Without bonuses we first
+look for a zero-cost perfect matching with the matching engine, which is the common case. Otherwise we run the successive shortest path (Hungarian) algorithm on a sparse
+candidate graph: every costly pair, plus a few random zero-cost pairs per giver. The duals tell us
+whether a zero-cost pair outside of the candidate graph could improve the solution. If so, those
+pairs are added and the candidate graph is solved again, until the solution is optimal or the time
+budget runs out. The time budget is checked between augmenting paths, so if it runs out before the
+first solve is done, the givers that were matched so far keep their receivers and the rest are
+matched quickly, without regard to cost.
+"""
+
+import heapq
+import math
+import random
+import time
+from collections.abc import Sequence, Set
+
+from .matching import maximum_matching, repair_matching
+from .stats import SolverStats
+
+# how many random zero-cost receivers each giver starts with in the candidate graph
+NUM_ZERO_COST_CANDIDATES = 8
+# a dual constraint is only considered violated by more than this much
+EPSILON = 1e-9
+
+
+def _shortest_augmenting_path(
+    root: int,
+    candidates: list[dict[int, float]],
+    receiver_of: list[int],
+    giver_of: list[int],
+    u: list[float],
+    v: list[float],
+    stats: SolverStats | None,
+) -> bool:
+    """
+    Dijkstra from the unmatched giver `root` over reduced costs c(g, r) - u[g] - v[r], which are never negative.
+    If a free receiver is reached, update the duals so that they stay feasible, flip the path and return True.
+    """
+    dist: dict[int, float] = {}
+    prev: dict[int, int] = {}
+    heap: list[tuple[float, int]] = []
+    for r, c in candidates[root].items():
+        d = c - u[root] - v[r]
+        if d < dist.get(r, math.inf):
+            dist[r] = d
+            prev[r] = root
+            heapq.heappush(heap, (d, r))
+
+    finalized: list[int] = []
+    done: set[int] = set()
+    target = -1
+    while heap:
+        d, r = heapq.heappop(heap)
+        if r in done or d > dist[r]:
+            continue
+        done.add(r)
+        g = giver_of[r]
+        if g == -1:
+            target = r
+            break
+        finalized.append(r)
+        for r2, c in candidates[g].items():
+            if r2 in done:
+                continue
+            nd = d + c - u[g] - v[r2]
+            if nd < dist.get(r2, math.inf):
+                dist[r2] = nd
+                prev[r2] = g
+                heapq.heappush(heap, (nd, r2))
+    if stats is not None:
+        stats.nodes_expanded += len(done)
+    if target == -1:
+        return False
+
+    # keep the duals feasible, and make the edges of the path tight
+    total = dist[target]
+    u[root] += total
+    for r in finalized:
+        delta = dist[r] - total
+        v[r] += delta
+        u[giver_of[r]] -= delta
+
+    r = target
+    while True:
+        g = prev[r]
+        next_r = receiver_of[g]
+        receiver_of[g] = r
+        giver_of[r] = g
+        if g == root:
+            return True
+        r = next_r
+
+
+def _sample_zero_cost(
+    excluded: Set[int], n: int, k: int, rng: random.Random
+) -> list[int]:
+    """Up to k distinct receivers that are not in `excluded`, drawn at random"""
+    if n - len(excluded) <= k:
+        return [r for r in range(n) if r not in excluded]
+    found: set[int] = set()
+    for _ in range(4 * k):
+        r = rng.randrange(n)
+        if r not in excluded:
+            found.add(r)
+            if len(found) == k:
+                break
+    return list(found)
+
+
+def _find_violations(
+    excluded: list[set[int]],
+    candidates: list[dict[int, float]],
+    u: list[float],
+    v: list[float],
+    k: int,
+    rng: random.Random,
+    deadline: float | None,
+) -> list[tuple[int, int]]:
+    """
+    Zero-cost pairs (g, r) outside of the candidate graph whose reduced cost -u[g] - v[r] is negative.
+    If there are none, the solution on the candidate graph is optimal on the whole graph.
+    At most k are returned per giver. Stops early at the deadline.
+    """
+    n = len(excluded)
+    # v never increases from 0 and u never decreases from 0 or below, so only givers with u > 0 can be violated
+    # and only receivers with v < 0 can be fine for them
+    order = list(range(n))
+    rng.shuffle(order)
+    violations = []
+    for g in range(n):
+        if u[g] <= EPSILON:
+            continue
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        num = 0
+        for r in order:
+            if (
+                u[g] + v[r] > EPSILON
+                and r not in excluded[g]
+                and r not in candidates[g]
+            ):
+                violations.append((g, r))
+                num += 1
+                if num == k:
+                    break
+    return violations
+
+
+def _solve_candidates(
+    candidates: list[dict[int, float]],
+    initial: list[int],
+    deadline: float | None,
+    stats: SolverStats | None,
+) -> tuple[list[int], list[float], list[float]] | None:
+    """
+    Successive shortest paths on the candidate graph, starting from a matching of zero-cost pairs.
+    At the deadline, the matching is returned as it is, with -1 for the givers that are not matched yet.
+    """
+    n = len(candidates)
+    receiver_of = initial[:]
+    giver_of = [-1] * n
+    for g, r in enumerate(receiver_of):
+        if r != -1:
+            giver_of[r] = g
+    # every reduced cost starts out non-negative: u[g] is 0, or the largest bonus of g as a negative number.
+    # The initial matching only has zero-cost pairs of givers without bonuses, so it is tight.
+    u = [min(0.0, min(candidates[g].values(), default=0.0)) for g in range(n)]
+    v = [0.0] * n
+    for g in range(n):
+        if receiver_of[g] != -1:
+            continue
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        if not _shortest_augmenting_path(
+            g, candidates, receiver_of, giver_of, u, v, stats
+        ):
+            return None
+    return receiver_of, u, v
+
+
+def min_cost_assignment(
+    forbidden: Sequence[Set[int]],
+    costs: list[dict[int, float]],
+    rng: random.Random,
+    time_budget: float | None = None,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    Find a perfect matching of givers to receivers with the smallest total cost.
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not be matched with
+    :param costs: For each giver, the cost of the receivers that do not cost 0. A negative cost is a bonus.
+    :param rng: Source of randomness. Among the optimal matchings, a random one is returned.
+    :param time_budget: In seconds. Once it runs out, return the best matching found so far, which may not be optimal.
+        By default there is no time limit.
+    :param stats: If given, count the work done
+    :returns: For each giver, the index of its receiver. None iff no perfect matching exists.
+    """
+    n = len(forbidden)
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    excluded = [forbidden[g] | costs[g].keys() for g in range(n)]
+    zero_cost = maximum_matching(excluded, rng, stats)
+    has_bonus = [any(c < 0 for c in costs[g].values()) for g in range(n)]
+    if not any(has_bonus):
+        if -1 not in zero_cost:
+            return zero_cost
+    else:
+        # the zero-cost pairs of givers with bonuses would not be tight, so those givers start unmatched
+        zero_cost = [-1 if has_bonus[g] else r for g, r in enumerate(zero_cost)]
+
+    k = NUM_ZERO_COST_CANDIDATES
+    # zero-cost pairs that the duals showed we need
+    priced_in: list[set[int]] = [set() for _ in range(n)]
+    # the optimal matching on the last candidate graph that was solved in time
+    best: list[int] | None = None
+    while True:
+        candidates: list[dict[int, float]] = []
+        for g in range(n):
+            cand = {r: c for r, c in costs[g].items() if r not in forbidden[g]}
+            zero = set(_sample_zero_cost(excluded[g], n, k, rng)) | priced_in[g]
+            if zero_cost[g] != -1:
+                zero.add(zero_cost[g])
+            for r in zero:
+                cand[r] = 0.0
+            candidates.append(cand)
+
+        if stats is not None:
+            stats.attempts += 1
+        solved = _solve_candidates(candidates, zero_cost, deadline, stats)
+        if solved is None:
+            if k >= n:
+                return None
+            if deadline is not None and time.monotonic() > deadline:
+                return best or repair_matching(forbidden, zero_cost, rng, stats)
+            # the candidate graph is too sparse to contain a perfect matching
+            k *= 2
+            continue
+        receiver_of, u, v = solved
+        if -1 in receiver_of:
+            # out of time before this solve was done
+            return best or repair_matching(forbidden, receiver_of, rng, stats)
+        best = receiver_of
+        violations = _find_violations(excluded, candidates, u, v, k, rng, deadline)
+        if not violations or (deadline is not None and time.monotonic() > deadline):
+            return receiver_of
+        for g, r in violations:
+            priced_in[g].add(r)
@@ -0,0 +1,368 @@
+"""
+Compact internal representation of a pairing problem.
+
+Participants are interned to small ints by a `NameTable`, constraints are `__slots__` objects
+holding those ints, and an assignment is an `array('I')` permutation from giver id to receiver id.
+Groups (households) are one int label per participant rather than a 'never' constraint for every
+pair of members. The solvers only ever see ints. Names are only looked up again at the API boundary.
+"""
+
+from array import array
+from collections.abc import Iterable, Iterator, Set
+
+import numpy as np
+
+
+class NameTable:
+    """Interns participant names to the ints 0..n-1"""
+
+    __slots__ = ("names", "_ids")
+
+    def __init__(self, names: list[str]) -> None:
+        self.names = list(names)
+        self._ids = {name: i for i, name in enumerate(self.names)}
+        assert len(self._ids) == len(self.names), "Names must be unique"
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def id(self, name: str) -> int:
+        return self._ids[name]
+
+    def name(self, i: int) -> str:
+        return self.names[i]
+
+
+class PairConstraint:
+    """A constraint on one giver -> receiver pair, by participant id"""
+
+    __slots__ = ("giver", "receiver")
+
+    def __init__(self, giver: int, receiver: int) -> None:
+        self.giver = giver
+        self.receiver = receiver
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.giver}, {self.receiver})"
+
+
+class AlwaysConstraint(PairConstraint):
+    __slots__ = ()
+
+
+class NeverConstraint(PairConstraint):
+    __slots__ = ()
+
+
+class GroupExclusions(Set[int]):
+    """
+    The receiver positions that a giver in a group may not give to: everyone in its group, plus a few others.
+    Membership is checked in O(1) with the group label of the receiver, and the list of members
+    is shared by the whole group instead of being copied into every member's exclusions.
+    """
+
+    __slots__ = ("others", "group", "_receiver_group", "_members")
+
+    def __init__(
+        self, others: set[int], group: int, receiver_group: array, members: list[int]
+    ) -> None:
+        """
+        :param others: Excluded receiver positions outside of the group
+        :param receiver_group: The group label of each receiver position
+        :param members: The receiver positions in the group
+        """
+        self.others = others
+        self.group = group
+        self._receiver_group = receiver_group
+        self._members = members
+
+    def __contains__(self, r: object) -> bool:
+        return r in self.others or self._receiver_group[r] == self.group  # type: ignore[call-overload]
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self._members
+        for r in self.others:
+            if self._receiver_group[r] != self.group:
+                yield r
+
+    def __len__(self) -> int:
+        return len(self._members) + sum(
+            1 for r in self.others if self._receiver_group[r] != self.group
+        )
+
+    def add(self, r: int) -> None:
+        self.others.add(r)
+
+    @classmethod
+    def _from_iterable(cls, it: Iterable[int]) -> set[int]:  # type: ignore[override]
+        # results of set operations are plain sets
+        return set(it)
+
+
+class Assignment:
+    """A full assignment: `receiver_of[giver_id]` is the id of that giver's receiver"""
+
+    __slots__ = ("table", "receiver_of")
+
+    def __init__(self, table: NameTable, receiver_of: array) -> None:
+        self.table = table
+        self.receiver_of = receiver_of
+
+    def to_dict(self) -> dict[str, str]:
+        names = self.table.names
+        return {names[g]: names[r] for g, r in enumerate(self.receiver_of)}
+
+
+class PairingProblem:
+    """
+    The part of a pairing that is left to solve once the 'always' constraints are fixed.
+    Free givers and free receivers are referred to by their position in `givers` and `receivers`.
+    The solvers take the problem as `forbidden_sets()` and return the receiver position of each giver position.
+
+    Leaving out the givers and receivers of the 'always' pairs contracts each chain of them (A -> B -> C)
+    to a single node: only its last member is a free giver and only its first member is a free receiver,
+    so the members in between are not part of the problem at all. Closed cycles drop out entirely.
+    """
+
+    __slots__ = (
+        "table",
+        "always",
+        "never",
+        "groups",
+        "givers",
+        "receivers",
+        "_receiver_pos",
+    )
+
+    def __init__(
+        self,
+        table: NameTable,
+        always: list[AlwaysConstraint],
+        never: list[NeverConstraint],
+        givers: array | None = None,
+        receivers: array | None = None,
+        groups: array | None = None,
+    ) -> None:
+        """
+        :param givers: The ids of the free givers. By default, everyone without an 'always' constraint.
+        :param receivers: The ids of the free receivers. By default, everyone who does not receive through an 'always' constraint.
+        :param groups: The group label of each participant id, or -1 if they are not in a group.
+            Members of a group never give to each other.
+        """
+        self.table = table
+        self.always = always
+        self.never = never
+        self.groups = groups
+        if givers is None:
+            fixed_givers = {c.giver for c in always}
+            givers = array("I", (i for i in range(len(table)) if i not in fixed_givers))
+        if receivers is None:
+            fixed_receivers = {c.receiver for c in always}
+            receivers = array(
+                "I", (i for i in range(len(table)) if i not in fixed_receivers)
+            )
+        self.givers = givers
+        self.receivers = receivers
+        self._receiver_pos = array("i", [-1]) * len(table)
+        for pos, r in enumerate(receivers):
+            self._receiver_pos[r] = pos
+
+    @classmethod
+    def from_names(
+        cls,
+        names: list[str],
+        always_constraints: list[list] | None = None,
+        never_constraints: list[list] | None = None,
+        groups: dict[str, str] | None = None,
+    ) -> "PairingProblem":
+        """
+        Intern the names and constraints. Constraints are expressed with giver first then receiver.
+        :param groups: The group of each participant that is in one
+        """
+        table = NameTable(names)
+        always = []
+        for item in always_constraints or []:
+            assert len(item) == 2, (
+                "always constraint must be expressed as a list of lists with each element having 2 items"
+            )
+            always.append(AlwaysConstraint(table.id(item[0]), table.id(item[1])))
+        # 'never' constraints on someone who is not taking part (e.g. who left) have nothing to forbid
+        never = [
+            NeverConstraint(table.id(giver), table.id(receiver))
+            for giver, receiver in never_constraints or []
+            if giver in table and receiver in table
+        ]
+        group_labels = None
+        if groups:
+            label_of: dict[str, int] = {}
+            group_labels = array("i", [-1]) * len(table)
+            for name, group in groups.items():
+                group_labels[table.id(name)] = label_of.setdefault(group, len(label_of))
+        return cls(table, always, never, groups=group_labels)
+
+    def always_chains(self) -> tuple[list[list[int]], list[list[int]]]:
+        """
+        Split the 'always' pairs into maximal chains and closed cycles of participant ids, where each one gives to the next.
+        Assumes that nobody gives or receives through more than one 'always' pair.
+        """
+        next_of = {c.giver: c.receiver for c in self.always}
+        fixed_receivers = set(next_of.values())
+        seen: set[int] = set()
+        chains = []
+        for head in next_of:
+            if head in fixed_receivers:
+                continue
+            chain = [head]
+            while chain[-1] in next_of:
+                chain.append(next_of[chain[-1]])
+            seen.update(chain)
+            chains.append(chain)
+        cycles = []
+        for start in next_of:
+            if start in seen:
+                continue
+            cycle = [start]
+            while next_of[cycle[-1]] != start:
+                cycle.append(next_of[cycle[-1]])
+            seen.update(cycle)
+            cycles.append(cycle)
+        return chains, cycles
+
+    def split(
+        self, components: list[tuple[list[int], list[int]]]
+    ) -> list["PairingProblem"]:
+        """
+        One standalone problem per component (see `components.connected_components`), with its own small `NameTable`
+        :param components: The free giver positions and free receiver positions of each component
+        :returns: For each component, a problem whose givers and receivers are in the same order as in the component
+        """
+        names = self.table.names
+        parts = []
+        local_ids: list[dict[int, int]] = []
+        part_of_giver: dict[int, int] = {}
+        for i, (giver_positions, receiver_positions) in enumerate(components):
+            member_ids = dict.fromkeys(
+                [self.givers[g] for g in giver_positions]
+                + [self.receivers[r] for r in receiver_positions]
+            )
+            local_ids.append({pid: j for j, pid in enumerate(member_ids)})
+            for g in giver_positions:
+                part_of_giver[self.givers[g]] = i
+        never: list[list[NeverConstraint]] = [[] for _ in components]
+        for c in self.never:
+            i = part_of_giver.get(c.giver, -1)
+            if i != -1 and c.receiver in local_ids[i]:
+                local = local_ids[i]
+                never[i].append(NeverConstraint(local[c.giver], local[c.receiver]))
+        for i, (giver_positions, receiver_positions) in enumerate(components):
+            local = local_ids[i]
+            groups = None
+            if self.groups is not None:
+                groups = array("i", (self.groups[pid] for pid in local))
+            parts.append(
+                PairingProblem(
+                    NameTable([names[pid] for pid in local]),
+                    [],
+                    never[i],
+                    givers=array("I", (local[self.givers[g]] for g in giver_positions)),
+                    receivers=array(
+                        "I", (local[self.receivers[r]] for r in receiver_positions)
+                    ),
+                    groups=groups,
+                )
+            )
+        return parts
+
+    @property
+    def size(self) -> int:
+        """Number of free givers (and free receivers)"""
+        return len(self.givers)
+
+    def receiver_position(self, receiver_id: int) -> int:
+        """Position of the receiver among the free receivers, or -1 if it is not free"""
+        return self._receiver_pos[receiver_id]
+
+    def forbidden_sets(self) -> list[set[int] | GroupExclusions]:
+        """
+        For each free giver, the positions of the free receivers it may not give to
+        (itself, 'never' constraints and its group). Givers in a group get a `GroupExclusions`, the others a set.
+        """
+        forbidden: list[set[int] | GroupExclusions] = []
+        others: list[set[int]] = []
+        giver_pos = {g: i for i, g in enumerate(self.givers)}
+        for g in self.givers:
+            excluded = set()
+            if self._receiver_pos[g] != -1:
+                excluded.add(self._receiver_pos[g])
+            others.append(excluded)
+        for c in self.never:
+            if c.giver in giver_pos and self._receiver_pos[c.receiver] != -1:
+                others[giver_pos[c.giver]].add(self._receiver_pos[c.receiver])
+        if self.groups is None:
+            forbidden.extend(others)
+            return forbidden
+
+        receiver_group = array("i", (self.groups[r] for r in self.receivers))
+        members: dict[int, list[int]] = {}
+        for pos, group in enumerate(receiver_group):
+            if group != -1:
+                members.setdefault(group, []).append(pos)
+        for g, excluded in zip(self.givers, others):
+            group = self.groups[g]
+            if group == -1:
+                forbidden.append(excluded)
+            else:
+                forbidden.append(
+                    GroupExclusions(
+                        excluded, group, receiver_group, members.get(group, [])
+                    )
+                )
+        return forbidden
+
+    def cost_sets(
+        self, penalties: dict[tuple[int, int], float]
+    ) -> list[dict[int, float]]:
+        """
+        :param penalties: Cost of giver id -> receiver id pairs. Every other pair costs nothing.
+        :returns: For each free giver, the cost of the free receiver positions that do not cost nothing
+        """
+        giver_pos = {g: i for i, g in enumerate(self.givers)}
+        costs: list[dict[int, float]] = [{} for _ in self.givers]
+        for (giver, receiver), cost in penalties.items():
+            r = self._receiver_pos[receiver]
+            if giver in giver_pos and r != -1:
+                costs[giver_pos[giver]][r] = cost
+        return costs
+
+    def forbidden_matrix(self) -> np.ndarray:
+        """Boolean matrix form of `forbidden_sets`: entry (g, r) is True iff giver position g may not give to receiver position r"""
+        forbidden = np.zeros((len(self.givers), len(self.receivers)), dtype=bool)
+        if self.groups is not None:
+            groups = np.asarray(self.groups)
+            giver_group = groups[np.asarray(self.givers, dtype=np.intp)]
+            receiver_group = groups[np.asarray(self.receivers, dtype=np.intp)]
+            forbidden |= (giver_group[:, None] == receiver_group[None, :]) & (
+                giver_group[:, None] != -1
+            )
+        for g, excluded in enumerate(self.forbidden_sets()):
+            if isinstance(excluded, GroupExclusions):
+                excluded = excluded.others
+            if excluded:
+                forbidden[g, list(excluded)] = True
+        return forbidden
+
+    def assignment(self, receiver_positions) -> Assignment:
+        """
+        Combine the fixed 'always' pairs with a solution to the free part of the problem
+        :param receiver_positions: For each free giver position, the position of its receiver
+        """
+        receiver_of = array("I", [0]) * len(self.table)
+        for c in self.always:
+            receiver_of[c.giver] = c.receiver
+        receivers = self.receivers
+        for g, r in zip(self.givers, receiver_positions):
+            receiver_of[g] = receivers[r]
+        return Assignment(self.table, receiver_of)
@@ -0,0 +1,108 @@
+"""
+Run independent randomized restarts of the search in a process pool.
+
+Restart number i always uses `search.stream_rng(random_seed, i)`, and the result is the assignment
+found by the lowest-numbered restart that succeeds. This is the same assignment that running the
+restarts one after the other would give, so the output for a given seed does not depend on the
+number of workers.
+"""
+
+import concurrent.futures
+import os
+from collections.abc import Sequence, Set
+
+from .search import SearchLimitExceeded, shuffled_search, stream_rng
+from .stats import SolverStats
+
+# set in each worker process by `_init_worker` so that the problem is only sent once per worker
+_forbidden: Sequence[Set[int]] = []
+
+
+def _init_worker(forbidden: Sequence[Set[int]]) -> None:
+    global _forbidden
+    _forbidden = forbidden
+
+
+def run_stream(
+    forbidden: Sequence[Set[int]],
+    random_seed: int,
+    stream: int,
+    max_nodes: int | None,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    Run restart number `stream`
+    :returns: The assignment found, or None if the search ran out of nodes or there is no valid assignment
+    """
+    if stats is not None:
+        stats.attempts += 1
+    try:
+        return shuffled_search(
+            forbidden,
+            stream_rng(random_seed, stream),
+            max_nodes=max_nodes,
+            stats=stats,
+        )
+    except SearchLimitExceeded:
+        return None
+
+
+def _run_stream_in_worker(
+    random_seed: int, stream: int, max_nodes: int | None, collect_stats: bool
+) -> tuple[list[int] | None, SolverStats | None]:
+    stats = SolverStats() if collect_stats else None
+    return run_stream(_forbidden, random_seed, stream, max_nodes, stats), stats
+
+
+def parallel_search(
+    forbidden: Sequence[Set[int]],
+    random_seed: int,
+    num_streams: int,
+    max_nodes: int | None,
+    max_workers: int | None = None,
+    stats: SolverStats | None = None,
+) -> tuple[int, list[int]] | None:
+    """
+    Run up to `num_streams` restarts across `max_workers` processes (by default, one per core).
+    If `stats` is given, it counts the work of every restart that finished, including ones after the one returned.
+    :returns: The index of the lowest-numbered restart that succeeded and the assignment it found,
+        or None if none of them did
+    """
+    if max_workers is None:
+        max_workers = os.process_cpu_count() or 1
+    results: dict[int, list[int] | None] = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(forbidden,)
+    ) as pool:
+        futures: dict[concurrent.futures.Future, int] = {}
+        next_stream = 0
+        # the lowest stream whose result we do not know yet
+        lowest_pending = 0
+        while lowest_pending < num_streams:
+            # keep every worker busy with the next streams in order
+            while next_stream < num_streams and len(futures) < 2 * max_workers:
+                future = pool.submit(
+                    _run_stream_in_worker,
+                    random_seed,
+                    next_stream,
+                    max_nodes,
+                    stats is not None,
+                )
+                futures[future] = next_stream
+                next_stream += 1
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                result, stream_stats = future.result()
+                results[futures.pop(future)] = result
+                if stats is not None and stream_stats is not None:
+                    stats.merge(stream_stats)
+            while lowest_pending in results:
+                result = results[lowest_pending]
+                if result is not None:
+                    for future in futures:
+                        future.cancel()
+                    return lowest_pending, result
+                lowest_pending += 1
+    return None
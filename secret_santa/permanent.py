@@ -0,0 +1,306 @@
+"""
+Count the valid assignments of a pairing problem, i.e. the permanent of its allowed giver x receiver matrix.
+
+Exact counts come from one of two dynamic programs, each given a budget of states:
+- Rook polynomial of the forbidden cells, for sparse constraints. If r_k is the number of ways to pick k forbidden
+  cells with no two in the same row or column, inclusion-exclusion gives sum_k (-1)^k r_k (n - k)! valid assignments.
+  Rows and columns that share no forbidden cells are independent, so the rook polynomial is the product of the
+  rook polynomials of the connected components of the forbidden cells (a household, a few 'never' pairs),
+  which stay small even when n is large. Components of a single cell (a giver who only excludes themselves)
+  are not multiplied in: their share of the sum has a closed form, a recurrence like that of the derangement numbers.
+- Assign the givers one at a time, with the set of receivers used so far as the state, for dense constraints.
+  Givers with the fewest allowed receivers go first, which keeps the number of distinct states low.
+The count can have as many bits as n!, so we only count exactly when that is small enough.
+Otherwise we estimate the count by sequential importance sampling: give each giver a receiver chosen uniformly
+from the ones still available, and weight the assignment by the product of the number of choices.
+The mean weight is an unbiased estimate of the count. The samples are drawn together with NumPy, each one from
+its own pool of available receivers, so a step costs time in the number of samples and the giver's exclusions.
+"""
+
+import math
+from collections.abc import Sequence, Set
+from typing import NamedTuple
+
+import numpy as np
+
+# give up on an exact count once a dynamic program has this many states at once
+MAX_EXACT_STATES = 50_000
+# only count exactly if the count could have at most this many bits (n! has about 120,000 for n = 10,000)
+MAX_EXACT_BITS = 200_000
+# give up on the rook polynomial once the product of the components' polynomials has a higher degree
+MAX_ROOK_DEGREE = 1_000
+# samples for the estimate
+DEFAULT_NUM_SAMPLES = 1000
+# the estimate draws its samples in batches of at most this many samples times givers
+MAX_BATCH_CELLS = 16_000_000
+# redraws of an excluded receiver before looking through all of the available ones
+NUM_REDRAWS = 8
+
+
+class AssignmentCount(NamedTuple):
+    # natural log of the number of valid assignments, -inf if there are none
+    log_count: float
+    # the exact number of valid assignments, None if it was estimated
+    exact: int | None
+    # estimated standard error of the estimate relative to the estimate, 0 if the count is exact
+    relative_error: float
+
+
+class _TooManyStates(Exception):
+    pass
+
+
+def _rook_polynomial(cells: dict[int, list[int]], max_states: int) -> list[int]:
+    """
+    :param cells: For each row of the board, the columns of its cells. Columns are 0..m-1.
+    :returns: r_k for k = 0, 1, ...
+    """
+    # number of ways to place rooks in the rows so far, by the set of columns they use
+    ways = {0: 1}
+    for columns in cells.values():
+        new_ways = dict(ways)
+        for mask, count in ways.items():
+            for c in columns:
+                bit = 1 << c
+                if not mask & bit:
+                    new_ways[mask | bit] = new_ways.get(mask | bit, 0) + count
+            if len(new_ways) > max_states:
+                raise _TooManyStates
+        ways = new_ways
+    r = [0] * (len(cells) + 1)
+    for mask, count in ways.items():
+        r[mask.bit_count()] += count
+    return r
+
+
+def _multiply(a: list[int], b: list[int]) -> list[int]:
+    """
+    Multiply polynomials with nonnegative coefficients by packing each one into a single int (Kronecker substitution),
+    which lets Python's fast multiplication of big ints do the work
+    """
+    # every coefficient of the product is at most sum(a) * sum(b)
+    width = ((sum(a) * sum(b)).bit_length() + 8) // 8
+    product = int.from_bytes(
+        b"".join(x.to_bytes(width, "little") for x in a), "little"
+    ) * int.from_bytes(b"".join(y.to_bytes(width, "little") for y in b), "little")
+    packed = product.to_bytes(width * (len(a) + len(b) - 1), "little")
+    return [
+        int.from_bytes(packed[i : i + width], "little")
+        for i in range(0, len(packed), width)
+    ]
+
+
+def _derangement_sums(m: int, t_max: int) -> list[int]:
+    """
+    :returns: For t = 0 .. t_max, the number of permutations of m + t elements in which m given elements
+        do not stay in place. This is D(m), D(m) + D(m + 1), then B(t + 2) = (m + t + 3) B(t + 1) - (t + 1) B(t).
+    """
+    # D(m) and D(m + 1), with D(0) = 1, D(1) = 0 and D(k) = (k - 1) (D(k - 1) + D(k - 2))
+    d0, d1 = 1, 0
+    for k in range(2, m + 2):
+        d0, d1 = d1, (k - 1) * (d0 + d1)
+    b = [d0, d0 + d1]
+    for t in range(t_max - 1):
+        b.append((m + t + 3) * b[-1] - (t + 1) * b[-2])
+    return b[: t_max + 1]
+
+
+def _count_by_rooks(forbidden: Sequence[Set[int]], max_states: int) -> int:
+    n = len(forbidden)
+    # union-find over rows 0..n-1 and columns n..2n-1
+    parent = list(range(2 * n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for g, excluded in enumerate(forbidden):
+        for r in excluded:
+            parent[find(g)] = find(n + r)
+    components: dict[int, list[int]] = {}
+    for g, excluded in enumerate(forbidden):
+        if excluded:
+            components.setdefault(find(g), []).append(g)
+
+    polynomials = []
+    degree = 0
+    num_single = 0
+    for rows in components.values():
+        if len(rows) == 1 and len(forbidden[rows[0]]) == 1:
+            # its rook polynomial is 1 + x
+            num_single += 1
+            continue
+        columns = sorted({r for g in rows for r in forbidden[g]})
+        if len(columns) <= len(rows):
+            local = {r: i for i, r in enumerate(columns)}
+            cells = {g: [local[r] for r in forbidden[g]] for g in rows}
+        else:
+            # the same board with rows and columns swapped has fewer columns
+            local = {g: i for i, g in enumerate(rows)}
+            cells = {}
+            for g in rows:
+                for r in forbidden[g]:
+                    cells.setdefault(r, []).append(local[g])
+        polynomials.append(_rook_polynomial(cells, max_states))
+        degree += len(polynomials[-1]) - 1
+        if degree > MAX_ROOK_DEGREE:
+            raise _TooManyStates
+    # multiply in pairs, so that most products are of short polynomials
+    while len(polynomials) > 1:
+        polynomials = [
+            _multiply(*polynomials[i : i + 2])
+            if i + 1 < len(polynomials)
+            else polynomials[i]
+            for i in range(0, len(polynomials), 2)
+        ]
+    polynomial = polynomials[0] if polynomials else [1]
+    # With the single cells, the rook polynomial is polynomial * (1 + x)^m. Summing over the single cells first,
+    # the term of polynomial[k] is (-1)^k polynomial[k] times the number of permutations of n - k elements
+    # in which m given elements do not stay in place.
+    m = num_single
+    sums = _derangement_sums(m, n - m)
+    return sum(
+        (-1) ** k * coefficient * sums[n - m - k]
+        for k, coefficient in enumerate(polynomial)
+    )
+
+
+def _count_by_givers(forbidden: Sequence[Set[int]], max_states: int) -> int:
+    n = len(forbidden)
+    # number of ways to assign the givers so far, by the set of receivers they use
+    ways = {0: 1}
+    # the givers with the fewest allowed receivers first
+    order = sorted(range(n), key=lambda g: -len(forbidden[g]))
+    if order and n - len(forbidden[order[0]]) > max_states:
+        # already the first giver has too many choices
+        raise _TooManyStates
+    for g in order:
+        choices = [r for r in range(n) if r not in forbidden[g]]
+        new_ways: dict[int, int] = {}
+        for mask, count in ways.items():
+            for r in choices:
+                bit = 1 << r
+                if not mask & bit:
+                    new_ways[mask | bit] = new_ways.get(mask | bit, 0) + count
+            if len(new_ways) > max_states:
+                raise _TooManyStates
+        ways = new_ways
+    return sum(ways.values())
+
+
+def exact_count(
+    forbidden: Sequence[Set[int]],
+    max_states: int = MAX_EXACT_STATES,
+    max_bits: int = MAX_EXACT_BITS,
+) -> int | None:
+    """
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not give to
+    :param max_bits: Do not count if the count could have more bits than this, since that takes at least as long
+    :returns: The number of valid assignments, or None if it would take more than `max_states` states to count them
+    """
+    if math.lgamma(len(forbidden) + 1) / math.log(2) > max_bits:
+        return None
+    try:
+        return _count_by_rooks(forbidden, max_states)
+    except _TooManyStates:
+        pass
+    try:
+        return _count_by_givers(forbidden, max_states)
+    except _TooManyStates:
+        return None
+
+
+def _sample_log_weights(
+    excluded: list[np.ndarray],
+    order: list[int],
+    rng: np.random.Generator,
+    num_samples: int,
+) -> np.ndarray:
+    """The log weight of `num_samples` sequential importance samples, giving in `order`"""
+    n = len(excluded)
+    samples = np.arange(num_samples)
+    # the receivers that are still available to each sample are pool[s, :remaining], and pos is the inverse of pool
+    pool = np.tile(np.arange(n, dtype=np.int32), (num_samples, 1))
+    pos = pool.copy()
+    is_excluded = np.zeros(n, dtype=bool)
+    log_weight = np.zeros(num_samples)
+    for step, g in enumerate(order):
+        remaining = n - step
+        ex = excluded[g]
+        num_choices = remaining - (pos[:, ex] < remaining).sum(axis=1)
+        is_excluded[ex] = True
+        # a uniform choice among the available receivers that are not excluded: draw again while it is excluded.
+        # Samples with no choice at all keep what they drew, since their weight is 0 anyway.
+        index = (rng.random(num_samples) * remaining).astype(np.int32)
+        redraw = samples[is_excluded[pool[samples, index]] & (num_choices > 0)]
+        for _ in range(NUM_REDRAWS):
+            if not redraw.size:
+                break
+            index[redraw] = (rng.random(redraw.size) * remaining).astype(np.int32)
+            redraw = redraw[is_excluded[pool[redraw, index[redraw]]]]
+        if redraw.size:
+            # pick the k-th allowed receiver among the available ones, with k uniformly random
+            cumulative = np.cumsum(~is_excluded[pool[redraw, :remaining]], axis=1)
+            k = (rng.random(redraw.size) * cumulative[:, -1]).astype(np.int64)
+            index[redraw] = np.argmax(cumulative > k[:, None], axis=1)
+        is_excluded[ex] = False
+        # move the chosen receiver past the end of the available ones
+        chosen = pool[samples, index]
+        last = pool[samples, remaining - 1]
+        pool[samples, index] = last
+        pos[samples, last] = index
+        pool[samples, remaining - 1] = chosen
+        pos[samples, chosen] = remaining - 1
+        with np.errstate(divide="ignore"):
+            log_weight += np.log(num_choices)
+    return log_weight
+
+
+def estimate_count(
+    forbidden: Sequence[Set[int]],
+    rng: np.random.Generator,
+    num_samples: int = DEFAULT_NUM_SAMPLES,
+) -> tuple[float, float]:
+    """
+    Sequential importance sampling. It takes O(num_samples * (n + number of exclusions)) time
+    when most receivers are allowed, and up to O(num_samples * n^2) when few are.
+    :returns: The natural log of the estimated number of valid assignments, and its relative standard error
+    """
+    n = len(forbidden)
+    excluded = [
+        np.fromiter(forbidden[g], dtype=np.int64, count=len(forbidden[g]))
+        for g in range(n)
+    ]
+    # the givers with the fewest allowed receivers first
+    order = sorted(range(n), key=lambda g: -len(forbidden[g]))
+    batch = max(1, MAX_BATCH_CELLS // max(n, 1))
+    log_weight = np.concatenate(
+        [
+            _sample_log_weights(excluded, order, rng, min(batch, num_samples - start))
+            for start in range(0, num_samples, batch)
+        ]
+    )
+    top = log_weight.max()
+    if top == -np.inf:
+        return -math.inf, 0.0
+    weight = np.exp(log_weight - top)
+    mean = weight.mean()
+    return float(top + np.log(mean)), float(
+        weight.std() / (mean * np.sqrt(num_samples))
+    )
+
+
+def count_assignments(
+    forbidden: Sequence[Set[int]],
+    rng: np.random.Generator,
+    num_samples: int = DEFAULT_NUM_SAMPLES,
+    max_states: int = MAX_EXACT_STATES,
+) -> AssignmentCount:
+    """Count exactly if it takes at most `max_states` states, otherwise estimate with `num_samples` samples"""
+    exact = exact_count(forbidden, max_states)
+    if exact is not None:
+        return AssignmentCount(math.log(exact) if exact else -math.inf, exact, 0.0)
+    log_count, relative_error = estimate_count(forbidden, rng, num_samples)
+    return AssignmentCount(log_count, None, relative_error)
@@ -0,0 +1,205 @@
+"""
+Iterative backtracking search for an assignment of givers to receivers.
+
+The receivers that are still available are kept in an integer bitset, the most constrained giver
+is always assigned next, and after every assignment we check that each constrained giver still
+has at least one receiver left (forward checking). The number of receivers left for each giver is
+kept up to date as receivers are taken and given back, so an assignment costs time in the number of
+givers that exclude its receiver rather than in the number of givers. There is no recursion, so the
+search depth is not limited by Python's recursion limit.
+"""
+
+import random
+from collections.abc import Sequence, Set
+
+from .stats import SolverStats, counting
+
+
+class SearchLimitExceeded(Exception):
+    """Raised when the search expands more nodes than it is allowed to"""
+
+
+def backtracking_search(
+    forbidden: Sequence[Set[int]],
+    max_nodes: int | None = None,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    Assign each giver a distinct receiver, trying receivers in index order.
+    :param forbidden: For each giver (by index), the set of receiver indexes it may not be assigned
+    :param max_nodes: Raise `SearchLimitExceeded` after this many assignments have been tried
+    :param stats: If given, count the nodes, backtracks and forward checks
+    :returns: For each giver, the index of its receiver. None iff there is no valid assignment.
+    """
+    n = len(forbidden)
+    if n == 0:
+        return []
+    remaining = (1 << n) - 1
+    num_remaining = n
+
+    excluded_masks = [sum(1 << r for r in excluded) for excluded in forbidden]
+    # givers with at most one excluded receiver (usually themselves) can only get stuck
+    # at the very end of the search, so they are assigned last and never checked
+    is_constrained = [len(excluded) > 1 for excluded in forbidden]
+    unconstrained = [g for g in range(n) if not is_constrained[g]]
+    # next unconstrained giver to assign, in order
+    next_unconstrained = 0
+
+    # Instead of counting the receivers left for every pending giver after each assignment,
+    # count how many of its excluded receivers are still available: it has `num_remaining` minus that many left.
+    # Taking (or giving back) a receiver only changes the count of the givers that exclude it.
+    excluded_by: list[list[int]] = [[] for _ in range(n)]
+    excluded_left = [0] * n
+    for g, excluded in enumerate(forbidden):
+        if is_constrained[g]:
+            excluded_left[g] = len(excluded)
+            for r in excluded:
+                excluded_by[r].append(g)
+    # the constrained givers that have not been assigned yet, by `excluded_left`
+    buckets: list[dict[int, None]] = [{} for _ in range(max(excluded_left) + 1)]
+    is_pending = is_constrained[:]
+    num_pending = 0
+    for g in range(n):
+        if is_constrained[g]:
+            buckets[excluded_left[g]][g] = None
+            num_pending += 1
+    # no bucket above this one has any givers
+    top = len(buckets) - 1
+
+    receiver_of = [-1] * n
+    nodes = 0
+    backtracks = 0
+    checks = 0
+
+    def candidates(g: int) -> int:
+        return remaining & ~excluded_masks[g]
+
+    def take(r: int) -> None:
+        nonlocal remaining, num_remaining, checks
+        remaining ^= 1 << r
+        num_remaining -= 1
+        checks += len(excluded_by[r])
+        for h in excluded_by[r]:
+            k = excluded_left[h]
+            excluded_left[h] = k - 1
+            if is_pending[h]:
+                del buckets[k][h]
+                buckets[k - 1][h] = None
+
+    def give_back(r: int) -> None:
+        nonlocal remaining, num_remaining, top
+        remaining |= 1 << r
+        num_remaining += 1
+        for h in excluded_by[r]:
+            k = excluded_left[h]
+            excluded_left[h] = k + 1
+            if is_pending[h]:
+                del buckets[k][h]
+                buckets[k + 1][h] = None
+                top = max(top, k + 1)
+
+    def most_constrained() -> int:
+        """:returns: The largest `excluded_left` of any pending giver"""
+        nonlocal top
+        while top > 0 and not buckets[top]:
+            top -= 1
+        return top
+
+    def choose() -> int:
+        """Remove the most constrained giver from the pending givers and return it"""
+        nonlocal next_unconstrained, num_pending
+        if num_pending:
+            g, _ = buckets[most_constrained()].popitem()
+            is_pending[g] = False
+            num_pending -= 1
+            return g
+        g = unconstrained[next_unconstrained]
+        next_unconstrained += 1
+        return g
+
+    def unchoose(g: int) -> None:
+        """Return `g` to the pending givers"""
+        nonlocal next_unconstrained, num_pending, top
+        if is_constrained[g]:
+            buckets[excluded_left[g]][g] = None
+            is_pending[g] = True
+            num_pending += 1
+            top = max(top, excluded_left[g])
+        else:
+            next_unconstrained -= 1
+
+    g = choose()
+    # each frame is [giver, receivers that are left to try]
+    frames = [[g, candidates(g)]]
+    try:
+        while frames:
+            frame = frames[-1]
+            g, cands = frame
+            if receiver_of[g] != -1:
+                # undo the previous choice for this giver
+                give_back(receiver_of[g])
+                receiver_of[g] = -1
+            if cands == 0:
+                frames.pop()
+                backtracks += 1
+                unchoose(g)
+                continue
+
+            low = cands & -cands
+            frame[1] = cands ^ low
+            receiver_of[g] = low.bit_length() - 1
+            take(receiver_of[g])
+            nodes += 1
+            if max_nodes is not None and nodes > max_nodes:
+                raise SearchLimitExceeded(f"Expanded more than {max_nodes} nodes")
+            if num_remaining == 0:
+                return receiver_of
+
+            # forward checking: do not go deeper if some constrained giver has nobody left
+            if num_pending and most_constrained() == num_remaining:
+                continue
+            h = choose()
+            frames.append([h, candidates(h)])
+        return None
+    finally:
+        if stats is not None:
+            stats.nodes_expanded += nodes
+            stats.backtracks += backtracks
+            stats.constraint_checks += checks
+
+
+def shuffled_search(
+    forbidden: Sequence[Set[int]],
+    rng: random.Random,
+    max_nodes: int | None = None,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    Run `backtracking_search` on a random renumbering of the givers and receivers, so that it finds a random assignment.
+    Raises `SearchLimitExceeded` like `backtracking_search`.
+    :returns: For each giver, the index of its receiver (in the original numbering). None iff there is no valid assignment.
+    """
+    n = len(forbidden)
+    rng = counting(rng, stats)
+    giver_order = list(range(n))
+    rng.shuffle(giver_order)
+    receiver_order = list(range(n))
+    rng.shuffle(receiver_order)
+    # the search tries receivers in index order, so renumber them by the shuffle
+    new_index = [0] * n
+    for i, r in enumerate(receiver_order):
+        new_index[r] = i
+    shuffled = [{new_index[r] for r in forbidden[g]} for g in giver_order]
+
+    result = backtracking_search(shuffled, max_nodes=max_nodes, stats=stats)
+    if result is None:
+        return None
+    receiver_of = [0] * n
+    for g, r in zip(giver_order, result):
+        receiver_of[g] = receiver_order[r]
+    return receiver_of
+
+
+def stream_rng(random_seed: int, stream: int) -> random.Random:
+    """The random number generator for restart number `stream`. It only depends on the seed and the stream index."""
+    return random.Random(f"{random_seed}:{stream}")
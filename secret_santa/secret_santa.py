@@ -1,12 +1,34 @@
+import concurrent.futures
 import logging
+import math
 import random
 import sys
+import time
+from array import array
+from collections.abc import Mapping, Sequence
+from contextlib import nullcontext
+from typing import NamedTuple
 
+import numpy as np
+
+from . import permanent, vectorized
+from .cache import cache_key, get_cached_pairings, open_cache, save_cached_pairings
+from .components import connected_components
+from .cycles import lengthen_cycles
+from .feasibility import find_hall_violation
 from .file_utils import (
     read_participants_json,
     read_constraints_json,
     ParticipantSchema,
 )
+from .matching import random_perfect_matching, repair_matching
+from .min_cost import min_cost_assignment
+from .model import NameTable, NeverConstraint, PairingProblem
+from .parallel import parallel_search, run_stream
+from .search import backtracking_search
+from .soft import soft_assignment
+from .stats import SolverStats, counting, timed
+from .validation import check_problems, validate_pairings
 
 
 def read_constraints(fname: str) -> dict[str, list]:
@@ -29,29 +51,105 @@ def is_derangement(l1: list, l2: list) -> bool:
     return True
 
 
-def fisher_yates(l: list) -> None:
-    """in-place shuffle of list l"""
+def fisher_yates(l: list, rng: random.Random | None = None) -> None:
+    """in-place shuffle of list l
+    :param rng: Source of randomness. By default the global `random` state."""
     assert isinstance(l, list)
-    random.shuffle(l)
+    if rng is None:
+        random.shuffle(l)
+    else:
+        rng.shuffle(l)
 
 
-def get_derangement(l: list) -> list:
+def get_derangement(l: list, rng: random.Random | None = None) -> list:
     """Return a derangement of the list l. Expected runtime is e * O(n).
     l is not modified
     https://en.wikipedia.org/wiki/Derangement
     """
     assert isinstance(l, list)
-    # necessary because we do not actually want to modify l
-    l2 = l[:]
-    while not is_derangement(l, l2):
-        fisher_yates(l2)
-    return l2
+    # shuffle positions rather than items so that the check compares ints
+    identity = list(range(len(l)))
+    perm = identity[:]
+    while not is_derangement(identity, perm):
+        fisher_yates(perm, rng)
+    return [l[i] for i in perm]
+
+
+def _normalized_derangement_counts(n: int) -> list[float]:
+    """
+    Return d(k) = D(k) / k! for k = 0..n, where D(k) is the number of derangements of k items.
+    Uses D(k) = (k - 1) * (D(k - 1) + D(k - 2)), which keeps everything close to 1/e in floating point.
+    """
+    d = [1.0, 0.0]
+    for k in range(2, n + 1):
+        d.append(((k - 1) * d[k - 1] + d[k - 2]) / k)
+    return d[: n + 1]
+
+
+def get_uniform_derangement(l: list, rng: random.Random | None = None) -> list:
+    """Return a uniformly random derangement of the list l in a single linear pass, without rejection.
+    This is the algorithm of Martinez, Panholzer and Prodinger (2008), "Generating random derangements".
+    l is not modified
+    """
+    assert isinstance(l, list)
+    n = len(l)
+    assert n != 1, "A single item cannot be deranged"
+    if rng is None:
+        rng = random.Random(random.getrandbits(64))
+    d = _normalized_derangement_counts(n)
+    perm = list(range(n))
+    mark = [False] * n
+    i = n - 1
+    # number of items which are not yet part of a closed cycle
+    u = n
+    while u >= 2:
+        if not mark[i]:
+            j = rng.randrange(i)
+            while mark[j]:
+                j = rng.randrange(i)
+            perm[i], perm[j] = perm[j], perm[i]
+            # probability that j closes a cycle is (u - 1) * D(u - 2) / D(u)
+            if rng.random() < d[u - 2] / (u * d[u]):
+                mark[j] = True
+                u -= 1
+            u -= 1
+        i -= 1
+    return [l[k] for k in perm]
+
+
+def get_cyclic_permutation(l: list, rng: random.Random | None = None) -> list:
+    """Return a uniformly random permutation of the list l that is a single cycle, with Sattolo's algorithm.
+    Giving to the returned item at the same index makes one gift circle through everyone.
+    l is not modified
+    """
+    assert isinstance(l, list)
+    if rng is None:
+        rng = random.Random(random.getrandbits(64))
+    perm = list(range(len(l)))
+    for i in range(len(perm) - 1, 0, -1):
+        # unlike Fisher-Yates, never leave an item in place
+        j = rng.randrange(i)
+        perm[i], perm[j] = perm[j], perm[i]
+    return [l[k] for k in perm]
+
+
+DERANGEMENT_METHODS = ["rejection", "direct"]
 
 
-def secret_santa_hat_simple(names: list[str]) -> dict[str, str]:
-    """This is the nice and simple way of generating correct pairings"""
+def secret_santa_hat_simple(
+    names: list[str], method: str = "rejection", rng: random.Random | None = None
+) -> dict[str, str]:
+    """This is the nice and simple way of generating correct pairings
+    :param method: Either "rejection" to shuffle until we get a derangement (expected e shuffles),
+        or "direct" to sample a uniform derangement in one pass with `get_uniform_derangement`
+    :param rng: Source of randomness. By default the global `random` state.
+    """
     assert isinstance(names, list)
-    derangement = get_derangement(names)
+    assert method in DERANGEMENT_METHODS, f"method must be one of {DERANGEMENT_METHODS}"
+    if method == "direct":
+        derangement = get_uniform_derangement(names, rng)
+    else:
+        derangement = get_derangement(names, rng)
     d = {}
     for giver, receiver in zip(names, derangement):
         assert giver != receiver
@@ -59,46 +157,54 @@ def secret_santa_hat_simple(names: list[str]) -> dict[str, str]:
     return d
 
 
+def _problem_from_lists(
+    givers: list[str], receivers: list[str], never_constraints: list[list] | None
+) -> PairingProblem:
+    """Intern the givers and receivers in the given order. Never constraints that mention anyone else are ignored."""
+    table = NameTable(list(dict.fromkeys(givers + receivers)))
+    never = [
+        NeverConstraint(table.id(giver), table.id(receiver))
+        for giver, receiver in never_constraints or []
+        if giver in table and receiver in table
+    ]
+    return PairingProblem(
+        table,
+        [],
+        never,
+        givers=array("I", (table.id(g) for g in givers)),
+        receivers=array("I", (table.id(r) for r in receivers)),
+    )
+
+
 def secret_santa_search(
     assignments: dict[str, str],
     available_givers: list[str],
     available_receivers: list[str],
+    never_constraints: list[list] | None = None,
+    max_nodes: int | None = None,
 ) -> bool:
     """
     This is an implementation of secret santa as a search program.
     This implementation supports pre-existing assignments, just make sure to set other variables correctly
     To support fully random assignments, both arrays should be shuffled prior to running this method
-    warning: in-place modification of assignments"""
+    Never constraints are pruned during the search. See `search.backtracking_search`.
+    warning: in-place modification of assignments and available_givers"""
     assert isinstance(assignments, dict)
     assert isinstance(available_givers, list)
     assert isinstance(available_receivers, list)
 
-    if (
-        len(available_givers) == 1
-        and len(available_receivers) == 1
-        and available_givers[0] == available_receivers[0]
-    ):
-        # failed to create a full assignment
+    if len(available_givers) != len(available_receivers):
         return False
-
-    if available_givers == []:
-        assert available_receivers == []
-        return True
-
-    g = available_givers.pop()
-    for r in available_receivers:
-        if r != g:
-            r2 = available_receivers.copy()
-            r2.remove(r)
-            assignments[g] = r
-            if secret_santa_search(assignments, available_givers, r2):
-                return True
-            else:
-                assignments.pop(g)
-
-    # restore g to its former position
-    available_givers.insert(0, g)
-    return False
+    problem = _problem_from_lists(
+        available_givers, available_receivers, never_constraints
+    )
+    result = backtracking_search(problem.forbidden_sets(), max_nodes=max_nodes)
+    if result is None:
+        return False
+    for g, r in zip(available_givers, result):
+        assignments[g] = available_receivers[r]
+    available_givers.clear()
+    return True
 
 
 def check_always_constraints(
@@ -119,8 +225,9 @@ def check_always_constraints(
     if num_constraints == 0:
         logging.debug("No always constraints found")
     else:
-        logging.info(
-            f"[secret_santa.check_always_constraints] All {num_constraints} always constraints are satisfied"
+        logging.debug(
+            "[secret_santa.check_always_constraints] All %d always constraints are satisfied",
+            num_constraints,
         )
     return True
 
@@ -143,89 +250,847 @@ def check_never_constraints(
     if num_constraints == 0:
         logging.debug("No never constraints found")
     else:
-        logging.info(f"All {num_constraints} never constraints are satisfied")
+        logging.debug("All %d never constraints are satisfied", num_constraints)
+    return True
+
+
+def check_group_constraints(
+    assignments: dict[str, str], groups: dict[str, str]
+) -> bool:
+    """
+    Return true iff no giver gives to someone in their own group
+    :param groups: The group of each participant that is in one
+    """
+    for giver, receiver in assignments.items():
+        group = groups.get(giver)
+        if group is not None and groups.get(receiver) == group:
+            return False
+    logging.debug("All %d group memberships are respected", len(groups))
+    return True
+
+
+def gift_cycles(assignments: dict[str, str]) -> list[list[str]]:
+    """
+    :param assignments: A full assignment, where everyone gives and receives once
+    :returns: The gift cycles, each starting with its first giver in `assignments` and following the gifts
+    """
+    seen: set[str] = set()
+    cycles = []
+    for start in assignments:
+        if start in seen:
+            continue
+        cycle = [start]
+        seen.add(start)
+        while assignments[cycle[-1]] != start:
+            cycle.append(assignments[cycle[-1]])
+            seen.add(cycle[-1])
+        cycles.append(cycle)
+    return cycles
+
+
+SOLVER_METHODS = ["matching", "search", "vectorized", "auto"]
+# with method "search", restart with a new shuffle after this many nodes per giver
+SEARCH_NODES_PER_GIVER = 50
+SEARCH_MAX_RESTARTS = 10
+# seconds to spend improving an assignment with penalties once a valid one is known
+MIN_COST_TIME_BUDGET = 10.0
+# secret_santa_hat_multi draws all its rounds again this many times before giving up
+MULTI_GIFT_MAX_RESTARTS = 10
+# with a minimum cycle length, merge the cycles of this many fresh assignments before giving up
+CYCLE_MAX_RESTARTS = 20
+# with method "auto", use rejection sampling if at least this fraction of all permutations are valid assignments
+AUTO_MIN_ACCEPTANCE = 1e-3
+# with method "auto", estimate the number of valid assignments with this many samples if it cannot be counted
+AUTO_COUNT_SAMPLES = 64
+# with method "auto", give up on an exact count after this many states, so that choosing stays cheap
+AUTO_MAX_STATES = 2_000
+# with method "auto", use matching without counting above this many givers, where counting costs more than it saves
+AUTO_MAX_COUNT_SIZE = 5_000
+
+
+def secret_santa_matching(
+    assignments: dict[str, str],
+    available_givers: list[str],
+    available_receivers: list[str],
+    never_constraints: list[list] | None = None,
+    rng: random.Random | None = None,
+) -> bool:
+    """
+    Complete `assignments` with a random perfect matching from the available givers to the available receivers.
+    Self-pairings and never constraints are excluded from the giver -> receiver graph up front,
+    so this finds a valid assignment whenever one exists.
+    :param rng: Source of randomness. By default it is seeded from the global `random` state.
+    warning: in-place modification of assignments"""
+    assert isinstance(assignments, dict)
+    if rng is None:
+        rng = random.Random(random.getrandbits(64))
+    if len(available_givers) != len(available_receivers):
+        return False
+    problem = _problem_from_lists(
+        available_givers, available_receivers, never_constraints
+    )
+    matching = random_perfect_matching(problem.forbidden_sets(), rng)
+    if matching is None:
+        return False
+    for g, r in zip(available_givers, matching):
+        assignments[g] = available_receivers[r]
     return True
 
 
+def _find_infeasibility(
+    problem: PairingProblem,
+) -> tuple[list[str], list[str]] | None:
+    violation = find_hall_violation(problem.forbidden_sets())
+    if violation is None:
+        return None
+    names = problem.table.names
+    givers = [names[problem.givers[g]] for g in violation.givers]
+    receivers = [names[problem.receivers[r]] for r in violation.receivers]
+    return givers, receivers
+
+
+def find_infeasibility(
+    names: list[str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+) -> tuple[list[str], list[str]] | None:
+    """
+    Check whether the constraints can be satisfied at all, in polynomial time.
+    :param groups: The group of each participant that is in one
+    :returns: None if there is a valid assignment.
+        Otherwise a list of givers and the (shorter) list of the only receivers that they may give to.
+    """
+    problem = PairingProblem.from_names(
+        names, always_constraints, never_constraints, groups
+    )
+    return _find_infeasibility(problem)
+
+
+def count_assignments(
+    names: list[str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+    num_samples: int = permanent.DEFAULT_NUM_SAMPLES,
+    random_seed: int = 0,
+) -> permanent.AssignmentCount:
+    """
+    Count the assignments that satisfy the constraints, to see how much they narrow the choices.
+    The count is exact when it can be done quickly (small groups, or few constraints), otherwise it is estimated.
+    :param groups: The group of each participant that is in one
+    :param num_samples: Samples to draw for an estimate. The relative error shrinks with the square root of this.
+    :param random_seed: Seed for an estimate
+    """
+    problem = PairingProblem.from_names(
+        names, always_constraints, never_constraints, groups
+    )
+    _check_conflicts(problem)
+    return permanent.count_assignments(
+        problem.forbidden_sets(),
+        np.random.default_rng(random_seed),
+        num_samples=num_samples,
+    )
+
+
+def _check_conflicts(problem: PairingProblem) -> None:
+    """
+    Exit if the 'always' pairs contradict each other (someone giving or receiving twice, or giving to themselves),
+    or if an 'always' pair is also forbidden by a 'never' constraint or a group.
+    Otherwise, log how much the 'always' chains shrink the problem.
+    """
+    table = problem.table
+    fixed: dict[int, int] = {}
+    fixed_giver_of: dict[int, int] = {}
+    for a in problem.always:
+        if a.giver == a.receiver:
+            logging.critical(
+                "Constraint %s -> %s is an 'always' constraint to themselves",
+                table.name(a.giver),
+                table.name(a.receiver),
+            )
+            sys.exit(1)
+        if a.giver in fixed:
+            logging.critical(
+                "%s has two 'always' receivers: %s and %s",
+                table.name(a.giver),
+                table.name(fixed[a.giver]),
+                table.name(a.receiver),
+            )
+            sys.exit(1)
+        if a.receiver in fixed_giver_of:
+            logging.critical(
+                "%s has two 'always' givers: %s and %s",
+                table.name(a.receiver),
+                table.name(fixed_giver_of[a.receiver]),
+                table.name(a.giver),
+            )
+            sys.exit(1)
+        fixed[a.giver] = a.receiver
+        fixed_giver_of[a.receiver] = a.giver
+    groups = problem.groups
+    if groups is not None:
+        for a in problem.always:
+            if groups[a.giver] != -1 and groups[a.giver] == groups[a.receiver]:
+                logging.critical(
+                    "Constraint %s -> %s is an 'always' constraint within a group",
+                    table.name(a.giver),
+                    table.name(a.receiver),
+                )
+                sys.exit(1)
+    for c in problem.never:
+        if fixed.get(c.giver) == c.receiver:
+            logging.critical(
+                "Constraint %s -> %s is both an 'always' and a 'never' constraint",
+                table.name(c.giver),
+                table.name(c.receiver),
+            )
+            sys.exit(1)
+    if problem.always:
+        chains, cycles = problem.always_chains()
+        logging.debug(
+            "Contracted %d 'always' pairs into %d chains and %d closed cycles, %d of %d givers are left to pair",
+            len(problem.always),
+            len(chains),
+            len(cycles),
+            problem.size,
+            len(table),
+        )
+
+
+def _check_feasible(problem: PairingProblem) -> None:
+    """Exit with an explanation if no assignment satisfies the constraints"""
+    infeasibility = _find_infeasibility(problem)
+    if infeasibility is None:
+        return
+    givers, receivers = infeasibility
+    logging.critical(
+        "No valid assignment satisfies the constraints: these %d givers can only give to these %d receivers",
+        len(givers),
+        len(receivers),
+    )
+    logging.critical("Givers: %s", ", ".join(givers))
+    logging.critical("Receivers: %s", ", ".join(receivers))
+    sys.exit(1)
+
+
+def _choose_method(
+    problem: PairingProblem,
+    rng: random.Random,
+    penalties: dict[tuple[str, str], float] | None,
+) -> str:
+    """
+    Use uniform rejection sampling if enough random permutations are valid assignments, otherwise matching.
+    The fraction of valid permutations is the number of valid assignments divided by n!.
+    """
+    if penalties:
+        return "matching"
+    if problem.size > AUTO_MAX_COUNT_SIZE:
+        logging.debug(
+            "Too many givers (%d) to count the valid assignments, using method 'matching'",
+            problem.size,
+        )
+        return "matching"
+    count = permanent.count_assignments(
+        problem.forbidden_sets(),
+        np.random.default_rng(rng.getrandbits(64)),
+        num_samples=AUTO_COUNT_SAMPLES,
+        max_states=AUTO_MAX_STATES,
+    )
+    log_acceptance = count.log_count - math.lgamma(problem.size + 1)
+    method = (
+        "vectorized" if log_acceptance >= math.log(AUTO_MIN_ACCEPTANCE) else "matching"
+    )
+    logging.debug(
+        "About %.3g of all permutations are valid assignments, using method '%s'",
+        math.exp(log_acceptance),
+        method,
+    )
+    return method
+
+
+def _solve_matching(
+    problem: PairingProblem, rng: random.Random, stats: SolverStats | None
+) -> list[int]:
+    if stats is not None:
+        stats.attempts += 1
+    matching = random_perfect_matching(problem.forbidden_sets(), rng, stats)
+    if matching is None:
+        _check_feasible(problem)
+        logging.critical("No valid assignment satisfies the 'never' constraints")
+        sys.exit(1)
+    logging.debug("Found an assignment using bipartite matching")
+    return matching
+
+
+def _solve_search(
+    problem: PairingProblem,
+    random_seed: int,
+    workers: int,
+    stats: SolverStats | None,
+) -> list[int]:
+    """
+    Shuffle, then search with the 'never' constraints pruned during the search.
+    Each search gets a node budget. When it runs out we restart with a new shuffle, a bounded number of times.
+    Restart i is seeded from `random_seed` and i, so running the restarts in parallel gives the same result.
+    """
+    forbidden = problem.forbidden_sets()
+    max_nodes = SEARCH_NODES_PER_GIVER * (len(forbidden) + 1)
+    if workers > 1:
+        found = parallel_search(
+            forbidden,
+            random_seed,
+            num_streams=SEARCH_MAX_RESTARTS,
+            max_nodes=max_nodes,
+            max_workers=workers,
+            stats=stats,
+        )
+        if found is not None:
+            logging.debug("Assignment %d is a success", found[0] + 1)
+            return found[1]
+    else:
+        for i in range(SEARCH_MAX_RESTARTS):
+            result = run_stream(forbidden, random_seed, i, max_nodes, stats)
+            if result is not None:
+                logging.debug("Assignment %d is a success", i + 1)
+                return result
+            logging.debug(
+                "assignment %d exceeded the search budget. # failures is %d",
+                i + 1,
+                i + 1,
+            )
+
+    logging.critical(
+        "Exceeded maximum number of failures on satisfying 'never' constraints"
+    )
+    sys.exit(1)
+
+
+def _solve_vectorized(
+    problem: PairingProblem, rng: random.Random, stats: SolverStats | None
+) -> list[int]:
+    """Draw batches of random permutations with NumPy and keep the first one that satisfies every constraint"""
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+    perm = vectorized.rejection_sample(problem.forbidden_matrix(), np_rng, stats=stats)
+    if perm is None:
+        logging.critical(
+            "Failed to sample an assignment that satisfies the 'never' constraints. Try method 'matching'."
+        )
+        sys.exit(1)
+    return perm.tolist()
+
+
+def history_penalties(
+    history: Sequence[Mapping[str, str | list[str]]], decay: float = 0.5
+) -> dict[tuple[str, str], float]:
+    """
+    :param history: Pairings of previous campaigns, most recent first.
+        A campaign with several gifts per giver maps each giver to the list of their receivers.
+    :param decay: Pairs drawn in the most recent campaign cost 1, and each campaign before that costs `decay` times as much
+    :returns: The total cost of each giver -> receiver pair that was drawn before
+    """
+    assert 0 < decay <= 1
+    penalties: dict[tuple[str, str], float] = {}
+    weight = 1.0
+    for pairings in history:
+        for giver, receivers in pairings.items():
+            if isinstance(receivers, str):
+                receivers = [receivers]
+            for receiver in receivers:
+                pair = (giver, receiver)
+                penalties[pair] = penalties.get(pair, 0.0) + weight
+        weight *= decay
+    return penalties
+
+
+def _solve_min_cost(
+    problem: PairingProblem,
+    penalties: dict[tuple[str, str], float],
+    rng: random.Random,
+    stats: SolverStats | None,
+) -> list[int]:
+    table = problem.table
+    costs = problem.cost_sets(
+        {
+            (table.id(giver), table.id(receiver)): cost
+            for (giver, receiver), cost in penalties.items()
+            if giver in table and receiver in table
+        }
+    )
+    result = min_cost_assignment(
+        problem.forbidden_sets(),
+        costs,
+        rng,
+        time_budget=MIN_COST_TIME_BUDGET,
+        stats=stats,
+    )
+    if result is None:
+        _check_feasible(problem)
+        logging.critical("No valid assignment satisfies the 'never' constraints")
+        sys.exit(1)
+    total = sum(cost.get(r, 0.0) for cost, r in zip(costs, result))
+    logging.debug("Found an assignment with total penalty %s", total)
+    return result
+
+
+def _solve(
+    problem: PairingProblem,
+    method: str,
+    random_seed: int,
+    workers: int,
+    rng: random.Random,
+    penalties: dict[tuple[str, str], float] | None,
+    stats: SolverStats | None,
+) -> list[int]:
+    """:returns: The receiver position of each giver position"""
+    if method == "search":
+        return _solve_search(problem, random_seed, workers, stats)
+    elif method == "vectorized":
+        return _solve_vectorized(problem, rng, stats)
+    elif penalties:
+        return _solve_min_cost(problem, penalties, rng, stats)
+    else:
+        return _solve_matching(problem, rng, stats)
+
+
+def _solve_part(
+    part: PairingProblem,
+    method: str,
+    seed: int,
+    penalties: dict[tuple[str, str], float] | None,
+    collect_stats: bool,
+) -> tuple[list[int], SolverStats | None]:
+    """Solve one independent part of a problem, possibly in a worker process"""
+    stats = SolverStats() if collect_stats else None
+    rng = counting(random.Random(seed), stats)
+    return _solve(part, method, seed, 1, rng, penalties, stats), stats
+
+
+def _solve_components(
+    problem: PairingProblem,
+    components: list[tuple[list[int], list[int]]],
+    method: str,
+    workers: int,
+    rng: random.Random,
+    penalties: dict[tuple[str, str], float] | None,
+    stats: SolverStats | None,
+) -> list[int]:
+    """
+    Solve each connected component of the allowed graph separately, in a process pool if there are several workers.
+    Each part gets its own seed drawn from `rng` in order, so the result does not depend on the number of workers.
+    """
+    parts = problem.split(components)
+    seeds = [rng.getrandbits(64) for _ in parts]
+    collect_stats = stats is not None
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(
+                    _solve_part,
+                    parts,
+                    [method] * len(parts),
+                    seeds,
+                    [penalties] * len(parts),
+                    [collect_stats] * len(parts),
+                )
+            )
+    else:
+        results = [
+            _solve_part(part, method, seed, penalties, collect_stats)
+            for part, seed in zip(parts, seeds)
+        ]
+
+    receiver_positions = [-1] * problem.size
+    for (giver_positions, part_receivers), (result, part_stats) in zip(
+        components, results
+    ):
+        for g, r in zip(giver_positions, result):
+            receiver_positions[g] = part_receivers[r]
+        if stats is not None and part_stats is not None:
+            stats.merge(part_stats)
+    return receiver_positions
+
+
+def _lengthen_cycles(
+    problem: PairingProblem,
+    receiver_positions: list[int],
+    min_length: int,
+    rng: random.Random,
+    stats: SolverStats | None,
+) -> None:
+    """
+    Merge the cycles of the assignment until none has fewer than `min_length` people (in-place modification of `receiver_positions`).
+    Each chain of 'always' pairs is a single node of the free problem that counts as all of its people.
+    Merging is greedy, so when it gets stuck we start again from a fresh random assignment.
+    """
+    chains, closed = problem.always_chains()
+    for cycle in closed:
+        if len(cycle) < min_length:
+            logging.critical(
+                "The 'always' constraints close a gift cycle of %d people: %s",
+                len(cycle),
+                ", ".join(problem.table.name(i) for i in cycle),
+            )
+            sys.exit(1)
+    giver_pos = {g: i for i, g in enumerate(problem.givers)}
+    # a free giver gives to a free receiver, which is either the same person or the first person of a chain
+    node_of_receiver = [giver_pos.get(r, -1) for r in problem.receivers]
+    weight = [1] * problem.size
+    for chain in chains:
+        tail = giver_pos[chain[-1]]
+        node_of_receiver[problem.receiver_position(chain[0])] = tail
+        weight[tail] = len(chain)
+    forbidden = problem.forbidden_sets()
+    attempt = receiver_positions[:]
+    for _ in range(CYCLE_MAX_RESTARTS):
+        if lengthen_cycles(
+            forbidden, attempt, node_of_receiver, weight, min_length, rng, stats
+        ):
+            receiver_positions[:] = attempt
+            return
+        logging.debug("Merging gift cycles got stuck, starting from a new assignment")
+        fresh = random_perfect_matching(forbidden, rng, stats)
+        # the problem is feasible, since `receiver_positions` is a valid assignment
+        assert fresh is not None
+        attempt = fresh
+    logging.critical(
+        "Failed to find an assignment without gift cycles of fewer than %d people",
+        min_length,
+    )
+    sys.exit(1)
+
+
 def secret_santa_hat(
     names: list[str],
     random_seed: int,
     always_constraints: list[list] | None = None,
     never_constraints: list[list] | None = None,
+    method: str = "matching",
+    workers: int = 1,
+    rng: random.Random | None = None,
+    penalties: dict[tuple[str, str], float] | None = None,
+    stats: SolverStats | None = None,
+    groups: dict[str, str] | None = None,
+    min_cycle_length: int = 2,
+    single_cycle: bool = False,
 ) -> dict[str, str]:
     """
     Constraints are expressed with giver first then receiver
+    This never touches the global `random` state, so it is safe to call from several threads at once.
+    :param method: One of
+        "matching" (default) to solve the pairing as a randomized bipartite matching,
+        "search" to shuffle and search with a bounded number of retries (the original method),
+        "vectorized" for uniform rejection sampling of batches of permutations with NumPy,
+        "auto" for "vectorized" if enough permutations satisfy the constraints (see `count_assignments`), otherwise "matching".
+    :param workers: With method "search", run this many restarts at once in a process pool.
+        With any method, independent parts of the problem (when no pair is allowed between them) are solved
+        in a process pool of this size. The pairings for a given seed are the same for any number of workers.
+    :param rng: Source of randomness for the "matching" and "vectorized" methods.
+        By default a new `random.Random(random_seed)`. Restarts of the "search" method are always seeded from `random_seed`.
+    :param penalties: With method "matching", find the assignment with the smallest total penalty
+        (see `history_penalties` to avoid repeating previous years). Pairs that are not listed cost nothing.
+    :param stats: If given, it is filled in with how much work the solver did and how long each phase took
+    :param groups: The group (e.g. household) of each participant that is in one. Members of a group never give to each other.
+    :param min_cycle_length: Every gift cycle has at least this many people, e.g. 3 for no A -> B -> A.
+        Short cycles of the solver's assignment are merged into longer ones, and the merges ignore `penalties`.
+    :param single_cycle: Everyone is part of one gift circle.
+        Without any constraints, this is a uniformly random circle (Sattolo's algorithm).
     """
     assert isinstance(names, list)
     assert isinstance(random_seed, int)
+    assert method in SOLVER_METHODS, f"method must be one of {SOLVER_METHODS}"
+    assert workers >= 1
+    assert not penalties or method in ("matching", "auto"), (
+        "penalties are only supported by method 'matching'"
+    )
+    # max(2, ...) lets an empty or one-person campaign through with the default value
+    assert 2 <= min_cycle_length <= max(2, len(names)), (
+        "min_cycle_length must be between 2 and the number of names"
+    )
     logging.debug("Generating new pairings...")
     logging.debug("Using random seed %s", random_seed)
-    random.seed(random_seed)
-    base_assignments = {}
-    givers = set(names)
-    receivers = set(names)
-    # fix the always constraints
-    if always_constraints is None:
-        always_constraints = []
-    for item in always_constraints:
-        assert len(item) == 2, (
-            "always constraint must be expressed as a list of lists with each element having 2 items"
+    if rng is None:
+        rng = random.Random(random_seed)
+    rng = counting(rng, stats)
+    if single_cycle:
+        min_cycle_length = len(names)
+        # one name alone would give to themselves, and goes through the usual check instead
+        if len(names) >= 2 and not (always_constraints or never_constraints or groups):
+            with timed(stats, "solve"):
+                return dict(zip(names, get_cyclic_permutation(names, rng)))
+    with timed(stats, "presolve"):
+        problem = PairingProblem.from_names(
+            names, always_constraints, never_constraints, groups
         )
-        giver, receiver = item
-        base_assignments[giver] = receiver
-        givers.remove(giver)
-        receivers.remove(receiver)
-
-    MAX_FAILURES = 10
-    num_failures = 0
-    i = 1
-    while num_failures < MAX_FAILURES:
-        assignments = base_assignments.copy()
-        g2 = list(givers)
-        random.shuffle(g2)
-        r2 = list(receivers)
-        random.shuffle(r2)
-
-        is_success = True
-
-        # fill the assignments
-        assert secret_santa_search(assignments, g2, r2)
-        if never_constraints is None:
-            logging.debug("No 'never' constraints so assignment %d is fine", i)
-        elif check_never_constraints(assignments, never_constraints):
-            logging.debug("assignment %d satisfied all 'never' constraints", i)
+        _check_conflicts(problem)
+        if method == "auto":
+            method = _choose_method(problem, rng, penalties)
+        if method != "matching":
+            # these methods cannot tell an impossible problem from a hard one, so check first
+            _check_feasible(problem)
+
+        components = connected_components(problem.forbidden_sets())
+
+    with timed(stats, "solve"):
+        if len(components) > 1 and all(len(g) == len(r) for g, r in components):
+            logging.debug("Solving %d independent parts", len(components))
+            receiver_positions = _solve_components(
+                problem, components, method, workers, rng, penalties, stats
+            )
         else:
-            logging.debug(
-                f"assignment {i} has failed one or more 'never' constraints. # failures is {num_failures}"
+            receiver_positions = _solve(
+                problem, method, random_seed, workers, rng, penalties, stats
             )
-            num_failures += 1
-            is_success = False
-
-        if is_success:
-            if always_constraints is None:
-                logging.debug("No 'always' constraints so assignment %d is fine", i)
-            elif check_always_constraints(assignments, always_constraints):
-                logging.debug("assignment %d satisfied all 'always' constraints", i)
-            else:
-                logging.debug(
-                    f"assignment {i} has failed one or more 'always' constraints. # failures is {num_failures}"
-                )
-                num_failures += 1
-                is_success = False
+        if min_cycle_length > 2:
+            _lengthen_cycles(problem, receiver_positions, min_cycle_length, rng, stats)
 
-        if is_success:
-            logging.debug("Assignment %d is a success", i)
-            break
+    with timed(stats, "postsolve"):
+        return problem.assignment(receiver_positions).to_dict()
 
-        i += 1
 
-    if num_failures >= MAX_FAILURES:
-        logging.critical(
-            "Exceeded maximum number of failures on satisfying 'never' constraints"
+def _solve_rounds(
+    problem: PairingProblem,
+    num_gifts: int,
+    rng: random.Random,
+    stats: SolverStats | None,
+) -> list[list[int]] | None:
+    """
+    :returns: One full assignment (receiver id of each giver id) per round, no pair used twice.
+        None if a round could not be completed given the pairs drawn in the earlier rounds.
+    """
+    if stats is not None:
+        stats.attempts += 1
+    matching = random_perfect_matching(problem.forbidden_sets(), rng, stats)
+    if matching is None:
+        return None
+    rounds = [list(problem.assignment(matching).receiver_of)]
+    # after the first round everyone gives again, so positions are ids, and the pairs used so far are excluded
+    everyone = PairingProblem(problem.table, [], problem.never, groups=problem.groups)
+    forbidden = everyone.forbidden_sets()
+    for g, r in enumerate(rounds[0]):
+        forbidden[g].add(r)
+    for _ in range(1, num_gifts):
+        receiver_of = random_perfect_matching(forbidden, rng, stats)
+        if receiver_of is None:
+            return None
+        for g, r in enumerate(receiver_of):
+            forbidden[g].add(r)
+        rounds.append(receiver_of)
+    return rounds
+
+
+def secret_santa_hat_multi(
+    names: list[str],
+    random_seed: int,
+    num_gifts: int,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    rng: random.Random | None = None,
+    stats: SolverStats | None = None,
+    groups: dict[str, str] | None = None,
+) -> dict[str, list[str]]:
+    """
+    Every giver gives `num_gifts` gifts to different receivers, and every receiver gets `num_gifts` gifts.
+    The gifts are drawn in rounds. Each round is a perfect matching that may not reuse a pair from an earlier round.
+    The 'always' pairs are part of the first round, and the 'never' constraints hold in every round.
+    :param num_gifts: Number of gifts per giver, at most len(names) - 1
+    :param rng: Source of randomness. By default a new `random.Random(random_seed)`.
+    :param stats: If given, it is filled in with how much work the solver did and how long each phase took
+    :param groups: The group of each participant that is in one. Members of a group never give to each other.
+    :returns: For each giver, their receivers in round order
+    """
+    assert isinstance(names, list)
+    assert isinstance(random_seed, int)
+    assert 1 <= num_gifts < len(names), "num_gifts must be between 1 and len(names) - 1"
+    logging.debug("Generating %d gifts per giver...", num_gifts)
+    if rng is None:
+        rng = random.Random(random_seed)
+    rng = counting(rng, stats)
+    with timed(stats, "presolve"):
+        problem = PairingProblem.from_names(
+            names, always_constraints, never_constraints, groups
         )
+        _check_conflicts(problem)
+        _check_feasible(problem)
+
+    with timed(stats, "solve"):
+        for i in range(MULTI_GIFT_MAX_RESTARTS):
+            rounds = _solve_rounds(problem, num_gifts, rng, stats)
+            if rounds is not None:
+                break
+            # the pairs drawn in the earlier rounds left no valid matching for the next one
+            logging.debug("Attempt %d failed, trying again", i + 1)
+        else:
+            logging.critical(
+                "Failed to find %d rounds of pairings that never repeat a pair",
+                num_gifts,
+            )
+            sys.exit(1)
+
+    with timed(stats, "postsolve"):
+        return {
+            name: [names[r[g]] for r in rounds]
+            for g, name in enumerate(problem.table.names)
+        }
+
+
+def repair_pairings(
+    previous: dict[str, str],
+    names: list[str],
+    random_seed: int,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+    rng: random.Random | None = None,
+) -> tuple[dict[str, str], list[str]]:
+    """
+    Fix up pairings after participants joined or dropped out, keeping as many of the previous pairs as possible.
+    Previous pairs that are still valid are kept, and the new or orphaned givers are matched along shortest
+    augmenting paths. When one person drops out, their giver usually just takes over their receiver.
+    :param previous: The pairings before the roster changed. They may mention people who are no longer in `names`.
+    :param names: The participants now
+    :param rng: Source of randomness. By default a new `random.Random(random_seed)`.
+    :returns: The repaired pairings, and the givers whose receiver changed (or who are new), who need to be told again
+    """
+    assert isinstance(names, list)
+    assert isinstance(random_seed, int)
+    if rng is None:
+        rng = random.Random(random_seed)
+    problem = PairingProblem.from_names(
+        names, always_constraints, never_constraints, groups
+    )
+    _check_conflicts(problem)
+    table = problem.table
+    initial = []
+    for g in problem.givers:
+        receiver = previous.get(table.name(g))
+        if receiver is None or receiver not in table:
+            initial.append(-1)
+        else:
+            initial.append(problem.receiver_position(table.id(receiver)))
+    receiver_positions = repair_matching(problem.forbidden_sets(), initial, rng)
+    if receiver_positions is None:
+        _check_feasible(problem)
+        logging.critical("No valid assignment satisfies the 'never' constraints")
         sys.exit(1)
+    pairings = problem.assignment(receiver_positions).to_dict()
+    changed = [giver for giver in names if previous.get(giver) != pairings[giver]]
+    logging.info("Repaired pairings: %d of %d givers changed", len(changed), len(names))
+    return pairings, changed
+
 
-    return assignments
+class SoftConstraint(NamedTuple):
+    giver: str
+    receiver: str
+    weight: float
+
+
+class SoftAssignment(NamedTuple):
+    """The result of `secret_santa_hat_soft`"""
+
+    pairings: dict[str, str]
+    # soft 'never' pairs that are used
+    violated_never: list[SoftConstraint]
+    # preferred pairs that are not used
+    violated_prefer: list[SoftConstraint]
+
+    @property
+    def penalty(self) -> float:
+        """Total weight of the violated soft constraints"""
+        return sum(c.weight for c in self.violated_never + self.violated_prefer)
+
+
+def _soft_constraints(items: list[list] | None) -> list[SoftConstraint]:
+    constraints = []
+    for item in items or []:
+        assert len(item) in (2, 3), (
+            "soft constraints must be lists of a giver, a receiver and an optional weight"
+        )
+        weight = float(item[2]) if len(item) == 3 else 1.0
+        assert weight >= 0, "weights of soft constraints must not be negative"
+        constraints.append(SoftConstraint(item[0], item[1], weight))
+    return constraints
+
+
+def _soft_costs(
+    problem: PairingProblem, constraints: list[SoftConstraint]
+) -> list[dict[int, float]]:
+    """The total weight of the soft constraints on each pair of free positions"""
+    table = problem.table
+    weights: dict[tuple[int, int], float] = {}
+    for c in constraints:
+        pair = (table.id(c.giver), table.id(c.receiver))
+        weights[pair] = weights.get(pair, 0.0) + c.weight
+    return problem.cost_sets(weights)
+
+
+def secret_santa_hat_soft(
+    names: list[str],
+    random_seed: int,
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    soft_never: list[list] | None = None,
+    prefer: list[list] | None = None,
+    deadline_ms: int = 1000,
+    groups: dict[str, str] | None = None,
+    rng: random.Random | None = None,
+    stats: SolverStats | None = None,
+) -> SoftAssignment:
+    """
+    Find the assignment that breaks the smallest total weight of soft constraints, within a time budget.
+    The 'always' and 'never' constraints and the groups are hard, as in `secret_santa_hat`.
+    Put the constraints that may be broken when there is no other way in `soft_never` instead.
+    :param soft_never: Lists of a giver, a receiver and a weight (1 by default). Using the pair costs its weight.
+    :param prefer: Lists of a giver, a receiver and a weight (1 by default). Not using the pair costs its weight.
+    :param deadline_ms: Return the best assignment found after this many milliseconds.
+        The first valid assignment is returned even if it takes longer.
+    :param rng: Source of randomness. By default a new `random.Random(random_seed)`.
+    :param stats: If given, it is filled in with how much work the solver did and how long each phase took
+    """
+    assert isinstance(names, list)
+    assert isinstance(random_seed, int)
+    assert deadline_ms >= 0
+    deadline = time.monotonic() + deadline_ms / 1000
+    if rng is None:
+        rng = random.Random(random_seed)
+    rng = counting(rng, stats)
+    soft_never_constraints = _soft_constraints(soft_never)
+    prefer_constraints = _soft_constraints(prefer)
+    with timed(stats, "presolve"):
+        problem = PairingProblem.from_names(
+            names, always_constraints, never_constraints, groups
+        )
+        _check_conflicts(problem)
+        _check_feasible(problem)
+        never_costs = _soft_costs(problem, soft_never_constraints)
+        prefer_weights = _soft_costs(problem, prefer_constraints)
+
+    with timed(stats, "solve"):
+        receiver_positions = soft_assignment(
+            problem.forbidden_sets(),
+            never_costs,
+            prefer_weights,
+            rng,
+            deadline=deadline,
+            stats=stats,
+        )
+        # the problem is feasible, so there is always an assignment
+        assert receiver_positions is not None
+
+    with timed(stats, "postsolve"):
+        pairings = problem.assignment(receiver_positions).to_dict()
+        violated_never = [
+            c for c in soft_never_constraints if pairings[c.giver] == c.receiver
+        ]
+        violated_prefer = [
+            c for c in prefer_constraints if pairings[c.giver] != c.receiver
+        ]
+    logging.debug(
+        "Broke %d soft 'never' and %d 'prefer' constraints",
+        len(violated_never),
+        len(violated_prefer),
+    )
+    return SoftAssignment(pairings, violated_never, violated_prefer)
 
 
 def read_people(fname: str) -> dict[str, ParticipantSchema]:
@@ -237,46 +1102,74 @@ def read_people(fname: str) -> dict[str, ParticipantSchema]:
         sys.exit(1)
 
 
+def read_groups(people: dict[str, ParticipantSchema]) -> dict[str, str]:
+    """:returns: The group of each person (as read with `read_people`) that is in one"""
+    groups: dict[str, str] = {}
+    for name, p in people.items():
+        group = p.get("group")
+        if group:
+            groups[name] = group
+    return groups
+
+
 def create_pairings_from_file(
-    people_fname: str, random_seed: int | None = None
+    people_fname: str,
+    random_seed: int | None = None,
+    cache_fname: str | None = None,
 ) -> dict[str, str]:
     """
     Given a file which lists people in a pre-specified format, return a mapping from giver to receiver
     :param people_fname: A file that can be consumed by `read_people`
     :param random_seed: Random seed value for reproducibility. Otherwise completely random.
+    :param cache_fname: With a given `random_seed`, reuse the pairings of an earlier run with the same people
+        and constraints from this SQLite file, and save new ones there
     """
     if random_seed is None:
         random_seed = random.randrange(1, sys.maxsize)
+        # nothing could be reused with a new seed
+        cache_fname = None
     people = read_people(people_fname)
     assert isinstance(people, dict)
     constraints = read_constraints(people_fname)
     assert isinstance(constraints, dict)
     names = list(people.keys())
-    pairings = secret_santa_hat(
-        names,
-        always_constraints=constraints.get("always", None),
-        never_constraints=constraints.get("never", None),
-        random_seed=random_seed,
+    groups = read_groups(people)
+    always_constraints = constraints.get("always", None)
+    never_constraints = constraints.get("never", None)
+    key = cache_key(names, random_seed, always_constraints, never_constraints, groups)
+    logging.info("Cache key of these pairings: %s", key)
+    with open_cache(cache_fname) if cache_fname else nullcontext() as cache:
+        pairings = get_cached_pairings(cache, key) if cache is not None else None
+        if pairings is None:
+            pairings = secret_santa_hat(
+                names,
+                always_constraints=always_constraints,
+                never_constraints=never_constraints,
+                random_seed=random_seed,
+                groups=groups,
+            )
+            if cache is not None:
+                save_cached_pairings(cache, key, pairings)
+    # check cached pairings too
+    sanity_check_pairings(
+        pairings, names, always_constraints, never_constraints, groups
     )
-    sanity_check_pairings(pairings, names)
     return pairings
 
 
-def sanity_check_pairings(pairings: dict[str, str], names: list[str]):
-    """
-    Throws assertion error on failure
-    Warning: this method sorts the names array
-    """
-    names.sort()
-    receivers = list(pairings.values())
-    receivers.sort()
-    givers = list(pairings.keys())
-    givers.sort()
-    assert givers == names, "Givers should be same list as names"
-    assert receivers == names, "Receivers should be same list as names"
-    for giver, receiver in pairings.items():
-        logging.debug("Checking pairing validity for giver %s...", giver)
-        assert giver != receiver, "Giver and receiver cannot be the same"
-        assert giver in names
-        assert receiver in names
-    logging.info("Sanity check complete! Pairings looking good!")
+def sanity_check_pairings(
+    pairings: dict[str, str],
+    names: list[str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+):
+    """
+    Throws assertion error on failure. The check is `validation.validate_pairings`, in O(n).
+    The arguments are not modified.
+    """
+    check_problems(
+        validate_pairings(
+            pairings.items(), names, always_constraints, never_constraints, groups
+        )
+    )
@@ -0,0 +1,106 @@
+"""
+Best-effort assignments with soft constraints and a deadline.
+
+Soft 'never' pairs cost their weight when they are used, and 'prefer' pairs cost their weight when they are not.
+Breaking a preference costs the same, up to a constant, as a bonus for keeping it, so both fit the sparse
+costs of `min_cost`, which finds the optimal assignment when it has the time. If the deadline cuts it short,
+we improve its answer with swaps: giver g takes receiver r from giver h, and h takes the old receiver of g.
+Each swap is evaluated in O(1) and only kept if it lowers the total cost. Both phases stop at the deadline,
+so the answer is the best assignment found in time, not necessarily the best one there is.
+"""
+
+import random
+import time
+from collections.abc import Sequence, Set
+
+from .min_cost import min_cost_assignment
+from .stats import SolverStats
+
+# a swap must lower the cost by more than this to be kept
+EPSILON = 1e-9
+# receivers to try per giver and pass, for a giver that uses a soft 'never' pair
+NUM_RANDOM_SWAPS = 8
+
+
+def _improve(
+    forbidden: Sequence[Set[int]],
+    never_costs: list[dict[int, float]],
+    prefer_weights: list[dict[int, float]],
+    receiver_of: list[int],
+    rng: random.Random,
+    deadline: float | None,
+    stats: SolverStats | None,
+) -> None:
+    """Swap receivers between pairs of givers while it helps (in-place modification of `receiver_of`)"""
+    n = len(receiver_of)
+    giver_of = [0] * n
+    for g, r in enumerate(receiver_of):
+        giver_of[r] = g
+
+    def cost(g: int, r: int) -> float:
+        # preferences are a bonus here, which only differs from the cost of breaking them by a constant
+        return never_costs[g].get(r, 0.0) - prefer_weights[g].get(r, 0.0)
+
+    order = [g for g in range(n) if never_costs[g] or prefer_weights[g]]
+    improved = True
+    while improved:
+        improved = False
+        rng.shuffle(order)
+        for g in order:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            old = receiver_of[g]
+            targets = [r for r in prefer_weights[g] if r != old]
+            if old in never_costs[g]:
+                targets += [rng.randrange(n) for _ in range(NUM_RANDOM_SWAPS)]
+            if stats is not None:
+                stats.nodes_expanded += 1
+                stats.constraint_checks += len(targets)
+            for r in targets:
+                h = giver_of[r]
+                if h == g or r in forbidden[g] or old in forbidden[h]:
+                    continue
+                delta = cost(g, r) + cost(h, old) - cost(g, old) - cost(h, r)
+                if delta < -EPSILON:
+                    receiver_of[g] = r
+                    receiver_of[h] = old
+                    giver_of[r] = g
+                    giver_of[old] = h
+                    improved = True
+                    break
+
+
+def soft_assignment(
+    forbidden: Sequence[Set[int]],
+    never_costs: list[dict[int, float]],
+    prefer_weights: list[dict[int, float]],
+    rng: random.Random,
+    deadline: float | None = None,
+    stats: SolverStats | None = None,
+) -> list[int] | None:
+    """
+    :param forbidden: For each giver (by index), the set of receiver indexes it may never be matched with
+    :param never_costs: For each giver, the cost of using each of its soft 'never' receivers. Costs must not be negative.
+    :param prefer_weights: For each giver, the cost of not giving to each of its preferred receivers
+    :param rng: Source of randomness
+    :param deadline: In terms of `time.monotonic()`. A first valid assignment is returned even if it takes longer.
+    :param stats: If given, count the work done
+    :returns: For each giver, the index of its receiver. None iff no assignment satisfies `forbidden`.
+    """
+    costs = []
+    for never, prefer in zip(never_costs, prefer_weights):
+        cost = dict(never)
+        for r, weight in prefer.items():
+            cost[r] = cost.get(r, 0.0) - weight
+        costs.append(cost)
+    time_budget = None
+    if deadline is not None:
+        # leave the rest of the time to the swaps
+        time_budget = max(0.0, deadline - time.monotonic()) / 2
+    receiver_of = min_cost_assignment(
+        forbidden, costs, rng, time_budget=time_budget, stats=stats
+    )
+    if receiver_of is None:
+        return None
+    _improve(forbidden, never_costs, prefer_weights, receiver_of, rng, deadline, stats)
+    return receiver_of
@@ -0,0 +1,101 @@
+"""
+Statistics about how hard a pairing run was.
+
+The solvers take an optional `SolverStats` and only update it at the end of a search or once per
+expanded node, never per candidate pair, so passing None costs (almost) nothing.
+"""
+
+import random
+import time
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+
+
+class SolverStats:
+    """Counters filled in by the solvers"""
+
+    __slots__ = (
+        "attempts",
+        "backtracks",
+        "nodes_expanded",
+        "constraint_checks",
+        "rng_draws",
+        "phase_seconds",
+    )
+
+    def __init__(self) -> None:
+        # candidate assignments tried: restarts of the search, or permutations drawn by rejection sampling
+        self.attempts = 0
+        self.backtracks = 0
+        # assignments tried by the search, or givers visited by augmenting path searches
+        self.nodes_expanded = 0
+        # giver -> receiver pairs checked against the constraints
+        self.constraint_checks = 0
+        self.rng_draws = 0
+        self.phase_seconds: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent in this block to the phase `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + elapsed
+
+    def merge(self, other: "SolverStats") -> None:
+        self.attempts += other.attempts
+        self.backtracks += other.backtracks
+        self.nodes_expanded += other.nodes_expanded
+        self.constraint_checks += other.constraint_checks
+        self.rng_draws += other.rng_draws
+        for name, seconds in other.phase_seconds.items():
+            self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "backtracks": self.backtracks,
+            "nodes_expanded": self.nodes_expanded,
+            "constraint_checks": self.constraint_checks,
+            "rng_draws": self.rng_draws,
+            "phase_seconds": dict(self.phase_seconds),
+        }
+
+    def __repr__(self) -> str:
+        return f"SolverStats({self.as_dict()})"
+
+
+class CountingRandom(random.Random):
+    """
+    Draws from another `random.Random` and counts the draws in `stats.rng_draws`.
+    It gives exactly the same numbers as the wrapped generator would have.
+    """
+
+    def __init__(self, rng: random.Random, stats: SolverStats) -> None:
+        super().__init__()
+        self._rng = rng
+        self._stats = stats
+
+    def random(self) -> float:
+        self._stats.rng_draws += 1
+        return self._rng.random()
+
+    def getrandbits(self, k: int, /) -> int:
+        self._stats.rng_draws += 1
+        return self._rng.getrandbits(k)
+
+
+def counting(rng: random.Random, stats: SolverStats | None) -> random.Random:
+    """Wrap `rng` to count its draws, if we are collecting stats"""
+    if stats is None:
+        return rng
+    return CountingRandom(rng, stats)
+
+
+def timed(stats: SolverStats | None, name: str) -> AbstractContextManager:
+    """`stats.phase(name)`, or a no-op if we are not collecting stats"""
+    if stats is None:
+        return nullcontext()
+    return stats.phase(name)
@@ -0,0 +1,190 @@
+"""
+Check that pairings are valid in a single pass, without changing the inputs.
+
+Pairings are valid if everyone gives exactly once, everyone receives exactly once, nobody gives to themselves,
+and the constraints hold. The pairs are checked one at a time against sets, so the whole check takes O(n)
+time plus the size of the constraints, and the pairs can come from any iterable: a dict, or a pairing file
+that is read as a stream with `iter_json_object` and never fully loaded into memory.
+"""
+
+import json
+import logging
+from collections.abc import Iterable, Iterator
+from typing import Any, TextIO
+
+# read pairing files this many characters at a time
+CHUNK_SIZE = 1 << 16
+# stop listing problems after this many
+MAX_PROBLEMS = 100
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+def validate_pairings(
+    pairs: Iterable[tuple[str, Any]],
+    names: Iterable[str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+    max_problems: int = MAX_PROBLEMS,
+) -> list[str]:
+    """
+    :param pairs: (giver, receiver) pairs
+    :param names: Everyone who should give and receive
+    :param groups: The group of each participant that is in one. Members of a group may not give to each other.
+    :returns: A description of each problem found, up to `max_problems`. The pairings are valid iff it is empty.
+    """
+    name_set: set[str] = set()
+    problems: list[str] = []
+
+    def problem(message: str) -> None:
+        if len(problems) < max_problems:
+            problems.append(message)
+
+    for name in names:
+        if name in name_set:
+            problem(f"{name} is listed more than once")
+        name_set.add(name)
+    always = {giver: receiver for giver, receiver in always_constraints or []}
+    never = {(giver, receiver) for giver, receiver in never_constraints or []}
+    groups = groups or {}
+    givers: set[str] = set()
+    receivers: set[str] = set()
+    for giver, receiver in pairs:
+        if not isinstance(receiver, str):
+            problem(f"The receiver of {giver} is not a name: {receiver!r}")
+            continue
+        if giver not in name_set:
+            problem(f"Giver {giver} is not a participant")
+        if receiver not in name_set:
+            problem(f"Receiver {receiver} is not a participant")
+        if giver in givers:
+            problem(f"{giver} gives more than once")
+        if receiver in receivers:
+            problem(f"{receiver} receives more than once")
+        givers.add(giver)
+        receivers.add(receiver)
+        if giver == receiver:
+            problem(f"{giver} gives to themselves")
+        if (giver, receiver) in never:
+            problem(f"{giver} -> {receiver} is a 'never' constraint")
+        if always.get(giver, receiver) != receiver:
+            problem(f"{giver} must give to {always[giver]}, not {receiver}")
+        group = groups.get(giver)
+        if group is not None and groups.get(receiver) == group:
+            problem(f"{giver} and {receiver} are both in group {group}")
+    if len(givers) < len(name_set):
+        missing = sorted(name_set - givers)
+        problem(f"{len(missing)} participants do not give: {', '.join(missing)}")
+    if len(receivers) < len(name_set):
+        missing = sorted(name_set - receivers)
+        problem(f"{len(missing)} participants do not receive: {', '.join(missing)}")
+    return problems
+
+
+def iter_json_object(
+    fp: TextIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[tuple[str, Any]]:
+    """
+    Read the (key, value) pairs of a JSON object one at a time, e.g. the pairings in a pairing file.
+    Only one chunk of the file and one value are held in memory at once.
+    Raises `ValueError` (or `json.JSONDecodeError`) if the file is not a JSON object, or has more data after it.
+    """
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> None:
+        nonlocal buffer, pos, eof
+        chunk = fp.read(chunk_size)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def skip_whitespace() -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def expect(chars: str) -> str:
+        nonlocal pos
+        skip_whitespace()
+        if pos >= len(buffer) or buffer[pos] not in chars:
+            found = buffer[pos : pos + 20] or "the end of the file"
+            raise ValueError(f"Expected one of {chars!r} but found {found!r}")
+        pos += 1
+        return buffer[pos - 1]
+
+    def value() -> Any:
+        nonlocal pos
+        skip_whitespace()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(buffer, pos)
+                # a number is only complete once it is followed by a character that cannot go on with it
+                if eof or (end < len(buffer) and buffer[end] not in _NUMBER_CHARS):
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    def end() -> None:
+        skip_whitespace()
+        if pos < len(buffer):
+            raise ValueError(
+                f"Expected the end of the file but found {buffer[pos : pos + 20]!r}"
+            )
+
+    expect("{")
+    skip_whitespace()
+    if buffer.startswith("}", pos):
+        pos += 1
+        end()
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise ValueError(f"Expected a key but found {key!r}")
+        expect(":")
+        yield key, value()
+        if expect(",}") == "}":
+            end()
+            return
+
+
+def validate_pairings_file(
+    fname: str,
+    names: Iterable[str],
+    always_constraints: list[list] | None = None,
+    never_constraints: list[list] | None = None,
+    groups: dict[str, str] | None = None,
+) -> list[str]:
+    """
+    Validate a JSON file that maps each giver to their receiver, as a stream. See `validate_pairings`.
+    :returns: A description of each problem found
+    """
+    with open(fname) as fp:
+        problems = validate_pairings(
+            iter_json_object(fp), names, always_constraints, never_constraints, groups
+        )
+    logging.debug("Validated pairings in %s: %d problems", fname, len(problems))
+    return problems
+
+
+def check_problems(problems: list[str]) -> None:
+    """
+    Log each problem found by `validate_pairings`, then throw an assertion error if there are any.
+    This is the end of every sanity check.
+    """
+    for problem in problems:
+        logging.error("Invalid pairings: %s", problem)
+    assert not problems, f"Invalid pairings: {problems[0]}"
+    logging.info("Sanity check complete! Pairings looking good!")
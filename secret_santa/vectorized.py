@@ -0,0 +1,91 @@
+"""
+Vectorized rejection sampling of assignments with NumPy.
+
+Candidate assignments are drawn as a batch of random permutations (an int array of shape (B, n))
+and checked against a boolean forbidden matrix all at once, so throughput is bounded by NumPy
+rather than by the interpreter. Since every permutation is equally likely to be drawn,
+the accepted assignments are uniformly distributed over the valid ones.
+The forbidden matrix comes from `model.PairingProblem.forbidden_matrix`.
+"""
+
+import numpy as np
+
+from .stats import SolverStats
+
+# upper bound on the number of elements in a batch of candidate permutations
+MAX_BATCH_ELEMENTS = 1 << 22
+
+
+def random_permutations(
+    n: int, batch_size: int, rng: np.random.Generator
+) -> np.ndarray:
+    """:returns: Int array of shape (batch_size, n) where each row is a uniformly random permutation"""
+    return rng.permuted(np.tile(np.arange(n), (batch_size, 1)), axis=1)
+
+
+def valid_rows(perms: np.ndarray, forbidden: np.ndarray) -> np.ndarray:
+    """:returns: Boolean array with one entry per row of `perms`, True iff that row violates nothing in `forbidden`"""
+    n = forbidden.shape[0]
+    return ~forbidden[np.arange(n), perms].any(axis=1)
+
+
+def default_batch_size(n: int) -> int:
+    return max(1, min(4096, MAX_BATCH_ELEMENTS // max(n, 1)))
+
+
+def sample_assignments(
+    forbidden: np.ndarray,
+    num_samples: int,
+    rng: np.random.Generator,
+    batch_size: int | None = None,
+    max_batches: int = 1000,
+    stats: SolverStats | None = None,
+) -> np.ndarray:
+    """
+    Draw up to `num_samples` independent uniformly random valid assignments.
+    :returns: Int array of shape (k, n) with k <= num_samples. Row i gives the receiver index of each giver.
+        k < num_samples only if `max_batches` batches did not produce enough valid assignments.
+    """
+    n = forbidden.shape[0]
+    assert forbidden.shape == (n, n)
+    if batch_size is None:
+        batch_size = default_batch_size(n)
+    found: list[np.ndarray] = []
+    num_found = 0
+    for _ in range(max_batches):
+        if num_found >= num_samples:
+            break
+        perms = random_permutations(n, batch_size, rng)
+        accepted = perms[valid_rows(perms, forbidden)]
+        if stats is not None:
+            stats.attempts += batch_size
+            stats.constraint_checks += batch_size * n
+        found.append(accepted[: num_samples - num_found])
+        num_found += len(found[-1])
+    if not found:
+        return np.empty((0, n), dtype=np.int64)
+    return np.concatenate(found)
+
+
+def rejection_sample(
+    forbidden: np.ndarray,
+    rng: np.random.Generator,
+    batch_size: int | None = None,
+    max_batches: int = 1000,
+    stats: SolverStats | None = None,
+) -> np.ndarray | None:
+    """
+    :returns: The first valid assignment found (receiver index of each giver),
+        or None if `max_batches` batches did not contain one
+    """
+    samples = sample_assignments(
+        forbidden,
+        1,
+        rng,
+        batch_size=batch_size,
+        max_batches=max_batches,
+        stats=stats,
+    )
+    if len(samples) == 0:
+        return None
+    return samples[0]
@@ -0,0 +1,53 @@
+import numpy as np
+
+from secret_santa import analysis
+
+from .test_secret_santa import SEED, _get_random_names
+
+# 0 -> 1, 1 -> 2, 3 -> 0 and 5 -> 1 are not allowed
+FORBIDDEN = [{0, 1}, {1, 2}, {2}, {3, 0}, {4}, {5, 1}, {6}]
+
+
+def test_exact_probabilities():
+    probabilities = analysis.exact_probabilities([{g} for g in range(4)])
+    assert probabilities is not None
+    assert np.allclose(probabilities, (1 - np.eye(4)) / 3)
+    probabilities = analysis.exact_probabilities(FORBIDDEN)
+    assert probabilities is not None
+    assert np.allclose(probabilities.sum(axis=0), 1)
+    assert np.allclose(probabilities.sum(axis=1), 1)
+    for g, excluded in enumerate(FORBIDDEN):
+        assert all(probabilities[g, r] == 0 for r in excluded)
+
+
+def test_pair_counts_workers():
+    counts = analysis.pair_counts(FORBIDDEN, "matching", 25_000, SEED)
+    assert (counts.sum(axis=1) == 25_000).all()
+    for g, excluded in enumerate(FORBIDDEN):
+        assert all(counts[g, r] == 0 for r in excluded)
+    assert (
+        analysis.pair_counts(FORBIDDEN, "matching", 25_000, SEED, workers=2) == counts
+    ).all()
+
+
+def test_uniform_samplers():
+    report = analysis.uniformity_report(FORBIDDEN, "vectorized", 20_000, SEED)
+    assert report.reference == "exact"
+    assert report.p_value > 0.001
+    names = _get_random_names(6)
+    report = analysis.analyze_uniformity(names, "derangement", 20_000, random_seed=SEED)
+    assert report.p_value > 0.001
+    assert report.worst_pair[0] in names
+
+
+def test_biased_sampler():
+    # the shuffled search prefers some assignments over others
+    report = analysis.uniformity_report(FORBIDDEN, "search", 20_000, SEED)
+    assert report.p_value < 1e-6
+
+
+def test_vectorized_reference():
+    forbidden = [{g, (g + 1) % 12} for g in range(12)]
+    report = analysis.uniformity_report(forbidden, "vectorized", 5_000, SEED)
+    assert report.reference == "vectorized"
+    assert report.degrees_of_freedom > 0
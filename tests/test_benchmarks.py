@@ -0,0 +1,74 @@
+from benchmarks import bench_solvers
+
+
+def test_run_case():
+    for engine in bench_solvers.ENGINES:
+        result = bench_solvers.run_case(bench_solvers.Case(engine, 10, 0.0))
+        assert result["status"] == "ok"
+        assert result["peak_memory_bytes"] > 0
+    result = bench_solvers.run_case(bench_solvers.Case("hat-matching", 20, 0.5))
+    assert result["num_never"] == 20 * round(0.5 * 19)
+    assert result["attempts"] == 1
+
+
+def test_cases():
+    cases = bench_solvers.cases([10, 100_000], [0.0, 0.5], bench_solvers.ENGINES)
+    # the simple engines do not take constraints, and there would be too many at n = 100000
+    assert len(cases) == 2 * len(bench_solvers.ENGINES) + 2 * len(
+        bench_solvers.CONSTRAINED_ENGINES
+    )
+    assert bench_solvers.Case("hat-matching", 100_000, 0.5) not in cases
+    # 3 more than ln(10) allowed receivers, rounded up
+    density = bench_solvers.threshold_density(10)
+    assert bench_solvers.Case("hat-matching", 10, density) in cases
+    assert round(density * 9) == 3
+    # the sparse densities run at the largest size, but not where they round to no constraints
+    cases = bench_solvers.cases([100, 100_000], [0.0001], ["hat-matching"])
+    assert [case for case in cases if case.density == 0.0001] == [
+        bench_solvers.Case("hat-matching", 100_000, 0.0001)
+    ]
+
+
+def test_compare():
+    baseline = [
+        {
+            "engine": "search",
+            "n": 10,
+            "density": 0.0,
+            "status": "ok",
+            "seconds": 1.0,
+            "peak_memory_bytes": 100,
+        },
+        {
+            "engine": "search",
+            "n": 100,
+            "density": 0.0,
+            "status": "ok",
+            "seconds": 0.001,
+            "peak_memory_bytes": 100,
+        },
+        {
+            "engine": "search",
+            "n": 1000,
+            "density": 0.0,
+            "status": "ok",
+            "seconds": 1.0,
+            "peak_memory_bytes": 100,
+        },
+    ]
+    results = [
+        # slower
+        {**baseline[0], "seconds": 2.0},
+        # slower, but by less than the noise
+        {**baseline[1], "seconds": 0.002},
+        {**baseline[2], "status": "timeout", "peak_memory_bytes": None},
+    ]
+    regressions = bench_solvers.compare(results, baseline)
+    assert len(regressions) == 2
+    assert bench_solvers.compare(baseline, baseline) == []
+    assert bench_solvers.persistent_timeouts(results, baseline) == []
+    # a timeout is only a regression if the baseline finished, but one that stays is still reported
+    assert bench_solvers.compare(results, results) == []
+    assert bench_solvers.persistent_timeouts(results, results) == [
+        "search n=1000 density=0.0"
+    ]
@@ -0,0 +1,77 @@
+import json
+
+from secret_santa import secret_santa
+from secret_santa.cache import (
+    cache_key,
+    get_cached_pairings,
+    open_cache,
+    save_cached_pairings,
+)
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def test_cache_key():
+    names = _get_random_names(5)
+    never_constraints = [[names[0], names[1]], [names[2], names[3]]]
+    key = cache_key(names, SEED, never_constraints=never_constraints)
+    # the order of the constraints does not matter
+    assert key == cache_key(names, SEED, never_constraints=never_constraints[::-1])
+    # but the order of the names, the seed and the options do
+    assert key != cache_key(names[::-1], SEED, never_constraints=never_constraints)
+    assert key != cache_key(names, SEED + 1, never_constraints=never_constraints)
+    assert key != cache_key(
+        names, SEED, never_constraints=never_constraints, num_gifts=2
+    )
+    assert key != cache_key(names, SEED, never_constraints=never_constraints[:1])
+
+
+def test_cache_eviction(tmp_path):
+    with open_cache(str(tmp_path / "cache.db")) as cache:
+        for i in range(3):
+            save_cached_pairings(cache, str(i), {"giver": str(i)}, max_entries=2)
+        assert get_cached_pairings(cache, "0") is None
+        # using 1 makes 2 the least recently used entry
+        assert get_cached_pairings(cache, "1") == {"giver": "1"}
+        save_cached_pairings(cache, "3", {}, max_entries=2)
+        assert get_cached_pairings(cache, "2") is None
+        assert get_cached_pairings(cache, "1") == {"giver": "1"}
+        assert get_cached_pairings(cache, "3") == {}
+
+
+def test_create_pairings_from_file_cached(tmp_path):
+    names = _get_random_names(10)
+    people_fname = str(tmp_path / "names.json")
+    with open(people_fname, "w") as fp:
+        json.dump(
+            {
+                "names": {
+                    name: {"email": f"{i}@example.com"} for i, name in enumerate(names)
+                },
+                "constraints": {"never": [[names[0], names[1]]]},
+            },
+            fp,
+        )
+    cache_fname = str(tmp_path / "cache.db")
+    pairings = secret_santa.create_pairings_from_file(
+        people_fname, random_seed=SEED, cache_fname=cache_fname
+    )
+    key = cache_key(names, SEED, never_constraints=[[names[0], names[1]]], groups={})
+    fake = dict(zip(names, names[2:] + names[:2]))
+    with open_cache(cache_fname) as cache:
+        assert get_cached_pairings(cache, key) == pairings
+        # a cached result is returned as is
+        save_cached_pairings(cache, key, fake)
+    assert (
+        secret_santa.create_pairings_from_file(
+            people_fname, random_seed=SEED, cache_fname=cache_fname
+        )
+        == fake
+    )
+
+
+def test_open_cache_releases_connections(tmp_path):
+    with open_cache(str(tmp_path / "cache.db")) as cache:
+        save_cached_pairings(cache, "key", {})
+    # nothing is left pooled once the cache is closed
+    assert cache.get_bind().pool.checkedin() == 0
@@ -0,0 +1,207 @@
+import json
+
+import fire
+from sqlalchemy import event, func, select
+
+from secret_santa import cli_v2
+from secret_santa.cli_v2 import _create_db_session, _read_pairings_from_db
+from secret_santa.db_models import CachedPairings, ConstraintType, Pairing
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def _make_campaign(data_dir: str, names: list[str]) -> None:
+    people_fname = f"{data_dir}/names.json"
+    with open(people_fname, "w") as fp:
+        json.dump(
+            {
+                "names": {
+                    name: {"email": f"{i}@example.com"} for i, name in enumerate(names)
+                }
+            },
+            fp,
+        )
+    cli_v2.create_campaign("test", data_dir=data_dir)
+    cli_v2.load_participants_from_json(people_fname, "test", data_dir=data_dir)
+
+
+def test_engine_is_cached(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    upgrades = []
+    upgrade_schema = cli_v2.upgrade_schema
+
+    def counting_upgrade(db_session):
+        upgrades.append(db_session)
+        upgrade_schema(db_session)
+
+    monkeypatch.setattr(cli_v2, "upgrade_schema", counting_upgrade)
+    try:
+        names = _get_random_names(10)
+        _make_campaign(data_dir, names)
+        cli_v2.create_pairings("test", data_dir=data_dir, random_seed=SEED)
+        cli_v2.create_pairings(
+            "test", data_dir=data_dir, random_seed=SEED, overwrite=True
+        )
+        # the schema is only checked when the database is first opened
+        assert len(upgrades) == 1
+        first = _create_db_session(data_dir)
+        second = _create_db_session(f"{data_dir}/.")
+        assert first.get_bind() is second.get_bind()
+        campaign = cli_v2._get_campaign_or_fail(first, "test")
+        assert sorted(_read_pairings_from_db(first, campaign.id)) == sorted(names)
+        first.close()
+        second.close()
+    finally:
+        cli_v2._dispose_db_engines()
+    assert cli_v2._session_factories == {}
+
+
+def test_bulk_load(tmp_path, caplog):
+    data_dir = str(tmp_path)
+    try:
+        names = _get_random_names(50)
+        _make_campaign(data_dir, names)
+        # the same participants again, with one new one
+        more_fname = f"{data_dir}/more.json"
+        with open(more_fname, "w") as fp:
+            json.dump(
+                {
+                    "names": {
+                        names[0]: {"email": "0@example.com"},
+                        "Newcomer": {"email": "new@example.com"},
+                        "Copycat": {"email": "1@example.com"},
+                    }
+                },
+                fp,
+            )
+        cli_v2.load_participants_from_json(more_fname, "test", data_dir=data_dir)
+        assert f"Participant {names[0]} has already been added" in caplog.text
+        assert "Email 1@example.com of participant Copycat is already taken" in (
+            caplog.text
+        )
+
+        constraints_fname = f"{data_dir}/constraints.json"
+        never = [[names[i], names[i + 1]] for i in range(40)]
+        with open(constraints_fname, "w") as fp:
+            json.dump(
+                {
+                    "constraints": {
+                        "always": [[names[45], "Newcomer"], ["Nobody", names[0]]],
+                        "never": never + never[:1],
+                    }
+                },
+                fp,
+            )
+        db_session = _create_db_session(data_dir)
+        statements = []
+        event.listen(
+            db_session.get_bind(),
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        cli_v2.load_constraints_from_json("test", constraints_fname, data_dir=data_dir)
+        # the campaign, the participants, the existing constraints and one bulk insert
+        assert len(statements) == 4
+        assert "no participant named Nobody" in caplog.text
+        assert (
+            f"The never constraint {names[0]} -> {names[1]} has already been added"
+            in caplog.text
+        )
+
+        campaign = cli_v2._get_campaign_or_fail(db_session, "test")
+        participants = cli_v2._read_participants_from_db(db_session, campaign.id)
+        assert len(participants) == 51
+        p_map = {p.id: p.name for p in participants}
+        assert (
+            cli_v2._read_constraints_from_db(
+                db_session, campaign.id, ConstraintType.NEVER, p_map
+            )
+            == never
+        )
+        assert cli_v2._read_constraints_from_db(
+            db_session, campaign.id, ConstraintType.ALWAYS, p_map
+        ) == [[names[45], "Newcomer"]]
+        db_session.close()
+    finally:
+        cli_v2._dispose_db_engines()
+
+
+def test_multi_gift_rounds_are_read(tmp_path):
+    data_dir = str(tmp_path)
+    try:
+        names = _get_random_names(10)
+        _make_campaign(data_dir, names)
+        cli_v2.create_pairings("test", data_dir=data_dir, random_seed=SEED, num_gifts=2)
+        cli_v2.create_campaign("next", data_dir=data_dir)
+        db_session = _create_db_session(data_dir)
+        campaign = cli_v2._get_campaign_or_fail(db_session, "test")
+        pairings = cli_v2._read_all_pairings_from_db(db_session, campaign.id)
+        assert sorted(pairings) == sorted(names)
+        assert all(len(receivers) == 2 for receivers in pairings.values())
+        assert {
+            giver: receivers[0] for giver, receivers in pairings.items()
+        } == _read_pairings_from_db(db_session, campaign.id)
+        # avoiding repeats looks at the second round too
+        next_campaign = cli_v2._get_campaign_or_fail(db_session, "next")
+        assert cli_v2._read_previous_pairings(db_session, next_campaign, 1) == [
+            pairings
+        ]
+        db_session.close()
+    finally:
+        cli_v2._dispose_db_engines()
+
+
+def test_history_is_not_cached(tmp_path):
+    data_dir = str(tmp_path)
+    try:
+        names = _get_random_names(10)
+        _make_campaign(data_dir, names)
+        cli_v2.create_pairings("test", data_dir=data_dir, random_seed=SEED)
+        cli_v2.create_campaign("next", data_dir=data_dir)
+        cli_v2.load_participants_from_json(
+            f"{data_dir}/names.json", "next", data_dir=data_dir
+        )
+        cli_v2.create_pairings("next", data_dir=data_dir, random_seed=SEED, history=1)
+        db_session = _create_db_session(data_dir)
+        # only the pairings without history
+        assert db_session.scalar(select(func.count()).select_from(CachedPairings)) == 1
+        db_session.close()
+    finally:
+        cli_v2._dispose_db_engines()
+
+
+def test_repair_pairings_cli(tmp_path):
+    data_dir = str(tmp_path)
+    try:
+        names = ["Alice", "Bob", "Carol", "Dave", "Eve", "Frank"]
+        _make_campaign(data_dir, names)
+        cli_v2.create_pairings("test", data_dir=data_dir, random_seed=SEED)
+        # the command line passes a single name as a plain string
+        fire.Fire(
+            cli_v2,
+            command=[
+                "repair_pairings",
+                "test",
+                "--drop",
+                "Eve",
+                "--data_dir",
+                data_dir,
+            ],
+        )
+        db_session = _create_db_session(data_dir)
+        campaign = cli_v2._get_campaign_or_fail(db_session, "test")
+        remaining = [name for name in names if name != "Eve"]
+        pairings = _read_pairings_from_db(db_session, campaign.id)
+        assert sorted(pairings) == remaining
+        assert sorted(pairings.values()) == remaining
+        assert all(giver != receiver for giver, receiver in pairings.items())
+        # the redrawn pairings keep the seed of the repair, the others have the campaign's
+        seeds = set(
+            db_session.scalars(
+                select(Pairing.repair_seed).where(Pairing.campaign_id == campaign.id)
+            )
+        )
+        assert None in seeds and len(seeds) == 2
+        db_session.close()
+    finally:
+        cli_v2._dispose_db_engines()
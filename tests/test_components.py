@@ -0,0 +1,74 @@
+from secret_santa import secret_santa
+from secret_santa.components import connected_components
+from secret_santa.model import PairingProblem
+from secret_santa.stats import SolverStats
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def _pools(names: list[str], size: int) -> list[list[str]]:
+    """'never' constraints so that people only give within their pool of `size`"""
+    return [
+        [giver, receiver]
+        for i, giver in enumerate(names)
+        for j, receiver in enumerate(names)
+        if i // size != j // size
+    ]
+
+
+def test_connected_components():
+    # 0 and 1 may only give to each other, and so may 2 and 3
+    forbidden = [{0, 2, 3}, {1, 2, 3}, {0, 1, 2}, {0, 1, 3}]
+    assert connected_components(forbidden) == [
+        ([0], [1]),
+        ([1], [0]),
+        ([2], [3]),
+        ([3], [2]),
+    ]
+    # 0, 1 and 2 may only give to each other
+    forbidden = [{0, 3}, {1, 3}, {2, 3}, {0, 1, 2}]
+    assert connected_components(forbidden) == [([0, 1, 2], [0, 1, 2]), ([3], [3])]
+    assert connected_components([set(), set()]) == [([0, 1], [0, 1])]
+    assert connected_components([]) == []
+
+
+def test_split_keeps_constraints():
+    names = _get_random_names(6)
+    never_constraints = _pools(names, 3) + [[names[0], names[1]]]
+    problem = PairingProblem.from_names(names, never_constraints=never_constraints)
+    components = connected_components(problem.forbidden_sets())
+    assert len(components) == 2
+    parts = problem.split(components)
+    assert parts[0].table.names == names[:3]
+    assert parts[0].forbidden_sets() == [{0, 1}, {1}, {2}]
+    assert parts[1].table.names == names[3:]
+    assert parts[1].forbidden_sets() == [{0}, {1}, {2}]
+
+
+def test_secret_santa_hat_pools():
+    names = _get_random_names(40)
+    never_constraints = _pools(names, 8)
+    for method in secret_santa.SOLVER_METHODS:
+        stats = SolverStats()
+        pairings = secret_santa.secret_santa_hat(
+            names,
+            SEED,
+            never_constraints=never_constraints,
+            method=method,
+            stats=stats,
+        )
+        secret_santa.sanity_check_pairings(pairings, names[:])
+        assert secret_santa.check_never_constraints(pairings, never_constraints)
+        assert stats.attempts >= 5
+
+
+def test_secret_santa_hat_pools_workers_are_deterministic():
+    names = _get_random_names(30)
+    never_constraints = _pools(names, 10)
+    serial = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints
+    )
+    parallel = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, workers=2
+    )
+    assert serial == parallel
@@ -0,0 +1,128 @@
+import random
+
+import pytest
+
+from secret_santa import secret_santa
+from secret_santa.cycles import lengthen_cycles
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def test_get_cyclic_permutation():
+    names = _get_random_names(50)
+    rng = random.Random(SEED)
+    for _ in range(20):
+        pairings = dict(zip(names, secret_santa.get_cyclic_permutation(names, rng)))
+        assert len(secret_santa.gift_cycles(pairings)) == 1
+
+
+def test_lengthen_cycles():
+    # three 2-cycles: 0 <-> 1, 2 <-> 3, 4 <-> 5
+    receiver_of = [1, 0, 3, 2, 5, 4]
+    forbidden: list[set[int]] = [{g} for g in range(6)]
+    assert lengthen_cycles(
+        forbidden, receiver_of, list(range(6)), [1] * 6, 3, random.Random(SEED)
+    )
+    assert sorted(receiver_of) == list(range(6))
+    # merging only makes cycles longer, so each one now has at least 4 people
+    cycles = secret_santa.gift_cycles(dict(enumerate(receiver_of)))
+    assert all(len(cycle) >= 4 for cycle in cycles)
+
+
+def test_lengthen_cycles_stuck():
+    # 0 and 1 may only give to each other
+    forbidden = [{0, 2, 3}, {1, 2, 3}, {0, 1, 2}, {0, 1, 3}]
+    receiver_of = [1, 0, 3, 2]
+    assert not lengthen_cycles(
+        forbidden, receiver_of, list(range(4)), [1] * 4, 3, random.Random(SEED)
+    )
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_min_cycle_length(method: str):
+    names = _get_random_names(40)
+    never_constraints = [[names[i], names[i + 1]] for i in range(0, 40, 2)]
+    always_constraints = [[names[1], names[4]], [names[4], names[7]]]
+    pairings = secret_santa.secret_santa_hat(
+        names,
+        SEED,
+        always_constraints,
+        never_constraints,
+        method=method,
+        min_cycle_length=5,
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert secret_santa.check_always_constraints(pairings, always_constraints)
+    assert secret_santa.check_never_constraints(pairings, never_constraints)
+    assert all(len(cycle) >= 5 for cycle in secret_santa.gift_cycles(pairings))
+
+
+def test_no_reciprocal_pairs_large():
+    names = _get_random_names(3000)
+    pairings = secret_santa.secret_santa_hat(names, SEED, min_cycle_length=3)
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert all(pairings[pairings[giver]] != giver for giver in names)
+
+
+def test_single_cycle():
+    names = _get_random_names(30)
+    groups = {name: str(i % 5) for i, name in enumerate(names)}
+    always_constraints = [[names[0], names[1]]]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, always_constraints, groups=groups, single_cycle=True
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert secret_santa.check_always_constraints(pairings, always_constraints)
+    assert secret_santa.check_group_constraints(pairings, groups)
+    assert len(secret_santa.gift_cycles(pairings)) == 1
+    # without constraints, this is Sattolo's algorithm
+    pairings = secret_santa.secret_santa_hat(names, SEED, single_cycle=True)
+    assert len(secret_santa.gift_cycles(pairings)) == 1
+
+
+@pytest.mark.parametrize(
+    "seed,never_constraints",
+    [
+        (856, [[0, 2], [1, 0], [2, 3], [3, 1]]),
+        (443, [[0, 2], [0, 3], [0, 4], [1, 3], [2, 0], [2, 1], [3, 0]]),
+        (703, [[0, 1], [0, 4], [1, 2], [2, 3], [2, 4], [4, 0], [4, 2]]),
+    ],
+)
+@pytest.mark.parametrize("single_cycle", [False, True])
+def test_min_cycle_length_restarts(seed, never_constraints, single_cycle):
+    # merging the cycles of the first assignment gets stuck, but another assignment works
+    names = [f"N{i}" for i in range(1 + max(max(pair) for pair in never_constraints))]
+    never_constraints = [[names[g], names[r]] for g, r in never_constraints]
+    pairings = secret_santa.secret_santa_hat(
+        names,
+        seed,
+        never_constraints=never_constraints,
+        min_cycle_length=3,
+        single_cycle=single_cycle,
+    )
+    secret_santa.sanity_check_pairings(
+        pairings, names, never_constraints=never_constraints
+    )
+    cycles = secret_santa.gift_cycles(pairings)
+    assert all(len(cycle) >= 3 for cycle in cycles)
+    assert len(cycles) == 1 or not single_cycle
+
+
+def test_min_cycle_length_empty():
+    assert secret_santa.secret_santa_hat([], SEED) == {}
+    assert secret_santa.secret_santa_hat([], SEED, single_cycle=True) == {}
+
+
+def test_single_cycle_one_name():
+    for single_cycle in (False, True):
+        with pytest.raises(SystemExit):
+            secret_santa.secret_santa_hat(["A"], SEED, single_cycle=single_cycle)
+
+
+def test_short_always_cycle():
+    names = _get_random_names(6)
+    always_constraints = [[names[0], names[1]], [names[1], names[0]]]
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(
+            names, SEED, always_constraints, min_cycle_length=3
+        )
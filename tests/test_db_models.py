@@ -0,0 +1,46 @@
+import sqlite3
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+
+from secret_santa.db_models import upgrade_schema
+
+
+def test_upgrade_schema_adds_indexes(tmp_path):
+    fname = str(tmp_path / "secret_santa.db")
+    # the pairings table as it was first released, without gift_round or any indexes
+    conn = sqlite3.connect(fname)
+    conn.execute(
+        "CREATE TABLE pairings (id INTEGER PRIMARY KEY, campaign_id INTEGER NOT NULL, "
+        "giver_id INTEGER NOT NULL, receiver_id INTEGER NOT NULL, created_at DATETIME NOT NULL)"
+    )
+    conn.execute("INSERT INTO pairings VALUES (1, 1, 1, 2, '2020-12-01')")
+    conn.commit()
+    conn.close()
+
+    engine = create_engine(f"sqlite:///{fname}", future=True)
+    for _ in range(2):
+        # a second upgrade finds nothing left to do
+        with Session(bind=engine, future=True) as db_session:
+            upgrade_schema(db_session)
+    inspector = inspect(engine)
+    indexes = {
+        index["name"]: index["column_names"]
+        for index in inspector.get_indexes("pairings")
+    }
+    assert indexes == {
+        "ix_pairings_campaign_id_gift_round": ["campaign_id", "gift_round"],
+        "ix_pairings_giver_id": ["giver_id"],
+        "ix_pairings_receiver_id": ["receiver_id"],
+    }
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT * FROM pairings WHERE campaign_id = 1"
+        ).all()
+        assert "ix_pairings_campaign_id_gift_round" in str(plan)
+        assert conn.exec_driver_sql("SELECT gift_round FROM pairings").scalar_one() == 0
+        assert (
+            conn.exec_driver_sql("SELECT repair_seed FROM pairings").scalar_one()
+            is None
+        )
+    engine.dispose()
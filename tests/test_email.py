@@ -45,6 +45,19 @@ def test_create_emails_unencrypted():
         )
 
 
+def test_create_emails_several_gifts():
+    givers = list(NAMES.keys())
+    pairings = {giver: [g for g in givers if g != giver] for giver in givers}
+    with tempfile.TemporaryDirectory() as output_dir:
+        create_emails(
+            pairings, email_template_fname=EMAIL_TEMPLATE_FNAME, output_dir=output_dir
+        )
+        for giver, receivers in pairings.items():
+            with open(get_email_fname(giver, output_dir)) as fp:
+                email = fp.read()
+            assert all(receiver in email for receiver in receivers)
+
+
 def test_send_all_emails():
     givers = list(NAMES.keys())
     emails = NAMES.copy()
@@ -100,3 +100,26 @@ def test_sanity_check_encrypted_pairings_fail_double_receiver():
             with patch("secret_santa.encryption_api.decrypt_with_api", m_dec):
                 with patch("builtins.open", mock_open(read_data=s)):
                     sanity_check_encrypted_pairings(output_dir, names, API_BASE_URL)
+
+
+def test_sanity_check_encrypted_pairings_fail_constraint():
+    # valid pairings that break a constraint from the people file
+    names = ["Alice", "Bob", "Eve"]
+    pairings = {"Alice": "Bob", "Bob": "Eve", "Eve": "Alice"}
+    s = json.dumps(fake_encrypt_pairings(pairings), indent=4)
+
+    m_dec = MagicMock(side_effect=fake_decrypt)
+    with tempfile.TemporaryDirectory() as output_dir:
+        with patch("secret_santa.encryption_api.decrypt_with_api", m_dec):
+            with patch("builtins.open", mock_open(read_data=s)):
+                sanity_check_encrypted_pairings(output_dir, names, API_BASE_URL)
+            for kwargs in [
+                {"never_constraints": [["Alice", "Bob"]]},
+                {"always_constraints": [["Alice", "Eve"]]},
+                {"groups": {"Alice": "home", "Bob": "home"}},
+            ]:
+                with pytest.raises(AssertionError):
+                    with patch("builtins.open", mock_open(read_data=s)):
+                        sanity_check_encrypted_pairings(
+                            output_dir, names, API_BASE_URL, **kwargs
+                        )
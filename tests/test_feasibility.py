@@ -0,0 +1,56 @@
+import pytest
+
+from secret_santa import secret_santa
+from secret_santa.feasibility import find_hall_violation
+
+
+def test_feasible():
+    forbidden = [{0}, {1}, {2}]
+    assert find_hall_violation(forbidden) is None
+
+
+def test_hall_violation():
+    # givers 0, 1 and 2 can only give to receivers 3 and 4
+    forbidden = [{0, 1, 2}, {0, 1, 2}, {0, 1, 2}, {3}, {4}]
+    violation = find_hall_violation(forbidden)
+    assert violation is not None
+    assert violation.givers == [0, 1, 2]
+    assert violation.receivers == [3, 4]
+
+
+def test_find_infeasibility_names():
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    never_constraints = [
+        ["Alice", "Bob"],
+        ["Alice", "Eve"],
+        ["Bob", "Alice"],
+        ["Bob", "Eve"],
+    ]
+    assert secret_santa.find_infeasibility(names) is None
+    givers, receivers = secret_santa.find_infeasibility(
+        names, never_constraints=never_constraints
+    )
+    assert sorted(givers) == ["Alice", "Bob"]
+    assert receivers == ["Mallory"]
+
+
+def test_find_infeasibility_with_always_constraints():
+    names = ["Alice", "Bob", "Eve"]
+    # Eve must then give to Alice, and cannot
+    result = secret_santa.find_infeasibility(
+        names,
+        always_constraints=[["Alice", "Bob"], ["Bob", "Eve"]],
+        never_constraints=[["Eve", "Alice"]],
+    )
+    assert result == (["Eve"], [])
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_secret_santa_hat_infeasible_exits_fast(method):
+    names = [f"Steve #{i}" for i in range(200)]
+    never_constraints = [[names[i], names[-1]] for i in range(len(names) - 1)]
+    never_constraints += [[names[-1], names[i]] for i in range(len(names) - 1)]
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(
+            names, 42, never_constraints=never_constraints, method=method
+        )
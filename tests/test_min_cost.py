@@ -0,0 +1,87 @@
+import itertools
+import random
+
+from secret_santa.min_cost import min_cost_assignment
+
+
+def _brute_force_cost(forbidden, costs):
+    n = len(forbidden)
+    best = None
+    for perm in itertools.permutations(range(n)):
+        if any(perm[g] in forbidden[g] for g in range(n)):
+            continue
+        cost = sum(costs[g].get(perm[g], 0) for g in range(n))
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+def test_min_cost_assignment_is_optimal():
+    rng = random.Random(42)
+    for _ in range(200):
+        n = rng.randint(2, 6)
+        forbidden = [{g} for g in range(n)]
+        costs = [
+            {r: rng.choice([0.5, 1.0, 2.0]) for r in range(n) if rng.random() < 0.6}
+            for _ in range(n)
+        ]
+        result = min_cost_assignment(forbidden, costs, rng)
+        assert result is not None
+        assert sorted(result) == list(range(n))
+        assert all(result[g] != g for g in range(n))
+        cost = sum(costs[g].get(result[g], 0) for g in range(n))
+        assert cost == _brute_force_cost(forbidden, costs)
+
+
+def test_min_cost_assignment_infeasible():
+    forbidden = [{0, 1}, {0, 1}, {2}]
+    assert min_cost_assignment(forbidden, [{}, {}, {}], random.Random(42)) is None
+
+
+def test_min_cost_assignment_large_sparse():
+    n = 5000
+    rng = random.Random(42)
+    forbidden = [{g} for g in range(n)]
+    # giver 0 has given to everyone before, so it must repeat somebody
+    costs: list[dict[int, float]] = [{r: 1.0 for r in range(1, n)}]
+    costs[0][1] = 0.25
+    costs += [{(g + 1) % n: 1.0} for g in range(1, n)]
+    result = min_cost_assignment(forbidden, costs, rng)
+    assert result is not None
+    assert result[0] == 1
+    assert all(result[g] != (g + 1) % n for g in range(1, n))
+
+
+def test_min_cost_assignment_with_bonuses():
+    rng = random.Random(42)
+    for _ in range(200):
+        n = rng.randint(2, 6)
+        forbidden = [{g} for g in range(n)]
+        costs = [
+            {r: rng.choice([-2.0, -0.5, 1.0]) for r in range(n) if rng.random() < 0.4}
+            for _ in range(n)
+        ]
+        result = min_cost_assignment(forbidden, costs, rng)
+        assert result is not None
+        assert sorted(result) == list(range(n))
+        cost = sum(costs[g].get(result[g], 0) for g in range(n))
+        assert cost == _brute_force_cost(forbidden, costs)
+
+
+def test_min_cost_assignment_out_of_time():
+    n = 2000
+    rng = random.Random(42)
+    forbidden = [{g, (g + 1) % n} for g in range(n)]
+    # every giver has a bonus, so none of them can start from the zero-cost matching
+    costs = [{(g + 2) % n: -1.0, (g + 3) % n: 1.0} for g in range(n)]
+    result = min_cost_assignment(forbidden, costs, rng, time_budget=0.0)
+    assert result is not None
+    assert sorted(result) == list(range(n))
+    assert all(result[g] not in forbidden[g] for g in range(n))
+    # running out of time does not hide that there is no assignment
+    assert (
+        min_cost_assignment(
+            [{0, 1}, {0, 1}, {2}], [{2: -1.0}, {}, {}], rng, time_budget=0.0
+        )
+        is None
+    )
@@ -0,0 +1,86 @@
+from secret_santa.model import GroupExclusions, PairingProblem
+
+
+def test_from_names_fixes_always_constraints():
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    problem = PairingProblem.from_names(
+        names,
+        always_constraints=[["Alice", "Bob"]],
+        never_constraints=[["Eve", "Alice"]],
+    )
+    assert list(problem.givers) == [1, 2, 3]
+    assert list(problem.receivers) == [0, 2, 3]
+    assert problem.receiver_position(1) == -1
+    # Bob may give to anyone left, Eve to neither herself nor Alice, Mallory not to himself
+    assert problem.forbidden_sets() == [set(), {0, 1}, {2}]
+
+
+def test_forbidden_matrix():
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    problem = PairingProblem.from_names(names, never_constraints=[["Alice", "Eve"]])
+    forbidden = problem.forbidden_matrix()
+    assert forbidden.shape == (4, 4)
+    assert forbidden.sum() == 5
+    assert forbidden[0, 2]
+    assert all(forbidden[i, i] for i in range(4))
+
+
+def test_assignment_to_dict():
+    names = ["Alice", "Bob", "Eve"]
+    problem = PairingProblem.from_names(names, always_constraints=[["Alice", "Bob"]])
+    # Bob -> Eve, Eve -> Alice
+    assignment = problem.assignment([1, 0])
+    assert list(assignment.receiver_of) == [1, 2, 0]
+    assert assignment.to_dict() == {"Alice": "Bob", "Bob": "Eve", "Eve": "Alice"}
+
+
+def test_forbidden_sets_with_groups():
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    problem = PairingProblem.from_names(
+        names,
+        never_constraints=[["Alice", "Mallory"]],
+        groups={"Alice": "Smith", "Bob": "Smith", "Eve": "Jones"},
+    )
+    forbidden = problem.forbidden_sets()
+    assert isinstance(forbidden[0], GroupExclusions)
+    assert forbidden[0] == {0, 1, 3}
+    assert 1 in forbidden[0] and 2 not in forbidden[0]
+    assert len(forbidden[0]) == 3
+    assert forbidden[1] == {0, 1}
+    assert forbidden[2] == {2}
+    # Mallory is not in a group
+    assert forbidden[3] == {3}
+    assert not isinstance(forbidden[3], GroupExclusions)
+    assert forbidden[0] | {2} == {0, 1, 2, 3}
+
+
+def test_forbidden_matrix_with_groups():
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    problem = PairingProblem.from_names(
+        names,
+        always_constraints=[["Eve", "Mallory"]],
+        groups={"Alice": "Smith", "Bob": "Smith"},
+    )
+    forbidden = problem.forbidden_matrix()
+    # Mallory only receives from Eve, so Mallory may give to any free receiver
+    expected = [[True, True, False], [True, True, False], [False, False, False]]
+    assert forbidden.tolist() == expected
+
+
+def test_always_chains():
+    names = ["Alice", "Bob", "Eve", "Mallory", "Trent", "Peggy"]
+    problem = PairingProblem.from_names(
+        names,
+        always_constraints=[
+            ["Alice", "Bob"],
+            ["Mallory", "Trent"],
+            ["Bob", "Eve"],
+            ["Trent", "Mallory"],
+        ],
+    )
+    chains, cycles = problem.always_chains()
+    assert chains == [[0, 1, 2]]
+    assert cycles == [[3, 4]]
+    # the chain is contracted: only Eve gives and only Alice receives, and the cycle is gone
+    assert list(problem.givers) == [2, 5]
+    assert list(problem.receivers) == [0, 5]
@@ -0,0 +1,43 @@
+from secret_santa import secret_santa
+from secret_santa.parallel import parallel_search, run_stream
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def test_parallel_search_matches_serial():
+    n = 30
+    forbidden = [{g, (g + 1) % n} for g in range(n)]
+    found = parallel_search(
+        forbidden, SEED, num_streams=4, max_nodes=None, max_workers=2
+    )
+    assert found is not None
+    stream, assignment = found
+    assert stream == 0
+    assert assignment == run_stream(forbidden, SEED, 0, None)
+
+
+def test_parallel_search_skips_failed_streams():
+    n = 30
+    forbidden = [{g} for g in range(n)]
+    # a budget too small for any stream to succeed
+    assert (
+        parallel_search(forbidden, SEED, num_streams=3, max_nodes=5, max_workers=2)
+        is None
+    )
+
+
+def test_secret_santa_hat_workers_are_deterministic():
+    names = _get_random_names(40)
+    never_constraints = [[names[i], names[i + 1]] for i in range(len(names) - 1)]
+    serial = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, method="search"
+    )
+    for workers in [2, 3]:
+        pairings = secret_santa.secret_santa_hat(
+            names,
+            SEED,
+            never_constraints=never_constraints,
+            method="search",
+            workers=workers,
+        )
+        assert pairings == serial
@@ -0,0 +1,132 @@
+import itertools
+import math
+import random
+
+import numpy as np
+
+from secret_santa import secret_santa
+from secret_santa.model import PairingProblem
+from secret_santa.permanent import count_assignments, estimate_count, exact_count
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def _brute_force_count(forbidden: list[set[int]]) -> int:
+    n = len(forbidden)
+    return sum(
+        all(r not in excluded for r, excluded in zip(perm, forbidden))
+        for perm in itertools.permutations(range(n))
+    )
+
+
+def test_exact_count():
+    rng = random.Random(SEED)
+    for _ in range(50):
+        n = rng.randint(0, 7)
+        forbidden = [{g} for g in range(n)]
+        for _ in range(rng.randint(0, n * n)):
+            forbidden[rng.randrange(n)].add(rng.randrange(n))
+        expected = _brute_force_count(forbidden)
+        assert exact_count(forbidden) == expected
+        # a state budget that forces the other dynamic program or nothing at all
+        assert exact_count(forbidden, max_states=2) in (expected, None)
+
+
+def test_exact_count_derangements():
+    # D(n) = n D(n - 1) + (-1)^n
+    derangements = [1]
+    for n in range(1, 1001):
+        derangements.append(n * derangements[-1] + (-1) ** n)
+    for n in (0, 1, 2, 5, 20, 1000):
+        assert exact_count([{g} for g in range(n)]) == derangements[n]
+
+
+def test_exact_count_sparse():
+    # mostly components of a single cell, which are counted in closed form
+    rng = random.Random(SEED)
+    for _ in range(50):
+        n = rng.randint(1, 7)
+        forbidden = [{g} if rng.random() < 0.7 else set() for g in range(n)]
+        for _ in range(rng.randint(0, 3)):
+            forbidden[rng.randrange(n)].add(rng.randrange(n))
+        assert exact_count(forbidden) == _brute_force_count(forbidden)
+
+
+def test_count_large():
+    n = 1000
+    households = [{g} | {g ^ 1} if g < 100 else {g} for g in range(n)]
+    exact = exact_count(households)
+    assert exact is not None
+    log_count, relative_error = estimate_count(
+        households, np.random.default_rng(SEED), num_samples=64
+    )
+    assert abs(log_count - math.log(exact)) < 5 * relative_error
+    # too many bits to count exactly
+    n = 20_000
+    count = count_assignments(
+        [{g} for g in range(n)], np.random.default_rng(SEED), num_samples=8
+    )
+    assert count.exact is None
+    assert abs(count.log_count - (math.lgamma(n + 1) - 1)) < 0.01
+    problem = PairingProblem.from_names([str(i) for i in range(n)])
+    assert secret_santa._choose_method(problem, random.Random(SEED), None) == (
+        "matching"
+    )
+
+
+def test_estimate_count():
+    n = 12
+    forbidden = [{g, (g + 1) % n, (g + 5) % n} for g in range(n)]
+    exact = exact_count(forbidden)
+    assert exact is not None
+    log_count, relative_error = estimate_count(
+        forbidden, np.random.default_rng(SEED), num_samples=5000
+    )
+    assert relative_error < 0.05
+    assert abs(math.exp(log_count) / exact - 1) < 5 * relative_error
+    # no valid assignment at all
+    assert estimate_count([{0, 1}, set()], np.random.default_rng(SEED))[0] == -math.inf
+
+
+def test_count_assignments_estimated():
+    rng = random.Random(SEED)
+    n = 200
+    forbidden = [{g} | {rng.randrange(n) for _ in range(n // 2)} for g in range(n)]
+    count = count_assignments(forbidden, np.random.default_rng(SEED), max_states=1000)
+    assert count.exact is None
+    assert count.log_count < math.lgamma(n + 1)
+
+
+def test_count_assignments_names():
+    names = _get_random_names(6)
+    groups = {names[0]: "a", names[1]: "a"}
+    never_constraints = [[names[2], names[3]]]
+    count = secret_santa.count_assignments(
+        names, never_constraints=never_constraints, groups=groups
+    )
+    problem = PairingProblem.from_names(names, None, never_constraints, groups)
+    assert count.exact == _brute_force_count(list(problem.forbidden_sets()))
+    assert count.relative_error == 0.0
+
+
+def test_auto_method():
+    rng = random.Random(SEED)
+    names = _get_random_names(30)
+    problem = PairingProblem.from_names(names)
+    assert secret_santa._choose_method(problem, rng, None) == "vectorized"
+    assert secret_santa._choose_method(problem, rng, {(names[0], names[1]): 1.0}) == (
+        "matching"
+    )
+    # everyone may only give to the next 3 people
+    never_constraints = [
+        [giver, receiver]
+        for i, giver in enumerate(names)
+        for j, receiver in enumerate(names)
+        if (j - i) % 30 > 3
+    ]
+    problem = PairingProblem.from_names(names, never_constraints=never_constraints)
+    assert secret_santa._choose_method(problem, rng, None) == "matching"
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, method="auto"
+    )
+    assert secret_santa.check_never_constraints(pairings, never_constraints)
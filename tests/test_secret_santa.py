@@ -1,3 +1,4 @@
+import itertools
 import json
 import os
 import random
@@ -170,3 +171,419 @@ def test_sanity_check_pairings_fail_double_receiver():
     names = ["Alice", "Bob", "Eve"]
     with pytest.raises(AssertionError):
         secret_santa.sanity_check_pairings(pairings, names)
+
+
+def test_secret_santa_hat_single_valid_assignment():
+    """Only one assignment satisfies these constraints: everyone gives to the next person"""
+    names = _get_random_names(12)
+    never_constraints = []
+    for i, giver in enumerate(names):
+        for j, receiver in enumerate(names):
+            if j != (i + 1) % len(names) and i != j:
+                never_constraints.append([giver, receiver])
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints
+    )
+    for i, giver in enumerate(names):
+        assert pairings[giver] == names[(i + 1) % len(names)]
+
+
+def test_secret_santa_hat_infeasible():
+    names = ["Alice", "Bob", "Eve"]
+    never_constraints = [["Alice", "Bob"], ["Alice", "Eve"]]
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(names, SEED, never_constraints=never_constraints)
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_secret_santa_hat_never_constraint_unknown_name(method: str):
+    # e.g. someone who has left since the constraints were written
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    never_constraints = [["Alice", "Trent"], ["Trent", "Bob"], ["Alice", "Bob"]]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, method=method
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert pairings["Alice"] != "Bob"
+
+
+def test_secret_santa_hat_large():
+    names = _get_random_names(20000)
+    never_constraints = [[names[i], names[i + 1]] for i in range(len(names) - 1)]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints
+    )
+    assert set(pairings.keys()) == set(names)
+    assert set(pairings.values()) == set(names)
+    assert all(giver != receiver for giver, receiver in pairings.items())
+    assert secret_santa.check_never_constraints(pairings, never_constraints)
+
+
+def test_secret_santa_hat_is_reproducible():
+    names = _get_random_names(50)
+    never_constraints = [[names[0], names[1]], [names[2], names[3]]]
+    d1 = secret_santa.secret_santa_hat(names, SEED, never_constraints=never_constraints)
+    d2 = secret_santa.secret_santa_hat(names, SEED, never_constraints=never_constraints)
+    assert d1 == d2
+
+
+def test_secret_santa_hat_search_method():
+    names = _get_random_names(10)
+    always_constraints = [[names[0], names[1]]]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, always_constraints, method="search"
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert pairings[names[0]] == names[1]
+
+
+def test_secret_santa_search_never_constraints():
+    names = _get_random_names(6)
+    # only possible assignment is the cycle 1 -> 2 -> ... -> 6 -> 1
+    never_constraints = [
+        [g, r]
+        for i, g in enumerate(names)
+        for j, r in enumerate(names)
+        if i != j and j != (i + 1) % len(names)
+    ]
+    pairings: dict[str, str] = {}
+    assert secret_santa.secret_santa_search(
+        pairings, names[:], names[:], never_constraints
+    )
+    for i, giver in enumerate(names):
+        assert pairings[giver] == names[(i + 1) % len(names)]
+
+
+def test_secret_santa_search_infeasible():
+    names = ["Alice", "Bob", "Eve"]
+    never_constraints = [["Alice", "Bob"], ["Eve", "Bob"]]
+    pairings: dict[str, str] = {}
+    assert not secret_santa.secret_santa_search(
+        pairings, names[:], names[:], never_constraints
+    )
+
+
+def test_secret_santa_search_no_recursion_limit():
+    names = _get_random_names(3000)
+    pairings: dict[str, str] = {}
+    assert secret_santa.secret_santa_search(pairings, names[:], names[:])
+    assert set(pairings.values()) == set(names)
+    assert all(giver != receiver for giver, receiver in pairings.items())
+
+
+def test_secret_santa_search_matches_brute_force():
+    rng = random.Random(SEED)
+    for _ in range(200):
+        names = _get_random_names(rng.randint(2, 6))
+        never_constraints = [
+            [g, r] for g in names for r in names if g != r and rng.random() < 0.4
+        ]
+        never = {tuple(pair) for pair in never_constraints}
+        feasible = any(
+            all(g != r and (g, r) not in never for g, r in zip(names, receivers))
+            for receivers in itertools.permutations(names)
+        )
+        pairings: dict[str, str] = {}
+        assert (
+            secret_santa.secret_santa_search(
+                pairings, names[:], names[:], never_constraints
+            )
+            == feasible
+        )
+        if feasible:
+            secret_santa.sanity_check_pairings(
+                pairings, names, never_constraints=never_constraints
+            )
+
+
+def test_secret_santa_search_sparse_never_constraints_large():
+    # a few 'never' constraints per giver used to make every step look at every giver
+    names = _get_random_names(3000)
+    rng = random.Random(SEED)
+    never_constraints = [[g, r] for g in names for r in rng.sample(names, 2) if g != r]
+    pairings: dict[str, str] = {}
+    assert secret_santa.secret_santa_search(
+        pairings, names[:], names[:], never_constraints
+    )
+    secret_santa.sanity_check_pairings(
+        pairings, names, never_constraints=never_constraints
+    )
+
+
+def test_secret_santa_hat_simple_direct():
+    names = _get_random_names(50)
+    random.seed(SEED)
+    d1 = secret_santa.secret_santa_hat_simple(names, method="direct")
+    assert sorted(d1.keys()) == sorted(names)
+    assert sorted(d1.values()) == sorted(names)
+    assert all(giver != receiver for giver, receiver in d1.items())
+    random.seed(SEED)
+    d2 = secret_santa.secret_santa_hat_simple(names, method="direct")
+    assert d1 == d2
+
+
+def test_get_uniform_derangement_is_uniform():
+    """There are 9 derangements of 4 items, which should come up equally often"""
+    rng = random.Random(SEED)
+    counts: dict[tuple, int] = {}
+    num_samples = 9000
+    for _ in range(num_samples):
+        d = tuple(secret_santa.get_uniform_derangement([0, 1, 2, 3], rng))
+        counts[d] = counts.get(d, 0) + 1
+    assert len(counts) == 9
+    for count in counts.values():
+        assert abs(count - num_samples / 9) < 150
+
+
+def test_secret_santa_hat_vectorized():
+    names = _get_random_names(20)
+    always_constraints = [[names[0], names[1]]]
+    never_constraints = [[names[2], names[3]], [names[3], names[2]]]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, always_constraints, never_constraints, method="vectorized"
+    )
+    assert pairings[names[0]] == names[1]
+    assert secret_santa.check_never_constraints(pairings, never_constraints)
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert pairings == secret_santa.secret_santa_hat(
+        names, SEED, always_constraints, never_constraints, method="vectorized"
+    )
+
+
+def test_secret_santa_hat_does_not_touch_global_random():
+    names = _get_random_names(20)
+    random.seed(SEED)
+    expected = random.random()
+    random.seed(SEED)
+    secret_santa.secret_santa_hat(names, SEED)
+    assert random.random() == expected
+
+
+def test_secret_santa_hat_concurrent_calls():
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = _get_random_names(200)
+    never_constraints = [[names[i], names[i + 1]] for i in range(len(names) - 1)]
+    seeds = list(range(1, 33))
+    expected = [
+        secret_santa.secret_santa_hat(names, seed, never_constraints=never_constraints)
+        for seed in seeds
+    ]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(
+            pool.map(
+                lambda seed: secret_santa.secret_santa_hat(
+                    names, seed, never_constraints=never_constraints
+                ),
+                seeds,
+            )
+        )
+    assert results == expected
+
+
+def test_secret_santa_hat_simple_with_rng():
+    names = _get_random_names(50)
+    for method in secret_santa.DERANGEMENT_METHODS:
+        d1 = secret_santa.secret_santa_hat_simple(names, method, random.Random(SEED))
+        d2 = secret_santa.secret_santa_hat_simple(names, method, random.Random(SEED))
+        assert d1 == d2
+
+
+def test_history_penalties():
+    history = [{"Alice": "Bob", "Bob": "Alice"}, {"Alice": "Bob", "Bob": "Eve"}]
+    penalties = secret_santa.history_penalties(history, decay=0.5)
+    assert penalties == {
+        ("Alice", "Bob"): 1.5,
+        ("Bob", "Alice"): 1.0,
+        ("Bob", "Eve"): 0.5,
+    }
+    # a campaign with several gifts per giver lists all of their receivers
+    history = [{"Alice": ["Bob", "Eve"]}, {"Alice": "Eve"}]
+    penalties = secret_santa.history_penalties(history, decay=0.5)
+    assert penalties == {("Alice", "Bob"): 1.0, ("Alice", "Eve"): 1.5}
+
+
+def test_secret_santa_hat_avoids_history():
+    names = _get_random_names(30)
+    history = [
+        secret_santa.secret_santa_hat(names, seed) for seed in range(SEED, SEED + 5)
+    ]
+    penalties = secret_santa.history_penalties(history)
+    pairings = secret_santa.secret_santa_hat(names, SEED, penalties=penalties)
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert all(pair not in penalties for pair in pairings.items())
+
+
+def test_secret_santa_hat_history_prefers_older_repeats():
+    # with 3 people there are only 2 assignments, and both have been drawn before
+    names = ["Alice", "Bob", "Eve"]
+    recent = {"Alice": "Bob", "Bob": "Eve", "Eve": "Alice"}
+    older = {"Alice": "Eve", "Eve": "Bob", "Bob": "Alice"}
+    penalties = secret_santa.history_penalties([recent, older])
+    assert secret_santa.secret_santa_hat(names, SEED, penalties=penalties) == older
+
+
+def _check_multi_pairings(pairings: dict[str, list[str]], names: list[str], k: int):
+    assert set(pairings) == set(names)
+    received: dict[str, int] = {name: 0 for name in names}
+    for giver, receivers in pairings.items():
+        assert len(receivers) == k
+        assert len(set(receivers)) == k
+        assert giver not in receivers
+        for receiver in receivers:
+            received[receiver] += 1
+    assert all(count == k for count in received.values())
+
+
+def test_secret_santa_hat_multi():
+    names = _get_random_names(40)
+    always_constraints = [[names[0], names[1]]]
+    never_constraints = [[names[i], names[i + 1]] for i in range(1, len(names) - 1)]
+    pairings = secret_santa.secret_santa_hat_multi(
+        names,
+        SEED,
+        3,
+        always_constraints=always_constraints,
+        never_constraints=never_constraints,
+    )
+    _check_multi_pairings(pairings, names, 3)
+    assert pairings[names[0]][0] == names[1]
+    for giver, receiver in never_constraints:
+        assert receiver not in pairings[giver]
+    assert pairings == secret_santa.secret_santa_hat_multi(
+        names,
+        SEED,
+        3,
+        always_constraints=always_constraints,
+        never_constraints=never_constraints,
+    )
+
+
+def test_secret_santa_hat_multi_everyone():
+    # every giver gives to every other participant
+    names = _get_random_names(6)
+    pairings = secret_santa.secret_santa_hat_multi(names, SEED, len(names) - 1)
+    _check_multi_pairings(pairings, names, len(names) - 1)
+
+
+def test_secret_santa_hat_multi_large():
+    names = _get_random_names(3000)
+    pairings = secret_santa.secret_santa_hat_multi(names, SEED, 3)
+    _check_multi_pairings(pairings, names, 3)
+
+
+def _households(names: list[str], size: int) -> dict[str, str]:
+    return {name: f"household {i // size}" for i, name in enumerate(names)}
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_secret_santa_hat_groups(method: str):
+    names = _get_random_names(30)
+    groups = _households(names, 3)
+    pairings = secret_santa.secret_santa_hat(names, SEED, method=method, groups=groups)
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert secret_santa.check_group_constraints(pairings, groups)
+
+
+def test_secret_santa_hat_groups_infeasible():
+    names = _get_random_names(5)
+    # 3 members of one group can only give to the other 2 people
+    groups = {name: "big family" for name in names[:3]}
+    assert secret_santa.find_infeasibility(names, groups=groups) is not None
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(names, SEED, groups=groups)
+
+
+def test_secret_santa_hat_always_within_group():
+    names = _get_random_names(6)
+    groups = _households(names, 2)
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(
+            names, SEED, always_constraints=[names[:2]], groups=groups
+        )
+
+
+def test_secret_santa_hat_multi_groups():
+    names = _get_random_names(40)
+    groups = _households(names, 4)
+    pairings = secret_santa.secret_santa_hat_multi(names, SEED, 3, groups=groups)
+    _check_multi_pairings(pairings, names, 3)
+    for giver, receivers in pairings.items():
+        assert all(groups[giver] != groups[receiver] for receiver in receivers)
+
+
+def test_repair_pairings_drop_out():
+    names = _get_random_names(30)
+    previous = secret_santa.secret_santa_hat(names, SEED)
+    giver_of = {r: g for g, r in previous.items()}
+    # someone who is not in a 2-cycle, so that their giver can take over their receiver
+    dropped = next(name for name in names if giver_of[name] != previous[name])
+    giver = giver_of[dropped]
+    remaining = [name for name in names if name != dropped]
+    pairings, changed = secret_santa.repair_pairings(previous, remaining, SEED)
+    secret_santa.sanity_check_pairings(pairings, remaining[:])
+    assert changed == [giver]
+    assert pairings[giver] == previous[dropped]
+
+
+def test_repair_pairings_new_participant():
+    names = _get_random_names(30)
+    previous = secret_santa.secret_santa_hat(names, SEED)
+    pairings, changed = secret_santa.repair_pairings(
+        previous, names + ["Newcomer"], SEED
+    )
+    secret_santa.sanity_check_pairings(pairings, names + ["Newcomer"])
+    assert len(changed) == 2
+    assert "Newcomer" in changed
+
+
+def test_repair_pairings_new_constraint():
+    names = _get_random_names(30)
+    previous = secret_santa.secret_santa_hat(names, SEED)
+    never_constraints = [[names[0], previous[names[0]]]]
+    pairings, changed = secret_santa.repair_pairings(
+        previous, names, SEED, never_constraints=never_constraints
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert secret_santa.check_never_constraints(pairings, never_constraints)
+    assert names[0] in changed
+    assert all(pairings[g] == previous[g] for g in names if g not in changed)
+
+
+@pytest.mark.parametrize(
+    "always_constraints",
+    [
+        [["Alice", "Alice"]],
+        [["Alice", "Bob"], ["Alice", "Eve"]],
+        [["Alice", "Eve"], ["Bob", "Eve"]],
+    ],
+)
+def test_secret_santa_hat_conflicting_always_constraints(always_constraints):
+    names = ["Alice", "Bob", "Eve", "Mallory"]
+    with pytest.raises(SystemExit):
+        secret_santa.secret_santa_hat(
+            names, SEED, always_constraints=always_constraints
+        )
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_secret_santa_hat_always_chains(method: str):
+    names = _get_random_names(20)
+    # a chain through the first 10 people, and a closed cycle through the next 4
+    always_constraints = [[names[i], names[i + 1]] for i in range(9)]
+    always_constraints += [[names[10 + i], names[10 + (i + 1) % 4]] for i in range(4)]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, always_constraints=always_constraints, method=method
+    )
+    secret_santa.sanity_check_pairings(pairings, names[:])
+    assert secret_santa.check_always_constraints(pairings, always_constraints)
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_secret_santa_hat_only_always_constraints(method: str):
+    names = _get_random_names(5)
+    always_constraints = [[names[i], names[(i + 1) % 5]] for i in range(5)]
+    pairings = secret_santa.secret_santa_hat(
+        names, SEED, always_constraints=always_constraints, method=method
+    )
+    assert pairings == dict(always_constraints)
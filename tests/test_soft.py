@@ -0,0 +1,98 @@
+import itertools
+import random
+import time
+
+from secret_santa import secret_santa
+from secret_santa.secret_santa import SoftConstraint
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def _brute_force_penalty(names, soft_never, prefer):
+    best = None
+    for perm in itertools.permutations(names):
+        pairings = dict(zip(names, perm))
+        if any(giver == receiver for giver, receiver in pairings.items()):
+            continue
+        penalty = sum(w for g, r, w in soft_never if pairings[g] == r)
+        penalty += sum(w for g, r, w in prefer if pairings[g] != r)
+        if best is None or penalty < best:
+            best = penalty
+    return best
+
+
+def test_soft_is_optimal():
+    rng = random.Random(SEED)
+    for _ in range(100):
+        names = _get_random_names(rng.randint(2, 6))
+        soft_never = [
+            [g, r, rng.choice([1, 2, 5])]
+            for g in names
+            for r in names
+            if g != r and rng.random() < 0.4
+        ]
+        prefer = [
+            [g, r, rng.choice([1, 3])]
+            for g in names
+            for r in names
+            if g != r and rng.random() < 0.25
+        ]
+        result = secret_santa.secret_santa_hat_soft(
+            names, SEED, soft_never=soft_never, prefer=prefer, rng=rng
+        )
+        secret_santa.sanity_check_pairings(result.pairings, names[:])
+        assert result.penalty == _brute_force_penalty(names, soft_never, prefer)
+
+
+def test_soft_prefer():
+    names = _get_random_names(20)
+    prefer = [[names[i], names[(i + 7) % 20], 1] for i in range(0, 20, 2)]
+    result = secret_santa.secret_santa_hat_soft(names, SEED, prefer=prefer)
+    secret_santa.sanity_check_pairings(result.pairings, names[:])
+    # all of the preferences can be satisfied at once
+    assert result.violated_prefer == []
+    assert result.penalty == 0
+
+
+def test_soft_over_constrained():
+    names = ["Alice", "Bob", "Eve"]
+    # Alice would give to nobody
+    soft_never = [["Alice", "Bob", 1], ["Alice", "Eve", 3]]
+    result = secret_santa.secret_santa_hat_soft(
+        names, SEED, soft_never=soft_never, prefer=[["Bob", "Alice", 0.5]]
+    )
+    assert result.pairings["Alice"] == "Bob"
+    assert result.violated_never == [SoftConstraint("Alice", "Bob", 1.0)]
+    assert result.penalty == _brute_force_penalty(
+        names, [[g, r, w] for g, r, w in soft_never], [["Bob", "Alice", 0.5]]
+    )
+
+
+def test_soft_deadline():
+    names = _get_random_names(500)
+    soft_never = [[names[i], names[(i + 1) % 500]] for i in range(500)]
+    prefer = [[names[i], names[(i + 2) % 500]] for i in range(0, 500, 3)]
+    result = secret_santa.secret_santa_hat_soft(
+        names,
+        SEED,
+        never_constraints=[[names[0], names[1]]],
+        soft_never=soft_never,
+        prefer=prefer,
+        deadline_ms=0,
+    )
+    secret_santa.sanity_check_pairings(result.pairings, names[:])
+    assert result.pairings[names[0]] != names[1]
+
+
+def test_soft_deadline_stops_the_solve():
+    names = _get_random_names(3000)
+    rng = random.Random(SEED)
+    soft_never = [[g, r] for g in names for r in rng.sample(names, 3) if g != r]
+    prefer = [[g, r] for g in names for r in rng.sample(names, 1) if g != r]
+    start = time.monotonic()
+    result = secret_santa.secret_santa_hat_soft(
+        names, SEED, soft_never=soft_never, prefer=prefer, deadline_ms=50
+    )
+    # solving to the end takes several seconds
+    assert time.monotonic() - start < 3
+    secret_santa.sanity_check_pairings(result.pairings, names[:])
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from secret_santa import secret_santa
+from secret_santa.stats import CountingRandom, SolverStats
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def test_counting_random_matches_wrapped_rng():
+    stats = SolverStats()
+    counted = CountingRandom(random.Random(SEED), stats)
+    plain = random.Random(SEED)
+    items = list(range(50))
+    counted_items = items[:]
+    counted.shuffle(counted_items)
+    plain.shuffle(items)
+    assert counted_items == items
+    assert counted.random() == plain.random()
+    assert counted.randrange(1000) == plain.randrange(1000)
+    assert stats.rng_draws > 0
+
+
+@pytest.mark.parametrize("method", secret_santa.SOLVER_METHODS)
+def test_stats_do_not_change_pairings(method: str):
+    names = _get_random_names(30)
+    never_constraints = [[names[i], names[i + 1]] for i in range(len(names) - 1)]
+    stats = SolverStats()
+    with_stats = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, method=method, stats=stats
+    )
+    without_stats = secret_santa.secret_santa_hat(
+        names, SEED, never_constraints=never_constraints, method=method
+    )
+    assert with_stats == without_stats
+    assert stats.attempts >= 1
+    assert stats.constraint_checks > 0
+    assert set(stats.phase_seconds) == {"presolve", "solve", "postsolve"}
+
+
+def test_stats_search_counts_nodes():
+    names = _get_random_names(20)
+    stats = SolverStats()
+    secret_santa.secret_santa_hat(names, SEED, method="search", stats=stats)
+    assert stats.nodes_expanded >= len(names)
+    assert stats.rng_draws > 0
+
+
+def test_stats_merge():
+    a = SolverStats()
+    a.attempts = 2
+    a.phase_seconds["solve"] = 1.0
+    b = SolverStats()
+    b.attempts = 3
+    b.backtracks = 4
+    b.phase_seconds["solve"] = 0.5
+    a.merge(b)
+    assert a.as_dict() == {
+        "attempts": 5,
+        "backtracks": 4,
+        "nodes_expanded": 0,
+        "constraint_checks": 0,
+        "rng_draws": 0,
+        "phase_seconds": {"solve": 1.5},
+    }
@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import random
+
+import pytest
+
+from secret_santa import secret_santa
+from secret_santa.validation import (
+    check_problems,
+    iter_json_object,
+    validate_pairings,
+    validate_pairings_file,
+)
+
+from .test_secret_santa import SEED, _get_random_names
+
+
+def test_validate_pairings():
+    names = _get_random_names(20)
+    pairings = secret_santa.secret_santa_hat(names, SEED)
+    original = names[:]
+    assert validate_pairings(pairings.items(), names) == []
+    # the names are not sorted or changed
+    assert names == original
+
+    broken = dict(pairings)
+    giver = names[0]
+    broken[giver] = giver
+    problems = validate_pairings(broken.items(), names)
+    assert f"{giver} gives to themselves" in problems
+    assert any("receives more than once" in problem for problem in problems)
+    assert any("do not receive" in problem for problem in problems)
+
+    pairs = list(pairings.items()) + [("Stranger", names[0])]
+    problems = validate_pairings(pairs, names)
+    assert "Giver Stranger is not a participant" in problems
+    assert f"{names[0]} receives more than once" in problems
+
+
+def test_validate_pairings_constraints():
+    names = _get_random_names(10)
+    pairings = secret_santa.secret_santa_hat(names, SEED)
+    giver = names[3]
+    receiver = pairings[giver]
+    other = next(name for name in names if name not in (giver, receiver))
+    problems = validate_pairings(
+        pairings.items(),
+        names,
+        always_constraints=[[giver, other]],
+        never_constraints=[[giver, receiver]],
+        groups={giver: "family", receiver: "family"},
+    )
+    assert problems == [
+        f"{giver} -> {receiver} is a 'never' constraint",
+        f"{giver} must give to {other}, not {receiver}",
+        f"{giver} and {receiver} are both in group family",
+    ]
+    # the same checks as the solver
+    assert (
+        validate_pairings(
+            pairings.items(), names, always_constraints=[[giver, receiver]]
+        )
+        == []
+    )
+
+
+def test_validate_pairings_max_problems():
+    names = _get_random_names(50)
+    problems = validate_pairings(
+        ((name, name) for name in names), names, max_problems=5
+    )
+    assert len(problems) == 5
+
+
+def test_iter_json_object():
+    rng = random.Random(SEED)
+    for _ in range(20):
+        obj = {
+            f'key \\ " {i} é': rng.choice(
+                ["value", 12345678901234, -1.5e10, None, {"key": "a", "b": [1, 2]}]
+            )
+            for i in range(rng.randint(0, 30))
+        }
+        text = json.dumps(obj, indent=rng.choice([None, 4]))
+        for chunk_size in (1, 3, 1 << 16):
+            assert dict(iter_json_object(io.StringIO(text), chunk_size)) == obj
+
+
+def test_iter_json_object_invalid():
+    for text in [
+        "",
+        "[]",
+        '{"a": 1',
+        '{"a" 1}',
+        '{"a": 1,}',
+        "{1: 2}",
+        '{"a": 1} x',
+        "{} {}",
+    ]:
+        with pytest.raises(ValueError):
+            dict(iter_json_object(io.StringIO(text), chunk_size=2))
+
+
+def test_validate_pairings_file(tmp_path):
+    names = _get_random_names(30)
+    pairings = secret_santa.secret_santa_hat(names, SEED)
+    fname = os.path.join(tmp_path, "unencrypted_pairings.json")
+    with open(fname, "w") as fp:
+        json.dump(pairings, fp, sort_keys=True, indent=4)
+    assert validate_pairings_file(fname, names) == []
+    assert validate_pairings_file(fname, names[1:]) != []
+    check_problems(validate_pairings_file(fname, names))
+    with pytest.raises(AssertionError, match="Invalid pairings"):
+        check_problems(validate_pairings_file(fname, names[1:]))
+
+
+def test_sanity_check_pairings_constraints():
+    names = _get_random_names(10)
+    pairings = secret_santa.secret_santa_hat(names, SEED)
+    giver = names[0]
+    with pytest.raises(AssertionError, match="'never' constraint"):
+        secret_santa.sanity_check_pairings(
+            pairings, names, never_constraints=[[giver, pairings[giver]]]
+        )
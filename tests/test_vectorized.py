@@ -0,0 +1,34 @@
+import numpy as np
+
+from secret_santa import vectorized
+
+
+def test_valid_rows():
+    forbidden = np.eye(3, dtype=bool)
+    perms = np.array([[0, 1, 2], [1, 2, 0], [2, 0, 1], [1, 0, 2]])
+    assert vectorized.valid_rows(perms, forbidden).tolist() == [
+        False,
+        True,
+        True,
+        False,
+    ]
+
+
+def test_sample_assignments():
+    n = 30
+    forbidden = np.eye(n, dtype=bool)
+    forbidden[0, 1:] = True
+    forbidden[0, 5] = False
+    rng = np.random.default_rng(42)
+    samples = vectorized.sample_assignments(forbidden, 100, rng)
+    assert samples.shape == (100, n)
+    assert (samples[:, 0] == 5).all()
+    assert vectorized.valid_rows(samples, forbidden).all()
+    for row in samples:
+        assert sorted(row.tolist()) == list(range(n))
+
+
+def test_rejection_sample_gives_up():
+    forbidden = np.ones((3, 3), dtype=bool)
+    rng = np.random.default_rng(42)
+    assert vectorized.rejection_sample(forbidden, rng, max_batches=2) is None